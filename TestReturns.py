@@ -6,13 +6,23 @@ import tkinter.font as font
 from typing import List
 import pathlib
 import datetime
+import threading
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
 from otoTests import * 
+from otoResultsStore import ResultsStore, build_unit_row, import_eol_folder, HISTORY_COLUMNS
+from otoTraceStore import TraceStore
+from otoLatency import LatencyStats, LatencyServer
+from otoCancel import CancellationToken, StepCancelled
+from otoAttach import AttachWatcher
+from otoPorts import PortInventory
+import otoTimeline
+from otoTimeline import Timeline, span
 import ctypes
 import datetime
 import seaborn as sns  # for graphs
 import matplotlib
 import globalvars  # anyvariable/funtion you want globally available goes here
-import serial
 import pyoto.otoProtocol.otoCommands as pyoto
 matplotlib.use("Agg")  # needed to prevent multi-thread failures when using matplotlib
 from matplotlib import pyplot as plt
@@ -37,6 +47,18 @@ class MainWindow(tk.Tk):
     FIGSIZEX = 14  # width of chart window for a 1440 vertical pixel screen, to be scaled at the init stage
     FIGSIZEY = 8.5 # height of chart window, for a 1440 vertical pixel screen, to be scaled at the init stage
     DPI = 120  # scale based on monitor dots per inch
+    EOL_DATA_FOLDER = None  # folder of the EOL station CSV files to import original unit values from, None to skip
+    EOL_DATA_PATTERN = "*ProductionData*.csv"
+    TIMELINE = True  # saves a Chrome/Perfetto trace of where each unit's test time goes to <log folder>/Timeline, about 0.3 % of a unit's test time (benchmarkTimeline.py), set to False to turn it off
+    TIMELINE_MAX_BYTES = 100000000  # the oldest timeline files are deleted beyond this total size
+    LATENCY_STATS = True  # saves per command OtO latency histograms, bytes and timeouts of each unit to <log folder>/Latency
+    LATENCY_MAX_BYTES = 20000000  # the oldest latency files are deleted beyond this total size
+    LATENCY_PORT = 8765  # serves the latency statistics as JSON on http://127.0.0.1:8765/, None to turn off
+    ATTACH_WATCHER = True  # pings the OtO between runs and reads a newly attached unit's identity and cloud unit name before START
+                                  # Off until PyOtO is confirmed to keep a polled get_sensors() reply and wait_for_complete moves apart from subscribed sensor packets
+    CAPTURE_SESSIONS = False  # set to True to record every OtO, GPIO and I2C call of each run to <log folder>/Sessions for otoReplay
+    TRACE_STORE = False  # set to True to append raw sensor traces to the binary trace store in <log folder>/Traces instead of one CSV file per step
+    POWER_TRACE = False  # set to True to sample the EOL board LTC2945 through the whole test and save per step energy and peak current
     
     def __init__(self):
         tk.Tk.__init__(self)
@@ -48,27 +70,30 @@ class MainWindow(tk.Tk):
 
         self.device_list = TestPeripherals(parent = self)
         self.test_suite = TestSuite(name = f"OtO Unit Return Function Test {self.ProgramVersion}",
-                            test_list=[
-                                GetUnitName(name = "Unit Name Check", parent = self),
-                                TestBattery(name = "Check Battery", parent = self),
-                                TestExternalPower(name = "Check OtO Charging", parent = self),
-                                TestPump(name = "Test Pump 1", target_pump = 1, target_pump_duty = 100, parent = self),
-                                TestPump(name = "Test Pump 2", target_pump = 2, target_pump_duty = 100, parent = self),
-                                TestPump(name = "Test Pump 3", target_pump = 3, target_pump_duty = 100, parent = self),
-                                SendNozzleHome(name = "Send Nozzle Home", parent = self),
-                                PressureCheck(name = "Zero Pressure Check", data_collection_time = 2.1, class_function= "EOL" , valve_target = None, parent = self),
-                                ValveCalibration(name = "Valve Calibration Comparison", parent = self, reset = True),
-                                VerifyValveOffsetTarget(name = "Verify Valve Closes", parent = self),
-                                TestMoesFullyOpen(name = "Fully Open Position Test", parent = self),
-                                NozzleRotationTestWithSubscribe(name = "Nozzle Rotation Test", parent = self),
-                                CheckVacSwitch(name = "Holds Pump Vacuum", parent = self),
-                                TestSolar(name = "Check Solar Panel", parent = self)
-                                ],  
+                            test_list = create_test_list(parent = self),
                             test_devices = self.device_list,
                             test_type = "EOL")
         
-        self.csv_file_name:pathlib.Path = None
+        self.results_file_name:pathlib.Path = None
+        self.results_store: ResultsStore = None
+        self.trace_store: TraceStore = None
+        self.eol_import_thread: threading.Thread = None
+        self.latency_stats: LatencyStats = None  # unit being tested
+        self.latency_totals = LatencyStats()  # every unit since the program started
+        self.latency_server: LatencyServer = None
+        if self.LATENCY_STATS and self.LATENCY_PORT is not None:
+            try:
+                self.latency_server = LatencyServer(self.latency_snapshot, port = self.LATENCY_PORT)
+            except OSError as e:
+                print(f"Couldn't start the latency stats server on port {self.LATENCY_PORT}: {e}")
         self.log_file_directory: pathlib.Path = None
+        self.port_inventory = PortInventory()  # USBCheck answers from it instead of scanning the ports
+        self.port_inventory.start()
+        self.attach_watcher: AttachWatcher = None
+        if self.ATTACH_WATCHER:
+            self.attach_watcher = AttachWatcher(open_interface = lambda: pyoto.OtoInterface(pyoto.ConnectionType.UART, logger = None), lookup = self.prefetch_unit_name,
+                                                find_port = lambda: self.port_inventory.oto_port()[0])
+            self.attach_watcher.start()
 
         # Fixed Window Elements
         self.status_font = font.Font(family = "Microsoft YaHei UI", size = int(28 * self.SCALEFACTOR), weight = "normal")
@@ -86,6 +111,7 @@ class MainWindow(tk.Tk):
 
         # Program Variables
         self.abort_test_bool: bool = False
+        self.cancel_token = CancellationToken(pump = self.update)  # lets STOP reach the loops inside a running step
         self.test_result_list: List[TestResult] = []
         self.test_start_time: float = 0.0
 
@@ -119,6 +145,7 @@ class MainWindow(tk.Tk):
         "Function to STOP test"
         self.one_button_to_rule_them_all["state"] = "disabled"
         self.abort_test_bool = True
+        self.cancel_token.cancel()
         self.one_button_to_rule_them_all.update()
 
     def clear_plot(self):
@@ -138,43 +165,50 @@ class MainWindow(tk.Tk):
             self.status_labels.append(temp)
             temp.grid(row = row_no, column = column_no, sticky = "EW", padx = int(40 * self.SCALEFACTOR), pady = int(4 * self.SCALEFACTOR))
 
-    def create_plot(self, window, plottype: str, xaxis, yaxis, size, name, clear, xtitle = None, ytitle = None):
-        """creates a plot of type histogram, line, or polar in the plot frame"""
-        self.clear_plot()
-        plotit = False
-        if plottype == "histplot":
-            figure = plt.figure(0, figsize = (self.FIGSIZEX, self.FIGSIZEY), dpi = self.DPI)
-            sns.histplot(data = xaxis)
-            plt.title(name)
-            plt.xlabel(xtitle)
-            plotit = True
-        elif plottype == "fohistplot":
-            figure = plt.figure(2, figsize = (self.FIGSIZEX, self.FIGSIZEY), dpi = self.DPI)
-            sns.histplot(data = xaxis)
-            plt.title(name)
-            plt.xlabel(xtitle)
-            plotit = True
-        elif plottype == "lineplot":
-            figure = plt.figure(1, figsize = (self.FIGSIZEX, self.FIGSIZEY), dpi = self.DPI)
-            if size > 10:
-                sns.scatterplot(x = xaxis, y = yaxis, marker = "o", s = size)
-            else:
-                sns.lineplot(x = xaxis, y = yaxis)
-            plt.title(name)
-            plt.xlabel(xtitle)
-            plt.ylabel(ytitle)
-            plotit = True
-        elif plottype == "polar":
-            figure = plt.figure(3, figsize = (self.FIGSIZEX, self.FIGSIZEY), dpi = self.DPI)
-            plt.polar(xaxis, yaxis, "r")
-            plt.title(name)
-            plotit = True
-        if plotit:
-            canvas = FigureCanvasTkAgg(figure, master = window)
-            canvas.get_tk_widget().grid()
-            self.GraphHolder.update()
-            if clear:
-                plt.close()
+    def create_plot(self, window, plottype: str, xaxis, yaxis, size, name, clear, xtitle = None, ytitle = None, weights = None):
+        """creates a plot of type histogram, line, or polar in the plot frame, histograms take bin centers in xaxis and counts in weights if they were binned already"""
+        with span(f"Plot {name}", "plot"):
+            self.clear_plot()
+            plotit = False
+            if plottype == "histplot":
+                figure = plt.figure(0, figsize = (self.FIGSIZEX, self.FIGSIZEY), dpi = self.DPI)
+                if weights is None:
+                    sns.histplot(data = xaxis)
+                else:
+                    sns.histplot(x = xaxis, weights = weights, bins = len(xaxis))
+                plt.title(name)
+                plt.xlabel(xtitle)
+                plotit = True
+            elif plottype == "fohistplot":
+                figure = plt.figure(2, figsize = (self.FIGSIZEX, self.FIGSIZEY), dpi = self.DPI)
+                if weights is None:
+                    sns.histplot(data = xaxis)
+                else:
+                    sns.histplot(x = xaxis, weights = weights, bins = len(xaxis))
+                plt.title(name)
+                plt.xlabel(xtitle)
+                plotit = True
+            elif plottype == "lineplot":
+                figure = plt.figure(1, figsize = (self.FIGSIZEX, self.FIGSIZEY), dpi = self.DPI)
+                if size > 10:
+                    sns.scatterplot(x = xaxis, y = yaxis, marker = "o", s = size)
+                else:
+                    sns.lineplot(x = xaxis, y = yaxis)
+                plt.title(name)
+                plt.xlabel(xtitle)
+                plt.ylabel(ytitle)
+                plotit = True
+            elif plottype == "polar":
+                figure = plt.figure(3, figsize = (self.FIGSIZEX, self.FIGSIZEY), dpi = self.DPI)
+                plt.polar(xaxis, yaxis, "r")
+                plt.title(name)
+                plotit = True
+            if plotit:
+                canvas = FigureCanvasTkAgg(figure, master = window)
+                canvas.get_tk_widget().grid()
+                self.GraphHolder.update()
+                if clear:
+                    plt.close()
 
     def eol_pcb_init(self):
         """turns all EOL board pins off"""
@@ -193,10 +227,24 @@ class MainWindow(tk.Tk):
         if is_testing == True:
             test_folder = "Test Folder"
             self.log_file_directory = (pathlib.Path(self.log_file_directory) /  test_folder)
-            filename = "-TestProductionData" + str(time.strftime("%y", time.localtime())) + format(datetime.datetime.now().isocalendar()[1],"02d") + ".csv"
+            filename = "-TestProductionData" + str(time.strftime("%y", time.localtime())) + format(datetime.datetime.now().isocalendar()[1],"02d") + ".db"
+            legacy_filename = pathlib.Path(filename).stem + ".csv"
         else: 
-            filename = "ReturnsData.csv"
-        self.csv_file_name = (pathlib.Path(self.log_file_directory)/(str(self.test_suite.test_devices.DUTsprinkler.testFixtureName) + filename ))
+            filename = "ReturnsResults.db"
+            legacy_filename = "ReturnsData.csv"  # what the fixture wrote before the database
+        FixtureName = str(self.test_suite.test_devices.DUTsprinkler.testFixtureName)
+        self.results_file_name = (pathlib.Path(self.log_file_directory)/(FixtureName + filename ))
+        if self.results_store is None or self.results_store.db_path != self.results_file_name:
+            if self.results_store is not None:
+                self.results_store.close()
+            self.results_store = ResultsStore(self.results_file_name)
+            self.import_legacy_results(pathlib.Path(self.log_file_directory)/(FixtureName + legacy_filename), FixtureName)
+        if self.TRACE_STORE:
+            trace_root = pathlib.Path(self.log_file_directory)/"Traces"
+            if self.trace_store is None or self.trace_store.root != trace_root:
+                if self.trace_store is not None:
+                    self.trace_store.close()
+                self.trace_store = TraceStore(trace_root)
 
     def execute_tests(self):
         "called when START button is pressed"
@@ -209,6 +257,7 @@ class MainWindow(tk.Tk):
 
         # Step 1: Reinitialize Program Variables
         self.abort_test_bool: bool = False
+        self.cancel_token.reset()
         self.test_result_list: List[TestResult] = []
         self.test_start_time: float = 0.0
 
@@ -220,22 +269,44 @@ class MainWindow(tk.Tk):
             self.turn_valve_button.configure(state = "normal")
             return None
         self.test_start_time = timeit.default_timer()
+        if self.TIMELINE:
+            otoTimeline.start(Timeline(f"OtO Unit Return Function Test {self.ProgramVersion}"))
 
         try:  # All encompassing error catch
 
             # Step 3: Restart device and reinitialize objects
-            self.initialize_devices()
-            if self.test_suite.test_type == "EOL": # reset all pin states
-                self.eol_pcb_init()
-                self.vac_interrupt()
+            with span("Initialize devices", "setup"):
+                self.initialize_devices(vacuum_check = True)  # the EOL board reset and vacuum pre-check run alongside the OtO reset
+            if self.LATENCY_STATS:
+                self.latency_stats = LatencyStats()
+                self.test_suite.test_devices.start_latency(self.latency_stats)
+            if otoTimeline.ACTIVE is not None:
+                self.test_suite.test_devices.start_timeline(otoTimeline.ACTIVE)
 
             #Step 4: Run the test Suite
             index = 0
             self.test_suite.test_devices.DUTsprinkler.passEOL = True            
+            PowerTrace = self.POWER_TRACE and hasattr(self.test_suite.test_devices, "i2cSuite")
+            if PowerTrace:
+                self.test_suite.test_devices.i2cSuite.startPowerTrace()
+            if self.CAPTURE_SESSIONS:
+                self.start_session_capture()
             while self.abort_test_bool is False and index < len(self.test_suite.test_list):
                 self.status_labels[index].config(bg = self.IN_PROCESS_COLOUR)
                 self.status_labels[index].update()
-                self.test_result_list.append(self.test_suite.test_list[index].run_step(peripherals_list=self.test_suite.test_devices))
+                if PowerTrace:
+                    self.test_suite.test_devices.i2cSuite.setPowerTraceStep(self.test_suite.test_list[index].name)
+                if self.test_suite.test_devices.recorder is not None:
+                    self.test_suite.test_devices.recorder.step(self.test_suite.test_list[index].name)
+                try:
+                    with span(self.test_suite.test_list[index].name, "step"):
+                        self.test_result_list.append(self.test_suite.test_list[index].run_step(peripherals_list=self.test_suite.test_devices, cancel = self.cancel_token))
+                except StepCancelled:  # STOP inside the step, turn everything off before anything else
+                    ShutdownTime = self.test_suite.test_devices.safe_shutdown()
+                    self.text_console_logger(display_message = f"{self.test_suite.test_list[index].name} stopped, air, motors and pumps off in {round(ShutdownTime * 1000)} ms.")
+                    break
+                if self.test_suite.test_devices.recorder is not None:
+                    self.test_suite.test_devices.recorder.result(self.test_suite.test_list[index].name, self.test_result_list[index])
                 if not self.test_result_list[index].is_passed:
                     self.test_suite.test_devices.DUTsprinkler.passEOL = False
                     self.test_step_failure_handler(step_number = index)
@@ -252,15 +323,23 @@ class MainWindow(tk.Tk):
                 index += 1
 
             #Step 5: While Loop Complete or Escaped
+            for MotionName in self.test_suite.test_devices.join_motions():  # moves left finishing in the background by the last steps
+                self.text_console_logger(display_message = f"{MotionName} didn't finish in time.")
+                self.test_suite.test_devices.DUTsprinkler.passEOL = False
+            self.test_suite.test_devices.stop_capture()
+            if PowerTrace:
+                self.test_suite.test_devices.i2cSuite.stopPowerTrace()
+                self.log_power_trace()
             if self.abort_test_bool is True:
                 self.text_console_logger(display_message="Stop button pressed, no results saved.")
                 self.text_console_logger('----------------------- Test was STOPPED ----------------------------------')
                 self.one_button_to_rule_them_all.configure(text = "START", bg = self.GOOD_COLOUR, fg = self.NORMAL_COLOUR, command = self.execute_tests, state = "normal")
                 self.turn_valve_button.configure(state = "normal")
-                return ClosePort(self.device_list)
+                return self.close_test_run()
             else:
                 self.test_suite.test_devices.DUTsprinkler.passTime = round((timeit.default_timer() - self.test_start_time), 4)
-                self.log_unit_data()
+                with span("Log unit data", "io"):
+                    self.log_unit_data()
                 if self.test_suite.test_devices.DUTsprinkler.passEOL:
                     self.text_console_logger("--------------------------  Device PASSED  -------------------------------")
                 else:
@@ -271,6 +350,9 @@ class MainWindow(tk.Tk):
             self.turn_valve_button.configure(state = "normal")
 
         except Exception as e:
+            self.test_suite.test_devices.stop_capture()
+            if hasattr(self.test_suite.test_devices, "i2cSuite"):
+                self.test_suite.test_devices.i2cSuite.stopPowerTrace()
             if hasattr(self.test_suite.test_devices, "gpioSuite"):
                 self.eol_pcb_init()  # Turns off power, air and LED
             self.text_console.configure(bg = self.IN_PROCESS_COLOUR)
@@ -283,186 +365,157 @@ class MainWindow(tk.Tk):
             self.one_button_to_rule_them_all.configure(text = "START", bg = self.GOOD_COLOUR, fg = self.NORMAL_COLOUR, command = self.execute_tests, state = "normal")
             self.turn_valve_button.configure(state = "normal")
 
-        return ClosePort(self.device_list)
+        return self.close_test_run()
+
+    def close_test_run(self):
+        "closes the port at the end of a run and saves the run's timeline and OtO latency statistics"
+        with span("Close port", "setup"):
+            Closed = ClosePort(self.device_list)
+        UnitTimeline = otoTimeline.stop()
+        self.test_suite.test_devices.stop_timeline()
+        self.test_suite.test_devices.stop_latency()
+        DUT = getattr(self.test_suite.test_devices, "DUTsprinkler", None)
+        DeviceID = getattr(DUT, "deviceID", "") or "Unidentified"
+        Date_Time = datetime.datetime.now().strftime('%Y-%m-%d %H_%M_%S')
+        if UnitTimeline is not None and self.log_file_directory is not None:
+            try:
+                UnitTimeline.save(pathlib.Path(self.log_file_directory)/"Timeline", f"{DeviceID} {Date_Time}", max_bytes = self.TIMELINE_MAX_BYTES)
+            except OSError as e:
+                print(f"Couldn't save timeline: {e}")
+        if self.latency_stats is not None:
+            self.latency_totals.merge(self.latency_stats)
+            if self.log_file_directory is not None:
+                try:
+                    self.latency_stats.save(pathlib.Path(self.log_file_directory)/"Latency", f"{DeviceID} {Date_Time}",
+                                            info = {"Unit": DeviceID, "Firmware": getattr(DUT, "Firmware", None), "Fixture": getattr(DUT, "testFixtureName", None)},
+                                            max_bytes = self.LATENCY_MAX_BYTES)
+                except OSError as e:
+                    print(f"Couldn't save latency statistics: {e}")
+            self.latency_stats = None
+        return Closed
+
+    def latency_snapshot(self):
+        "what the latency stats server returns, the unit being tested and the totals of the units finished so far"
+        Unit = self.latency_stats
+        return {"Unit": Unit.summary() if Unit is not None else None, "Session": self.latency_totals.summary()}
+
+    def prefetch_unit_name(self, prefetch):
+        "cloud unit name request for a unit the attach watcher found, only for units that already have a device ID and once a run has read the fixture's factory location"
+        DUT = getattr(self.test_suite.test_devices, "DUTsprinkler", None)
+        FactoryLocation = getattr(DUT, "factoryLocation", "")
+        if not FactoryLocation or prefetch.device_id is None or prefetch.bom_number is None:
+            return None
+        Request = GetUnitName.unit_name_request(bom_number = prefetch.bom_number, batch_number = DUT.batchNumber, mac_address = prefetch.mac_address,
+                                                factory_location = FactoryLocation, existing_serial = prefetch.device_id)
+        Response = GetUnitName.post_unit_name_request(Request)
+        if Response.status_code != 200:  # errors are asked again at START
+            return None
+        return Request, Response
 
-    def initialize_devices(self):
-        "Add otoSprinkler instance, establish gpio and i2c communications to the Cypress chip"
+    def initialize_devices(self, vacuum_check: bool = False):
+        "Add otoSprinkler instance, establish gpio and i2c communications to the Cypress chip. The Cypress side is set up in a worker thread while the OtO resets and is joined before returning."
 
         try:
             if self.test_suite.test_type == "EOL":
-                if not hasattr(self.test_suite.test_devices, "gpioSuite"):
-                    new_gpio = GpioSuite()
-                    self.test_suite.test_devices.add_device(new_object = new_gpio)
-                if not hasattr(self.test_suite.test_devices,"i2cSuite"):
-                    new_i2c = I2CSuite()
-                    self.test_suite.test_devices.add_device(new_object = new_i2c)
-                self.text_console_logger("Connecting to OtO ...")
-                new_oto = otoSprinkler()
-                self.test_suite.test_devices.add_device(new_object = new_oto)  # always reinitialize connection and create new sprinkler
-                # pull info from the EOL PCB. factoryLocation and 
-                self.test_suite.test_devices.DUTsprinkler.factoryLocation, self.test_suite.test_devices.DUTsprinkler.testFixtureName = self.test_suite.test_devices.gpioSuite.getBoardInfo()
+                with ThreadPoolExecutor(max_workers = 1, thread_name_prefix = "Fixture setup") as Worker:
+                    FixtureSetup = Worker.submit(self.prepare_fixture, vacuum_check)
+                    self.text_console_logger("Connecting to OtO ...")
+                    try:
+                        new_oto = otoSprinkler()
+                        self.test_suite.test_devices.add_device(new_object = new_oto)  # always reinitialize connection and create new sprinkler
+                    except Exception:
+                        FixtureError = FixtureSetup.exception()
+                        if FixtureError is not None and not isinstance(FixtureError, VacError):  # a missing test controller explains more than the OtO error
+                            raise FixtureError
+                        raise
+                    # pull info from the EOL PCB. factoryLocation and 
+                    self.test_suite.test_devices.DUTsprinkler.factoryLocation, self.test_suite.test_devices.DUTsprinkler.testFixtureName = FixtureSetup.result()
             else:
                 self.text_console_logger(display_message = "UNEXPECTED PROGRAM ERROR!")
         except Exception as e:
             raise Exception(str(e))
 
-    def log_unit_data(self):
-        "logging raw data about the testSteps. every single testStep in the testSuite run must be added to this function otherwise it will error out"
+    def prepare_fixture(self, vacuum_check: bool):
+        "Cypress side of initialize_devices, doesn't depend on the OtO so it runs in a worker thread during the OtO reset: GPIO and I2C connections, all EOL board pins off and the vacuum pre-check, returns the EOL board info"
+        with span("Fixture setup", "setup"):
+            if not hasattr(self.test_suite.test_devices, "gpioSuite"):
+                new_gpio = GpioSuite()
+                self.test_suite.test_devices.add_device(new_object = new_gpio)
+            if not hasattr(self.test_suite.test_devices,"i2cSuite"):
+                new_i2c = I2CSuite()
+                self.test_suite.test_devices.add_device(new_object = new_i2c)
+            self.eol_pcb_init()
+            if vacuum_check:
+                self.vac_interrupt()
+            return self.test_suite.test_devices.gpioSuite.getBoardInfo()
 
-        write_header: bool = True
+    def start_session_capture(self):
+        "starts recording this run's OtO, GPIO and I2C calls, the unit isn't identified yet so the file is named by fixture and time"
         self.establish_file_write_location()
-        log_file_columns = ["Entry Time", "Device ID", "MAC Address", "Firmware", "BOM", "Batch", "Unit Name Time", "Battery", "Battery Time", "Ext Power I","Ext Power V", "Ext Power Time",
-                            "Pump 1 Time", "Pump 1 Ave Current", "Pump 1 Current STD", "Pump 2 Time", "Pump 2 Ave Current", "Pump 2 Current STD", "Pump 3 Time", "Pump 3 Ave Current", "Pump 3 Current STD",
-                            "Nozzle Offset", "Nozzle Home Time","0 Pressure", "0 Pressure STD", "0 Pressure Time", "Valve Offset", "Valve Offset Time", "Valve Ave Current", "Valve Current STD",
-                            "Peak 1 Pressure", "Peak 1 Angle", "Peak 2 Pressure", "Peak 2 Angle", "Closed Pressure", "Closed Pressure STD", "Closed Pressure Time", "Fully Open Trials",
-                            "Fully Open 1 Ave", "Fully Open 1 STD", "Fully Open 3 Ave", "Fully Open 3 STD", "Fully Open Time", "Nozzle Speed", "Nozzle Speed STD", "Nozzle Time", "Nozzle Ave Current",
-                            "Nozzle Current STD", "Vacuum Fail", "Vacuum Time", "Solar Voltage", "Solar Current", "Solar Time", "Cloud Save", "Cloud Time", "Printed", "Print Time", "Pass Time", "Passed"]
-
-        if pathlib.Path(self.csv_file_name).exists():
-            write_header = False
-        else:
-            pathlib.Path(self.log_file_directory).mkdir(parents = True, exist_ok = True)
-
-        with open(self.csv_file_name, mode = "a", newline = "") as log_file:
-            csv_writer = csv.DictWriter(log_file, fieldnames = log_file_columns)
-            if write_header is True:
-                csv_writer.writeheader()
-            default_row = { "Entry Time": datetime.datetime.now(),
-                            "Device ID": self.test_suite.test_devices.DUTsprinkler.deviceID,
-                            "MAC Address": self.test_suite.test_devices.DUTsprinkler.macAddress,
-                            "Firmware": self.test_suite.test_devices.DUTsprinkler.Firmware,
-                            "BOM": self.test_suite.test_devices.DUTsprinkler.bomNumber,
-                            "Batch": self.test_suite.test_devices.DUTsprinkler.batchNumber,
-                            "Unit Name Time": None,
-                            "Battery": None,
-                            "Battery Time": None,
-                            "Ext Power I": None,
-                            "Ext Power V": None,
-                            "Ext Power Time": None,
-                            "Pump 1 Time": None,
-                            "Pump 1 Ave Current": None,
-                            "Pump 1 Current STD": None,
-                            "Pump 2 Time": None,
-                            "Pump 2 Ave Current": None,
-                            "Pump 2 Current STD": None,
-                            "Pump 3 Time": None,
-                            "Pump 3 Ave Current": None,
-                            "Pump 3 Current STD": None,
-                            "Nozzle Offset": None,
-                            "Nozzle Home Time": None,
-                            "0 Pressure": None,
-                            "0 Pressure STD": None,
-                            "0 Pressure Time": None,
-                            "Valve Offset": None,
-                            "Valve Offset Time": None,
-                            "Valve Ave Current": None,
-                            "Valve Current STD": None,
-                            "Peak 1 Pressure": None,
-                            "Peak 1 Angle": None,
-                            "Peak 2 Pressure": None,
-                            "Peak 2 Angle": None,
-                            "Closed Pressure": None,
-                            "Closed Pressure STD": None,
-                            "Closed Pressure Time": None,                            
-                            "Fully Open Trials": None,
-                            "Fully Open 1 Ave": None,
-                            "Fully Open 1 STD": None,
-                            "Fully Open 3 Ave": None,
-                            "Fully Open 3 STD": None,
-                            "Fully Open Time": None,
-                            "Nozzle Speed": None,
-                            "Nozzle Speed STD": None,
-                            "Nozzle Time": None,
-                            "Nozzle Ave Current": None,
-                            "Nozzle Current STD": None,
-                            "Vacuum Fail": None,
-                            "Vacuum Time": None,
-                            "Solar Voltage": None,
-                            "Solar Current": None,
-                            "Solar Time": None,
-                            "Cloud Save": None,
-                            "Cloud Time": None,
-                            "Printed": None,
-                            "Print Time": None,
-                            "Pass Time": self.test_suite.test_devices.DUTsprinkler.passTime,
-                            "Passed": self.test_suite.test_devices.DUTsprinkler.passEOL
-                            }
-
-            CurrentPump = 1
-            for entry in self.test_result_list:
-                if entry.cycle_time > 0:
-                    if isinstance(entry, GetUnitNameResult):
-                        default_row["Unit Name Time"] = entry.cycle_time
-                    elif isinstance(entry, TestBatteryResult):
-                        default_row["Battery Time"] = entry.cycle_time
-                        default_row["Battery"] = self.test_suite.test_devices.DUTsprinkler.batteryVoltage
-                    elif isinstance(entry, TestExternalPowerResult):
-                        default_row["Ext Power Time"] = entry.cycle_time
-                        default_row["Ext Power I"] = self.test_suite.test_devices.DUTsprinkler.extPowerCurrent
-                        default_row["Ext Power V"] = self.test_suite.test_devices.DUTsprinkler.extPowerVoltage
-                    elif isinstance(entry, TestPumpResult):
-                        if CurrentPump == 1:
-                            default_row["Pump 1 Time"] = entry.cycle_time
-                            default_row["Pump 1 Ave Current"] = self.test_suite.test_devices.DUTsprinkler.Pump1CurrentAve
-                            default_row["Pump 1 Current STD"] = self.test_suite.test_devices.DUTsprinkler.Pump1CurrentSTD
-                            CurrentPump += 1
-                        elif CurrentPump == 2:
-                            default_row["Pump 2 Time"] = entry.cycle_time
-                            default_row["Pump 2 Ave Current"] = self.test_suite.test_devices.DUTsprinkler.Pump2CurrentAve
-                            default_row["Pump 2 Current STD"] = self.test_suite.test_devices.DUTsprinkler.Pump2CurrentSTD
-                            CurrentPump += 1
-                        elif CurrentPump == 3:
-                            default_row["Pump 3 Time"] = entry.cycle_time
-                            default_row["Pump 3 Ave Current"] = self.test_suite.test_devices.DUTsprinkler.Pump3CurrentAve
-                            default_row["Pump 3 Current STD"] = self.test_suite.test_devices.DUTsprinkler.Pump3CurrentSTD
-                            CurrentPump += 1
-                    elif isinstance(entry, SendNozzleHomeResult):
-                        default_row["Nozzle Home Time"] = entry.cycle_time
-                        default_row["Nozzle Offset"] = self.test_suite.test_devices.DUTsprinkler.nozzleOffset
-                    elif isinstance(entry, PressureCheckResult):
-                        default_row["0 Pressure Time"] = entry.cycle_time
-                        default_row["0 Pressure"] = self.test_suite.test_devices.DUTsprinkler.ZeroPressureAve
-                        default_row["0 Pressure STD"] = self.test_suite.test_devices.DUTsprinkler.ZeroPressureSTD
-                    elif isinstance(entry, ValveCalibrationResult):
-                        default_row["Valve Offset Time"] = entry.cycle_time
-                        default_row["Valve Ave Current"] = self.test_suite.test_devices.DUTsprinkler.ValveCurrentAve
-                        default_row["Valve Current STD"] = self.test_suite.test_devices.DUTsprinkler.ValveCurrentSTD
-                        default_row["Valve Offset"] = self.test_suite.test_devices.DUTsprinkler.valveOffset
-                        default_row["Peak 1 Pressure"] = self.test_suite.test_devices.DUTsprinkler.ValvePeak1
-                        default_row["Peak 1 Angle"] = self.test_suite.test_devices.DUTsprinkler.Peak1Angle
-                        default_row["Peak 2 Pressure"] = self.test_suite.test_devices.DUTsprinkler.ValvePeak2
-                        default_row["Peak 2 Angle"] = self.test_suite.test_devices.DUTsprinkler.Peak2Angle
-                    elif isinstance(entry, VerifyValveOffsetTargetResult):
-                        default_row["Closed Pressure Time"] = entry.cycle_time
-                        if self.test_suite.test_devices.DUTsprinkler.valveClosesAve > 0:
-                            default_row["Closed Pressure"] = self.test_suite.test_devices.DUTsprinkler.valveClosesAve
-                            default_row["Closed Pressure STD"] = self.test_suite.test_devices.DUTsprinkler.valveClosesSTD
-                    elif isinstance(entry, TestMoesFullyOpenResult):
-                        default_row["Fully Open Time"] = entry.cycle_time
-                        if self.test_suite.test_devices.DUTsprinkler.valveFullyOpenTrials > 0:
-                            default_row["Fully Open Trials"] = self.test_suite.test_devices.DUTsprinkler.valveFullyOpenTrials
-                            default_row["Fully Open 1 Ave"] = self.test_suite.test_devices.DUTsprinkler.valveFullyOpen1Ave
-                            default_row["Fully Open 1 STD"] = self.test_suite.test_devices.DUTsprinkler.valveFullyOpen1STD
-                            default_row["Fully Open 3 Ave"] = self.test_suite.test_devices.DUTsprinkler.valveFullyOpen3Ave
-                            default_row["Fully Open 3 STD"] = self.test_suite.test_devices.DUTsprinkler.valveFullyOpen3STD
-                    elif isinstance(entry, NozzleRotationTestWithSubscribeResult):
-                        default_row["Nozzle Time"] = entry.cycle_time
-                        default_row["Nozzle Ave Current"] = self.test_suite.test_devices.DUTsprinkler.NozzleCurrentAve
-                        default_row["Nozzle Current STD"] = self.test_suite.test_devices.DUTsprinkler.NozzleCurrentSTD
-                        if self.test_suite.test_devices.DUTsprinkler.nozzleRotationAve > 0:
-                            default_row["Nozzle Speed"] = self.test_suite.test_devices.DUTsprinkler.nozzleRotationAve
-                            default_row["Nozzle Speed STD"] = self.test_suite.test_devices.DUTsprinkler.nozzleRotationSTD
-                    elif isinstance(entry, CheckVacSwitchResult):
-                        default_row["Vacuum Time"] = entry.cycle_time
-                        default_row["Vacuum Fail"] = self.test_suite.test_devices.DUTsprinkler.vacuumFail
-                    elif isinstance(entry, TestSolarResult):
-                        default_row["Solar Time"] = entry.cycle_time
-                        default_row["Solar Voltage"] = self.test_suite.test_devices.DUTsprinkler.solarVoltage
-                        default_row["Solar Current"] = self.test_suite.test_devices.DUTsprinkler.solarCurrent                    
-                    else:
-                        print (type(entry))
-                        raise TypeError(f'Program error, unknown test specified: {entry}')
-            csv_writer.writerow(default_row)
+        session_folder = pathlib.Path(self.log_file_directory)/"Sessions"
+        session_folder.mkdir(parents = True, exist_ok = True)
+        Date_Time = str(datetime.datetime.now().strftime("%Y-%m-%d %H_%M_%S"))
+        self.test_suite.test_devices.start_capture(session_folder/f"{self.test_suite.test_devices.DUTsprinkler.testFixtureName}_{Date_Time}.otosession")
+
+    def log_power_trace(self):
+        "saves the per step summary of the fixture power trace next to the other test step outputs"
+        if self.test_suite.test_devices.DUTsprinkler.deviceID == "":
+            return None
+        Summary = self.test_suite.test_devices.i2cSuite.powerTraceSummary()
+        if not Summary:
+            return None
+        Date_Time = str(datetime.datetime.now().strftime("%d-%m-%Y %H_%M_%S"))
+        file_name = EstablishLoggingLocation(name = "Power Trace", folder_name = "Power Trace", date_time = Date_Time, parent = self).run_step(peripherals_list = self.test_suite.test_devices).file_path
+        with open(file_name, mode = "w", newline = "") as trace_file:
+            csv_writer = csv.writer(trace_file)
+            csv_writer.writerow(["Step", "Samples", "Duration (s)", "Charge (A·s)", "Energy (J)", "Mean Current (A)", "Peak Current (A)"])
+            csv_writer.writerows(Summary)
+
+    def import_legacy_results(self, csv_path: pathlib.Path, FixtureName: str):
+        "brings the results this fixture wrote to its CSV file before the database into it, once, so the history lookup sees them too"
+        try:
+            Imported = self.results_store.import_legacy_csv(csv_path, fixture = FixtureName)
+        except (OSError, sqlite3.Error, csv.Error, ValueError) as e:  # file locked or not synced yet, tried again when the store is next opened
+            self.text_console_logger(f"Couldn't import {csv_path.name}: {e}")
+            return None
+        if Imported:
+            self.text_console_logger(f"Imported {Imported} earlier results from {csv_path.name}")
+
+    def start_eol_import(self):
+        "imports the lines added to the EOL station files since the last import in a background thread, the history lookup answers from what was imported before"
+        if self.EOL_DATA_FOLDER is None or (self.eol_import_thread is not None and self.eol_import_thread.is_alive()):
+            return None
+        self.eol_import_thread = threading.Thread(target = import_eol_folder, args = (self.results_file_name, self.EOL_DATA_FOLDER, self.EOL_DATA_PATTERN), name = "EOL import", daemon = True)
+        self.eol_import_thread.start()
+
+    def show_unit_history(self):
+        "shows previous returns tests and the original EOL values of the unit that was just identified, history is only for information so nothing in here stops the test"
+        try:
+            self.establish_file_write_location()
+            self.start_eol_import()
+            DUT = self.test_suite.test_devices.DUTsprinkler
+            History = self.results_store.unit_history(device_id = DUT.deviceID) if DUT.deviceID else self.results_store.unit_history(mac = DUT.macAddress)
+            self.log_unit_history(History)
+        except Exception as e:
+            self.text_console_logger(f"Unit history not available: {e}")
+        return None
+
+    def log_unit_history(self, History: dict):
+        Summary = History.get("Summary")
+        if Summary is not None:
+            self.text_console_logger(f"Tested here {Summary['tests']} time(s), passed {Summary['passes']}, last {Summary['last_tested'][:16]}")
+            for Previous in History.get("Returns")[:1]:
+                self.text_console_logger("Last test: " + ", ".join(f"{Name} {Value}" for Name, Value in Previous.items() if Value not in (None, "") and Name != "Entry Time"))
+        EOL = History.get("EOL")
+        if EOL is not None:
+            self.text_console_logger(f"EOL {EOL.get('Entry Time', '')[:16]}: " + ", ".join(f"{Name} {EOL[Name]}" for Name in HISTORY_COLUMNS if EOL.get(Name) not in (None, "")))
+        if Summary is None and EOL is None:
+            self.text_console_logger("No previous test records for this unit.")
+
+    def log_unit_data(self):
+        "logging raw data about the testSteps to the results database. every TestResult type in the testSuite run must be registered in otoResultsStore otherwise it will error out"
+        self.establish_file_write_location()
+        self.results_store.add(build_unit_row(self.test_result_list, self.test_suite.test_devices.DUTsprinkler))
     
     def OneTestButton(self, ButtonNumber):
         "function for handling single button press for device debugging purposes"
@@ -524,10 +577,7 @@ class MainWindow(tk.Tk):
                 self.turn_valve_button.configure(state = "normal")  
             return ClosePort(self.device_list)             
         try:  # all other functions require an OtO, so try to connect to one first...
-            if FunctionName in "Test Pump 1 Test Pump 2 Test Pump 3":
-                self.vac_interrupt()
-            self.initialize_devices()
-            self.eol_pcb_init()
+            self.initialize_devices(vacuum_check = FunctionName in "Test Pump 1 Test Pump 2 Test Pump 3")
         except Exception as e:
             self.text_console.configure(bg = self.IN_PROCESS_COLOUR)
             if str(e) == "Ping Failed":
@@ -638,12 +688,14 @@ class MainWindow(tk.Tk):
                 self.one_button_to_rule_them_all.configure(state = "normal")
                 self.turn_valve_button.configure(state = "normal")
         elif FunctionName in "Verify Valve Closes":
-            PauseTime = 17
+            PauseTime = 17  # longest wait
+            PauseTolerance = 300  # pressure ADC change between 1 second windows that counts as settled
             ResultList = PressureCheck(name = "Zero Pressure Check", data_collection_time = 2.1, class_function= "EOL" , valve_target = None, parent = self).run_step(peripherals_list = self.test_suite.test_devices)
             if ResultList.test_status != None:
                 self.text_console_logger(display_message = ResultList.test_status[1:])
-            self.text_console_logger(display_message = f"Waiting {PauseTime} seconds")
-            time.sleep(PauseTime)
+            self.text_console_logger(display_message = f"Waiting up to {PauseTime} seconds for the pressure to settle")
+            SettleWait(self.test_suite.test_devices, name = "Verify Valve Closes pause", read = lambda: int(self.test_suite.test_devices.DUTMLB.get_sensors().pressure_adc),
+                       tolerance = PauseTolerance, timeout = PauseTime, window = 1, minimum_time = 2)
             ResultList = self.test_suite.test_list[ButtonNumber].run_step(peripherals_list=self.test_suite.test_devices)  # Verify Valve Closes
             if not ResultList.is_passed:
                 self.status_labels[ButtonNumber].configure(bg = self.BAD_COLOUR, state = "normal")
@@ -761,21 +813,12 @@ class MainWindow(tk.Tk):
         return ClosePort(self.device_list)
 
     def USBCheck(self):
-        "Confirm only one OtO serial card is connected"
-        USB_VID = 0x10C4
-        USB_PID = 0xEA60
-        PortList = serial.tools.list_ports.comports()
-        OtOPortList = []
-        for port in PortList:
-            if port.pid == USB_PID and port.vid == USB_VID:
-                OtOPortList.append(port.name)
-        if len(OtOPortList) == 1:
-            globalvars.PortName = OtOPortList[0]
+        "Confirm only one OtO serial card is connected, from the port inventory"
+        PortName, Reason = self.port_inventory.oto_port()
+        if PortName is not None:
+            globalvars.PortName = PortName
             return True
-        elif len(OtOPortList) > 1:
-            self.text_console_logger("Too many USB cards attached for this test!")
-        else:
-            self.text_console_logger("No USB card found!")
+        self.text_console_logger(Reason)
         return False
 
     def vac_interrupt(self):
@@ -801,12 +844,21 @@ def ClearFigures():
     plt.close()
 
 def ClosePort(DeviceList: TestPeripherals):
-    "Closes the USB port if it is open and connected to an OtO"
-    if hasattr(DeviceList, "DUTMLB"):
-        if hasattr(DeviceList.DUTMLB, "connection"):
-            if hasattr(DeviceList.DUTMLB.connection, "port"):
-                return DeviceList.DUTMLB.stop_connection()
-    return None
+    "Closes the USB port if it is open and connected to an OtO, after any moves still finishing in the background, then lets the attach watcher use the port again"
+    Watcher = getattr(DeviceList.parent, "attach_watcher", None)
+    try:
+        if hasattr(DeviceList, "DUTMLB"):
+            if hasattr(DeviceList.DUTMLB, "connection"):
+                if hasattr(DeviceList.DUTMLB.connection, "port"):
+                    try:
+                        DeviceList.join_motions()
+                    except Exception:
+                        DeviceList.pending_motions.clear()
+                    return DeviceList.DUTMLB.stop_connection()
+        return None
+    finally:
+        if Watcher is not None:
+            Watcher.resume()
 
 if __name__ == '__main__':
     ctypes.windll.shcore.SetProcessDpiAwareness(1)  # gets rid of the fuzzies on graphics display
@@ -814,5 +866,14 @@ if __name__ == '__main__':
     Application.state('zoomed')
     Application.grid()
     Application.mainloop()
+    if Application.results_store is not None:
+        Application.results_store.close()
+    if Application.trace_store is not None:
+        Application.trace_store.close()
+    if Application.latency_server is not None:
+        Application.latency_server.close()
+    if Application.attach_watcher is not None:
+        Application.attach_watcher.close()
+    Application.port_inventory.close()
     ClearFigures()
     exit()
\ No newline at end of file
@@ -0,0 +1,85 @@
+import argparse
+import csv
+import pathlib
+import timeit
+import numpy as np
+from scipy import signal
+from scipy.signal import find_peaks
+from otoAnalysis import lowpass_sos, valve_main_peaks
+
+SAMPLING_FREQUENCY = 100  # Hz, ValveCalibration subscribe rate
+
+def legacy_valve_peaks(valve_calibration_data: list):
+    "ValveCalibration's peak analysis before otoAnalysis.valve_main_peaks, kept as the reference, returns [[position, pressure], [position, pressure]]"
+    ValvePositionData = []
+    PressureData = []
+    peak_position_list = []
+    peak_pressure_list = []
+    second_peak = 0
+    sos = signal.butter(N = 1, Wn = 0.5, btype = "lowpass", output = "sos", fs = SAMPLING_FREQUENCY)
+    for i in range(len(valve_calibration_data)):
+        ValvePositionData.append(valve_calibration_data[i][0])
+        PressureData.append(valve_calibration_data[i][1])
+
+    FinalPressure = signal.sosfiltfilt(sos, x = PressureData, padtype = "odd", padlen = 40)
+    zero = min(FinalPressure)
+    FinalPressure = (FinalPressure - zero) * 1.085 + zero
+
+    peak_list_index, properties = find_peaks(FinalPressure)
+    for i in range(len(peak_list_index)):
+        peak_position_list.append(ValvePositionData[peak_list_index[i]])
+        peak_pressure_list.append(FinalPressure[peak_list_index[i]])
+    try:
+        first_peak = max(peak_pressure_list)
+    except:
+        first_peak = 0
+    for i in range(len(peak_list_index)):
+        if peak_pressure_list[i] != first_peak:
+            if peak_pressure_list[i] > second_peak:
+                second_peak = peak_pressure_list[i]
+    main2peaks_position = [None, None]
+    for i in range(len(peak_list_index)):
+        if first_peak == peak_pressure_list[i]:
+            main2peaks_position[0] = peak_position_list[i]
+        if second_peak == peak_pressure_list[i]:
+            main2peaks_position[1] = peak_position_list[i]
+    return [[main2peaks_position[0], first_peak], [main2peaks_position[1], second_peak]]
+
+def current_valve_peaks(valve_calibration_data: list):
+    "the same analysis the way ValveCalibration does it now"
+    CalibrationArray = np.asarray(valve_calibration_data)
+    Peaks = valve_main_peaks(positions = CalibrationArray[:, 0], pressures = CalibrationArray[:, 1], sos = lowpass_sos(order = 1, cutoff = 0.5, fs = SAMPLING_FREQUENCY))
+    first = Peaks["Peak 1"] if Peaks["Peak 1"] is not None else [None, 0]
+    second = Peaks["Peak 2"] if Peaks["Peak 2"] is not None else [None, 0]
+    return [first, second]
+
+def read_valve_calibrate_csv(csv_path: pathlib.Path):
+    "[position, pressure] rows of an Output/Valve Calibrate CSV file"
+    data = []
+    with open(csv_path, newline = "", encoding = "utf-8") as csv_file:
+        for row in csv.DictReader(csv_file):
+            if row["Position"] != "" and row["Pressure"] != "":
+                data.append([int(float(row["Position"])), int(float(row["Pressure"]))])
+    return data
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Compare the ValveCalibration peak analysis against the original loops on recorded traces")
+    parser.add_argument("folder", help = "Output/Valve Calibrate folder, or any folder holding its CSV files")
+    parser.add_argument("--repeat", type = int, default = 20, help = "runs of each trace per timing")
+    arguments = parser.parse_args()
+
+    Traces = [read_valve_calibrate_csv(Path) for Path in sorted(pathlib.Path(arguments.folder).rglob("*.csv"))]
+    Traces = [Trace for Trace in Traces if len(Trace) > 40]  # sosfiltfilt needs more points than its 40 point padding
+    if not Traces:
+        raise SystemExit(f"No Valve Calibrate traces found in {arguments.folder}")
+    Mismatches = 0
+    for Trace in Traces:
+        Legacy = legacy_valve_peaks(Trace)
+        Current = current_valve_peaks(Trace)
+        if [Legacy[0][0], Legacy[1][0]] != [Current[0][0], Current[1][0]] or not np.allclose([Legacy[0][1], Legacy[1][1]], [Current[0][1], Current[1][1]]):
+            Mismatches += 1
+            print(f"Mismatch: legacy {Legacy}, current {Current}")
+    LegacyTime = timeit.timeit(lambda: [legacy_valve_peaks(Trace) for Trace in Traces], number = arguments.repeat) / arguments.repeat
+    CurrentTime = timeit.timeit(lambda: [current_valve_peaks(Trace) for Trace in Traces], number = arguments.repeat) / arguments.repeat
+    print(f"{len(Traces)} traces, {Mismatches} mismatches")
+    print(f"Legacy: {LegacyTime/len(Traces)*1000:.3f} ms per trace, current: {CurrentTime/len(Traces)*1000:.3f} ms per trace, {LegacyTime/CurrentTime:.1f}x")
@@ -0,0 +1,77 @@
+import argparse
+import json
+import pathlib
+import tempfile
+import time
+import timeit
+from otoTimeline import Timeline
+from otoProxy import TimingProxy
+
+BUDGET = 0.01  # share of a unit's test time the timeline may cost
+
+class StandInDevice:
+    "DUTMLB stand in that returns straight away, so only the proxy and the timeline are timed"
+    def get_sensors(self):
+        return None
+
+    def get_currents(self):
+        return None
+
+def call_overhead(calls: int = 200000):
+    "seconds a TimingProxy adds to one device call, alternating two methods like the polling loops so nothing is merged"
+    device = StandInDevice()
+    proxy = TimingProxy(device, "DUTMLB", Timeline("benchmark"))
+    direct = timeit.timeit(lambda: (device.get_sensors(), device.get_currents()), number = calls // 2)
+    timed = timeit.timeit(lambda: (proxy.get_sensors(), proxy.get_currents()), number = calls // 2)
+    return max(timed - direct, 0) / calls
+
+def save_time(events: int = Timeline.MAX_CALL_EVENTS):
+    "seconds to save a trace holding events device calls, the largest a unit's trace gets"
+    timeline = Timeline("benchmark")
+    proxy = TimingProxy(StandInDevice(), "DUTMLB", timeline)
+    for _ in range(events // 2):
+        proxy.get_sensors()
+        proxy.get_currents()
+    with tempfile.TemporaryDirectory() as folder:
+        start = time.perf_counter()
+        timeline.save(folder, "benchmark")
+        return time.perf_counter() - start
+
+def unit_calls(trace_path: pathlib.Path):
+    "[unit seconds, timed calls] of a saved trace, calls from the call totals or, for traces saved without them, the call spans"
+    with open(trace_path, encoding = "utf-8") as trace_file:
+        trace = json.load(trace_file)
+    spans = [event for event in trace["traceEvents"] if event.get("ph") == "X"]
+    if not spans:
+        return [0, 0]
+    seconds = (max(event["ts"] + event["dur"] for event in spans) - min(event["ts"] for event in spans)) / 1e6
+    totals = trace.get("metadata", {}).get("call totals")
+    if totals:
+        calls = sum(total["calls"] for total in totals.values())
+    else:
+        calls = sum(event.get("args", {}).get("calls", 1) for event in spans if event["cat"] not in ("step", "setup"))
+    return [seconds, calls]
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Measure what the timeline hooks cost per unit, from saved traces or a nominal unit")
+    parser.add_argument("folder", nargs = "?", default = None, help = "Timeline folder of saved unit traces")
+    parser.add_argument("--unit-seconds", type = float, default = 60, help = "test time of the nominal unit when no folder is given")
+    parser.add_argument("--calls", type = int, default = 40000, help = "timed calls of the nominal unit when no folder is given")
+    arguments = parser.parse_args()
+
+    PerCall = call_overhead()
+    SaveSeconds = save_time()
+    print(f"{PerCall*1e9:.0f} ns per timed call, {SaveSeconds*1000:.0f} ms to save a full trace")
+    if arguments.folder is None:
+        Units = [["nominal unit", arguments.unit_seconds, arguments.calls]]
+    else:
+        Units = [[Path.name] + unit_calls(Path) for Path in sorted(pathlib.Path(arguments.folder).glob("*.json"))]
+        Units = [Unit for Unit in Units if Unit[1] > 0]
+        if not Units:
+            raise SystemExit(f"No timeline traces found in {arguments.folder}")
+    Shares = []
+    for Name, Seconds, Calls in Units:
+        Share = (Calls * PerCall + SaveSeconds) / Seconds
+        Shares.append(Share)
+        print(f"{Name}: {Seconds:.1f} s, {Calls} calls, {Share*100:.2f} % overhead")
+    print(f"{len(Units)} units, worst {max(Shares)*100:.2f} %, budget {BUDGET*100:.0f} %: {'within' if max(Shares) <= BUDGET else 'OVER'}")
@@ -1,5 +1,10 @@
 from pyoto.cypressTest.ucdev.cy7c65211 import CyUSBSerial, CyGPIO, CyI2C
 import pathlib
+import threading
+import time
+import math
+import statistics
+from array import array
 from pyoto.cypressTest.ltc2945 import LTC2945
 
 #########
@@ -57,6 +62,8 @@ class GpioSuite:
         return self.lib.sendBoardInfo()
 
 class I2CSuite:
+    CONVERSION_TIME = 0.04  # sec, the LTC2945 refreshes its current register about once per continuous scan (33.3 ms sense conversion plus the voltage channels)
+
     def __init__(self):
         self.lib = CyUSBSerial(lib=str(pathlib.Path(__file__).parent/"pyoto"/"cypressTest"/"cyusbserial.dll"))
         try:
@@ -65,6 +72,103 @@ class I2CSuite:
             raise Exception("TEST CONTROLLER WASN'T FOUND. Is it plugged in?\n测试控制器没有找到, 是否已插入?")
         self.i2cController = CyI2C(self.i2cDev)
         self.i2cLTC2945 = LTC2945(self.i2cController)
+        self.lock = threading.Lock()  # one I2C transaction at a time on the Cypress bridge
+        self.traceThread: threading.Thread = None
+        self.traceRunning = threading.Event()
+        self.clearPowerTrace()
+
+    def clearPowerTrace(self):
+        "empties the power trace buffer, samples are kept in compact arrays: time (s), current (A), voltage (V) and step number"
+        self.traceTimes = array("d")
+        self.traceCurrents = array("d")
+        self.traceVoltages = array("d")
+        self.traceSteps = array("H")
+        self.traceStepNames: list = ["Start"]  # step name for each step number in traceSteps
+
+    def startPowerTrace(self, period: float = 0.01):
+        "starts sampling the LTC2945 in a background thread every period seconds until stopPowerTrace()"
+        if self.traceThread is not None and self.traceThread.is_alive():
+            return
+        self.clearPowerTrace()
+        self.traceRunning.set()
+        self.traceThread = threading.Thread(target = self._powerTraceLoop, args = (period,), name = "PowerTrace", daemon = True)
+        self.traceThread.start()
+
+    def setPowerTraceStep(self, stepName: str):
+        "tags all following samples with this test step"
+        self.traceStepNames.append(stepName)
+
+    def stopPowerTrace(self):
+        self.traceRunning.clear()
+        if self.traceThread is not None:
+            self.traceThread.join(timeout = 1)
+            self.traceThread = None
+
+    def _powerTraceLoop(self, period: float):
+        hasVoltage = hasattr(self.i2cLTC2945, "get_voltage")  # not every LTC2945 driver version reads the supply voltage
+        startTime = time.perf_counter()
+        nextSample = startTime
+        while self.traceRunning.is_set():
+            try:
+                with self.lock:
+                    current = float(self.i2cLTC2945.get_current())
+                    voltage = float(self.i2cLTC2945.get_voltage()) if hasVoltage else math.nan
+            except Exception:  # a failed read mustn't stop the test, skip the sample
+                current = None
+            if current is not None:
+                self.traceTimes.append(time.perf_counter() - startTime)
+                self.traceCurrents.append(current)
+                self.traceVoltages.append(voltage)
+                self.traceSteps.append(len(self.traceStepNames) - 1)
+            nextSample += period
+            time.sleep(max(nextSample - time.perf_counter(), 0))
+
+    def powerTraceSummary(self):
+        "per test step: [step name, samples, seconds, charge (A·s), energy (J, nan without voltage), mean current (A), peak current (A)]"
+        summary = []
+        count = len(self.traceSteps)
+        index = 0
+        while index < count:
+            step = self.traceSteps[index]
+            end = index
+            while end < count and self.traceSteps[end] == step:
+                end += 1
+            times = self.traceTimes[index:end]
+            currents = self.traceCurrents[index:end]
+            voltages = self.traceVoltages[index:end]
+            charge = 0.0
+            energy = 0.0
+            for sample in range(1, len(times)):  # trapezoidal integration
+                dt = times[sample] - times[sample - 1]
+                charge += 0.5 * (currents[sample] + currents[sample - 1]) * dt
+                energy += 0.5 * (currents[sample] * voltages[sample] + currents[sample - 1] * voltages[sample - 1]) * dt
+            summary.append([self.traceStepNames[step], end - index, round(times[-1] - times[0], 3), round(charge, 4), round(energy, 4),
+                            round(statistics.fmean(currents), 4), round(max(currents), 4)])
+            index = end
+        return summary
+
+    def burstCurrent(self, samples: int = 4, period: float = CONVERSION_TIME, cancel = None, previous: dict = None, tolerance: float = 0):
+        '''
+        Reads the LTC2945 current samples times, one read per ADC conversion so every reading is a new conversion rather
+        than the same register value read again. The I2C lock is only held for each read, so the power trace keeps running
+        between them. cancel.check() is called between reads if given. Given the previous burst, the current counts as
+        settled when the two means are within tolerance A.
+
+        returns {"Mean": A, "STD": A, "Samples": count, "Settled": bool}, Settled is False without a previous burst
+        '''
+        readings = []
+        nextRead = time.perf_counter()
+        for sample in range(samples):
+            if sample:
+                if cancel is not None:
+                    cancel.check()
+                nextRead += period
+                time.sleep(max(nextRead - time.perf_counter(), 0))
+            with self.lock:
+                readings.append(float(self.i2cLTC2945.get_current()))
+        mean = statistics.fmean(readings)
+        settled = previous is not None and abs(mean - previous["Mean"]) <= tolerance
+        return {"Mean": mean, "STD": statistics.pstdev(readings), "Samples": len(readings), "Settled": settled}
 
 #######################################################################################################################
 
@@ -1,4 +1,4 @@
 BOMtoFlash = ""
 KenakoreBOM = "Kenakore"
 PortName = None
-PressureSensor = None
\ No newline at end of file
+PressureCalibration = None  # otoTests.PressureCalibration of the connected OtO
\ No newline at end of file
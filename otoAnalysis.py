@@ -0,0 +1,213 @@
+import functools
+import math
+import numpy as np
+from scipy import signal
+
+def valve_curve_span_slope(valve_raw_data: list, saved_offset: int, low_target: int, high_target: int, step: int = 200):
+    '''
+    Estimates how fast the fully open span (pressure at low_target minus pressure at high_target) changes per centidegree
+    of valve offset change, using the pressure against angle curve recorded by ValveCalibration (otoSprinkler.valveRawData).
+    Targets are relative to the saved valve offset, valveRawData positions are absolute. Returns None if there is no
+    usable curve.
+    '''
+    if not valve_raw_data or len(valve_raw_data) < 10:
+        return None
+    curve = np.asarray(valve_raw_data, dtype = float)
+    order = np.argsort(curve[:, 0])
+    positions = curve[order, 0]
+    pressures = curve[order, 1]
+
+    def span(offset_change):
+        low = (low_target + saved_offset + offset_change) % 36000
+        high = (high_target + saved_offset + offset_change) % 36000
+        return np.interp(low, positions, pressures, period = 36000) - np.interp(high, positions, pressures, period = 36000)
+
+    slope = (span(step) - span(-step)) / (2 * step)
+    if not math.isfinite(slope) or slope <= 0:  # span has to grow with the offset change, otherwise the curve can't be trusted
+        return None
+    return float(slope)
+
+class OffsetSpanSolver:
+    '''
+    Finds the valve offset change where the pressures at the two fully open check positions are balanced (span = 0),
+    from the (offset change, span) points measured so far.
+
+    The first step uses the slope of the ValveCalibration curve if there is one, otherwise the original square root
+    heuristic. After two measurements a secant step is used. Every step is limited to max_step centidegrees.
+    '''
+    def __init__(self, max_step: int, adjustment_factor: float, curve_slope: float = None):
+        self.max_step = max_step
+        self.adjustment_factor = adjustment_factor  # square root of the span divided by this factor x 1° for the heuristic step
+        self.curve_slope = curve_slope
+        self.points: list = []  # [offset change, span]
+        self.method: str = ""  # how the last prediction was made, for the console
+
+    def add(self, offset_change: int, span: float):
+        self.points.append([int(offset_change), float(span)])
+
+    def next_offset_change(self):
+        "predicted offset change in centidegrees for the next trial"
+        offset_change, span = self.points[-1]
+        prediction = None
+        if len(self.points) >= 2:
+            previous_change, previous_span = self.points[-2]
+            if offset_change != previous_change and span != previous_span:
+                slope = (span - previous_span) / (offset_change - previous_change)
+                if slope > 0:
+                    prediction = offset_change - span / slope
+                    self.method = "secant"
+        if prediction is None and self.curve_slope is not None:
+            prediction = offset_change - span / self.curve_slope
+            self.method = "calibration curve"
+        if prediction is None:
+            prediction = offset_change - np.sign(span) * 100 * math.sqrt(abs(span)) / self.adjustment_factor
+            self.method = "heuristic"
+        step = min(max(prediction - offset_change, -self.max_step), self.max_step)
+        return int(round(offset_change + step))
+
+class StreamingPeakTracker:
+    '''
+    Causal low pass filter and peak detection for a pressure stream that arrives in packet batches. The filter state
+    is carried between batches, so the result is the same as filtering the whole trace with signal.sosfilt.
+
+    A peak is confirmed once the filtered pressure has dropped confirm_drop below the highest value seen since the last
+    valley, the tracker then waits for the pressure to rise confirm_drop above the valley before looking for the next
+    peak. Small ripples therefore never count as peaks.
+    '''
+    def __init__(self, sos, confirm_drop: float):
+        self.sos = sos
+        self.confirm_drop = confirm_drop
+        self.zi = None  # filter state carried between batches
+        self.peaks: list = []  # [travel, filtered pressure] of every confirmed peak
+        self.rising: bool = True
+        self.extreme: list = None  # [travel, filtered pressure] of the current peak candidate or valley
+
+    def update(self, travel, pressure):
+        "adds a batch of samples, travel is the unwrapped angle in centidegrees since recording started"
+        pressure = np.asarray(pressure, dtype = float)
+        if pressure.size == 0:
+            return
+        if self.zi is None:
+            self.zi = signal.sosfilt_zi(self.sos) * pressure[0]
+        filtered, self.zi = signal.sosfilt(self.sos, pressure, zi = self.zi)
+        for angle, value in zip(travel, filtered):
+            if self.extreme is None:
+                self.extreme = [angle, value]
+            elif self.rising:
+                if value > self.extreme[1]:
+                    self.extreme = [angle, value]
+                elif value < self.extreme[1] - self.confirm_drop:
+                    self.peaks.append(self.extreme)
+                    self.rising = False
+                    self.extreme = [angle, value]
+            else:
+                if value < self.extreme[1]:
+                    self.extreme = [angle, value]
+                elif value > self.extreme[1] + self.confirm_drop:
+                    self.rising = True
+                    self.extreme = [angle, value]
+
+    def pair_confirmed(self, travel: float, spacing: int, spacing_window: int, margin: int):
+        "True when two confirmed peaks are spacing ± spacing_window apart and the valve has turned margin past the second one"
+        if len(self.peaks) < 2:
+            return False
+        first, second = self.peaks[0][0], self.peaks[1][0]
+        return abs((second - first) - spacing) <= spacing_window and travel >= second + margin
+
+@functools.lru_cache(maxsize = None)
+def lowpass_sos(order: int, cutoff: float, fs: float):
+    "Butterworth low pass second order sections, designed once per setting and shared between units, don't modify the result"
+    return signal.butter(N = order, Wn = cutoff, btype = "lowpass", output = "sos", fs = fs)
+
+def valve_main_peaks(positions, pressures, sos, scale: float = 1.085, padlen: int = 40):
+    '''
+    Zero phase filters a ValveCalibration pressure trace and finds the two highest peaks. The filtered curve is stretched
+    by scale above its minimum to line the filtered peaks up closer to the raw ones.
+
+    The first peak is the highest, the second the highest of the rest with a different pressure. When several peaks
+    share a pressure the last one (in recorded order) is used, the same as the original loops. Returns a dict with
+    "Filtered", "Peak 1" and "Peak 2" ([position, pressure], None if missing) and "Separation Error", how far the two
+    peaks are from 180° apart in centidegrees.
+    '''
+    positions = np.asarray(positions)
+    filtered = signal.sosfiltfilt(sos, x = np.asarray(pressures, dtype = float), padtype = "odd", padlen = padlen)
+    zero = filtered.min()
+    filtered = (filtered - zero) * scale + zero
+    result = {"Filtered": filtered, "Peak 1": None, "Peak 2": None, "Separation Error": None}
+
+    peak_index, _ = signal.find_peaks(filtered)
+    if peak_index.size == 0:
+        return result
+    peak_pressure = filtered[peak_index]
+    order = np.argsort(peak_pressure, kind = "stable")  # stable, so the last of equal peaks sorts last
+    first = order[-1]
+    result["Peak 1"] = [positions[peak_index[first]], peak_pressure[first]]
+    rest = order[(peak_pressure[order] != peak_pressure[first]) & (peak_pressure[order] > 0)]
+    if rest.size == 0:
+        return result
+    second = rest[-1]
+    result["Peak 2"] = [positions[peak_index[second]], peak_pressure[second]]
+    result["Separation Error"] = abs(abs(int(result["Peak 1"][0]) - int(result["Peak 2"][0])) - 18000)
+    return result
+
+def reduce_for_plot(values, points: int = 1000):
+    "indices of at most about points samples that keep the shape of values for plotting, the minimum and maximum of each bucket so peaks survive"
+    values = np.asarray(values)
+    if values.size <= points:
+        return np.arange(values.size)
+    buckets = max(points // 2, 1)
+    size = values.size // buckets
+    shaped = values[:buckets * size].reshape(buckets, size)
+    starts = np.arange(buckets) * size
+    index = np.concatenate([starts + shaped.argmin(axis = 1), starts + shaped.argmax(axis = 1), np.arange(buckets * size, values.size)])
+    return np.unique(index)
+
+def valve_calibration_analysis(positions, pressures, order: int, cutoff: float, fs: float, plot_points: int = 1000, padlen: int = 40):
+    "ValveCalibration analysis, the peaks plus reduced raw and filtered curves to plot"
+    positions = np.asarray(positions)
+    pressures = np.asarray(pressures)
+    peaks = valve_main_peaks(positions = positions, pressures = pressures, sos = lowpass_sos(order = order, cutoff = cutoff, fs = fs), padlen = padlen)
+    raw_index = reduce_for_plot(pressures, plot_points)
+    filtered_index = reduce_for_plot(peaks["Filtered"], plot_points)
+    return {"Peak 1": None if peaks["Peak 1"] is None else [int(peaks["Peak 1"][0]), float(peaks["Peak 1"][1])],
+            "Peak 2": None if peaks["Peak 2"] is None else [int(peaks["Peak 2"][0]), float(peaks["Peak 2"][1])],
+            "Separation Error": peaks["Separation Error"],
+            "Plot Positions": positions[raw_index], "Plot Pressures": pressures[raw_index],
+            "Plot Filtered Positions": positions[filtered_index], "Plot Filtered": peaks["Filtered"][filtered_index]}
+
+def pressure_distribution(pressures):
+    "mean, standard deviation and histogram of a pressure trace, the histogram replaces the raw samples in the plot"
+    pressures = np.asarray(pressures, dtype = float)
+    counts, edges = np.histogram(pressures, bins = "auto")
+    return {"Count": int(pressures.size), "Mean": float(pressures.mean()), "STD": float(pressures.std()), "Minimum": float(pressures.min()),
+            "Maximum": float(pressures.max()), "Histogram Counts": counts, "Histogram Centers": (edges[:-1] + edges[1:]) / 2}
+
+def nozzle_speed_analysis(positions, speeds, mean_speed: float, tolerance: float, max_delta_position: int, plot_points: int = 2000):
+    '''
+    Nozzle rotation speed analysis, the same per point values the original loop appended to
+    every data point: failure count so far, speed difference to the set mean, position change across 0°, speed
+    normalised to the fastest point and its x and y. "Columns" holds them one row per point since they go into the CSV
+    file, everything else is a summary or a reduced polar plot.
+    '''
+    positions = np.asarray(positions, dtype = np.int64)
+    speeds = np.asarray(speeds, dtype = float)
+    delta_speed = mean_speed - speeds
+    previous = np.concatenate([positions[:1], positions[:-1]])
+    delta_position = np.select([(previous <= 9000) & (positions >= 27000), (previous >= 27000) & (positions <= 9000)],
+                               [-(36000 - positions + previous), 36000 - previous + positions], positions - previous)
+    delta_position[0] = 0
+    failed = np.cumsum(np.abs(delta_speed) > tolerance)
+    max_speed = max(float(speeds.max()), 0) if speeds.size else 0
+    # a stalled nozzle has no fastest point to normalise to, its mean speed fails the rotation speed limits
+    radius = np.round(speeds / max_speed, 4) if max_speed > 0 else np.zeros(speeds.size)
+    angle = np.radians(positions / 100)
+    x_position = np.round(radius * np.cos(angle), 4)
+    y_position = np.round(radius * np.sin(angle), 4)
+    largest = int(np.argmax(np.abs(delta_speed))) if speeds.size else 0
+    plot_index = reduce_for_plot(speeds, plot_points)
+    return {"Columns": np.column_stack([failed, delta_speed, delta_position, radius, x_position, y_position]),
+            "Failed Count": int(failed[-1]) if speeds.size else 0,
+            "Max Difference": float(delta_speed[largest]) if speeds.size and delta_speed[largest] != 0 else 0,
+            "Delta Position Count": int(np.count_nonzero(np.abs(delta_position) >= max_delta_position)),
+            "Max Speed": max_speed, "Mean": float(speeds.mean()) if speeds.size else 0, "STD": float(speeds.std()) if speeds.size else 0,
+            "Plot Angles": -positions[plot_index] / 18000 * np.pi, "Plot Speeds": speeds[plot_index] / 100}
@@ -0,0 +1,282 @@
+import argparse
+import csv
+import datetime
+import json
+import os
+import pathlib
+import re
+import sqlite3
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+
+# Output/ folders holding one raw trace CSV per unit per run
+TRACE_FOLDERS = ["Zero P", "Fully Open", "Closed", "Valve Calibrate", "Nozzle Rotation"]
+ARCHIVE_FOLDER = "Archive"
+CATALOG_NAME = "archive_catalog.db"
+# test time in the CSV file names, "%d-%m-%Y %H_%M_%S" or "%d-%m-%Y %H-%M-%S" with an optional "<duty>DC_" prefix
+FILE_TIME = re.compile(r"(\d{2})-(\d{2})-(\d{4}) (\d{2})[-_](\d{2})[-_](\d{2})")
+
+def trace_time(csv_path: pathlib.Path):
+    "test time from the file name, the file modified time if the name doesn't have one"
+    match = FILE_TIME.search(csv_path.stem)
+    if match is not None:
+        day, month, year, hour, minute, second = (int(value) for value in match.groups())
+        try:
+            return datetime.datetime(year, month, day, hour, minute, second)
+        except ValueError:
+            pass
+    return datetime.datetime.fromtimestamp(csv_path.stat().st_mtime)
+
+def week_name(time: datetime.datetime):
+    year, week, _ = time.isocalendar()
+    return f"{year}-W{week:02d}"
+
+def _column_array(values: list):
+    "numeric column as float64 with NaN for blank cells, anything else as a string array"
+    try:
+        return np.array([float(value) if value != "" else np.nan for value in values], dtype = np.float64)
+    except ValueError:
+        return np.array(values, dtype = str)
+
+def read_trace_csv(csv_path: pathlib.Path):
+    "header and columns of one trace CSV, the first (pandas index) column is dropped since it is just the row number"
+    with open(csv_path, newline = "", encoding = "utf-8") as csv_file:
+        rows = list(csv.reader(csv_file))
+    if not rows:
+        return [], [], 0
+    header = rows[0][1:]
+    for number, row in enumerate(rows[1:], start = 2):
+        if len(row) > len(header) + 1:  # cells past the header would be dropped without changing the row count
+            raise ValueError(f"{csv_path.name}: line {number} has {len(row) - 1} cells but the header has {len(header)}")
+    data = [row[1:] + [""] * (len(header) - len(row) + 1) for row in rows[1:]]
+    columns = [_column_array([row[index] for row in data]) for index in range(len(header))]
+    return header, columns, len(data)
+
+def count_csv_rows(csv_path: pathlib.Path):
+    "data rows in a CSV file, counted separately from the parse so the bundle can be checked against it"
+    with open(csv_path, newline = "", encoding = "utf-8") as csv_file:
+        return max(sum(1 for _ in csv.reader(csv_file)) - 1, 0)
+
+def build_bundle(bundle_path: str, sources: list):
+    '''
+    Parses the CSV files of one fixture, step and week and writes them as one compressed columnar .npz bundle. Files
+    with the same header share a layout, layout n's column i is stored as "c{n}_{i}" with every trace of that layout
+    one after the other. Runs in a worker process.
+
+    sources is a list of [source (path relative to Output/), device ID, test time ISO string, absolute CSV path].
+    Returns the catalog rows [source, device ID, test time, layout, offset, rows] once the written bundle has been read
+    back and every trace's row count matches its CSV file, raises ValueError otherwise and deletes the bundle. A CSV row
+    with more cells than its header is rejected the same way.
+    '''
+    layouts: list = []  # header of each layout
+    layout_columns: list = []  # per layout, per column, list of arrays
+    layout_rows: list = []
+    traces: list = []
+    for source, device_id, test_time, csv_path in sources:
+        header, columns, rows = read_trace_csv(pathlib.Path(csv_path))
+        if header not in layouts:
+            layouts.append(header)
+            layout_columns.append([[] for _ in header])
+            layout_rows.append(0)
+        layout = layouts.index(header)
+        for index, column in enumerate(columns):
+            layout_columns[layout][index].append(column)
+        traces.append([source, device_id, test_time, layout, layout_rows[layout], rows])
+        layout_rows[layout] += rows
+
+    arrays = {"layouts": np.array(json.dumps(layouts)),
+              "trace_source": np.array([trace[0] for trace in traces], dtype = str),
+              "trace_layout": np.array([trace[3] for trace in traces], dtype = np.int32),
+              "trace_offset": np.array([trace[4] for trace in traces], dtype = np.int64),
+              "trace_rows": np.array([trace[5] for trace in traces], dtype = np.int64)}
+    for layout, columns in enumerate(layout_columns):
+        for index, parts in enumerate(columns):
+            if any(part.dtype.kind != "f" for part in parts):  # a column that is text in any file is text for the whole layout
+                parts = [np.where(np.isnan(part), "", part.astype(str)) if part.dtype.kind == "f" else part for part in parts]
+            arrays[f"c{layout}_{index}"] = np.concatenate(parts) if parts else np.zeros(0)
+
+    bundle_path = pathlib.Path(bundle_path)
+    bundle_path.parent.mkdir(parents = True, exist_ok = True)
+    temporary_path = bundle_path.with_name(bundle_path.stem + ".partial.npz")
+    np.savez_compressed(temporary_path, **arrays)
+    os.replace(temporary_path, bundle_path)
+
+    try:
+        with np.load(bundle_path) as bundle:
+            stored_layouts = json.loads(str(bundle["layouts"]))
+            for (source, _, _, csv_path), layout, offset, rows in zip(sources, bundle["trace_layout"], bundle["trace_offset"], bundle["trace_rows"]):
+                expected = count_csv_rows(pathlib.Path(csv_path))
+                column_lengths = {len(bundle[f"c{layout}_{index}"]) for index in range(len(stored_layouts[layout]))}
+                if rows != expected or any(length < offset + rows for length in column_lengths):
+                    raise ValueError(f"{bundle_path.name}: {source} has {expected} rows but {rows} were archived")
+    except Exception:  # an unverified bundle mustn't be left where the next run would take it for an earlier part
+        bundle_path.unlink(missing_ok = True)
+        raise
+    return traces
+
+class TraceArchive:
+    '''
+    Compacts the raw trace CSVs under <fixture folder>/Output into one compressed columnar bundle per step, fixture and
+    ISO week in <fixture folder>/Archive/<step>/<fixture>_<year>-W<week>.npz, parsed in parallel worker processes. Each
+    bundle is read back and its row counts checked against the CSV files before anything is pruned. A SQLite catalog
+    in the Archive folder records which bundle every trace went to, so one trace can be pulled back out on demand.
+
+    Files from the current week are left alone since the fixture is still writing them. Running it again only archives
+    files that aren't in the catalog yet, into a new bundle part.
+
+    to call this,
+    archive = TraceArchive(logFileDirectory)
+    archive.archive(workers = 4, prune = True)
+    archive.extract(device_id = "oto1234567", step = "Zero P", destination = "C:\\Temp\\oto1234567")
+    '''
+    def __init__(self, root, fixture: str = None):
+        self.root = pathlib.Path(root)
+        self.fixture = fixture if fixture is not None else self.root.name
+        self.archive_path = self.root/ARCHIVE_FOLDER
+        self.archive_path.mkdir(parents = True, exist_ok = True)
+        self.connection = sqlite3.connect(str(self.archive_path/CATALOG_NAME))
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS traces (id INTEGER PRIMARY KEY, fixture TEXT, step TEXT, device_id TEXT, test_time TEXT,
+                                       source TEXT UNIQUE, bundle TEXT, layout INTEGER, offset INTEGER, rows INTEGER)""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS traces_device ON traces (device_id, step)")
+
+    def pending(self, before: datetime.datetime = None):
+        "CSV files not archived yet, grouped by bundle path relative to the Archive folder"
+        if before is None:
+            today = datetime.datetime.now()
+            before = datetime.datetime.combine((today - datetime.timedelta(days = today.weekday())).date(), datetime.time())
+        archived = {row[0] for row in self.connection.execute("SELECT source FROM traces")}
+        groups: dict = {}
+        for step in TRACE_FOLDERS:
+            for csv_path in sorted((self.root/"Output"/step).glob("*/*.csv")):
+                source = csv_path.relative_to(self.root/"Output").as_posix()
+                if source in archived:
+                    continue
+                time = trace_time(csv_path)
+                if time >= before:
+                    continue
+                groups.setdefault(f"{step}/{self.fixture}_{week_name(time)}", []).append([source, csv_path.parent.name, time.isoformat(sep = " "), str(csv_path)])
+        return groups
+
+    def _bundle_name(self, group: str):
+        "next free part of the group's bundle, earlier runs' bundles are never rewritten"
+        part = 0
+        name = f"{group}.npz"
+        while (self.archive_path/name).exists():
+            part += 1
+            name = f"{group}_{part}.npz"
+        return name
+
+    def archive(self, workers: int = None, prune: bool = False, before: datetime.datetime = None):
+        "archives every pending CSV, returns [bundles written, traces archived, files pruned, failed bundles]"
+        groups = self.pending(before = before)
+        bundles = traces = pruned = 0
+        failed: list = []
+        with ProcessPoolExecutor(max_workers = workers) as executor:
+            futures = {}
+            for group, sources in groups.items():
+                bundle = self._bundle_name(group)
+                futures[executor.submit(build_bundle, str(self.archive_path/bundle), sources)] = [bundle, sources]
+            for future in as_completed(futures):
+                bundle, sources = futures[future]
+                try:
+                    catalog_rows = future.result()
+                except Exception as e:
+                    failed.append(bundle)
+                    print(f"Couldn't archive {bundle}: {e}")
+                    continue
+                with self.connection:
+                    self.connection.executemany("""INSERT INTO traces (fixture, step, device_id, test_time, source, bundle, layout, offset, rows)
+                                                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                                                [(self.fixture, source.split("/")[0], device_id, test_time, source, bundle, layout, offset, rows)
+                                                 for source, device_id, test_time, layout, offset, rows in catalog_rows])
+                bundles += 1
+                traces += len(catalog_rows)
+                if prune:  # only once the bundle is verified and catalogued
+                    for _, _, _, csv_path in sources:
+                        pathlib.Path(csv_path).unlink()
+                        pruned += 1
+                    for unit_folder in {pathlib.Path(source[3]).parent for source in sources}:
+                        if not any(unit_folder.iterdir()):
+                            unit_folder.rmdir()
+        return [bundles, traces, pruned, failed]
+
+    def find(self, device_id: str = None, step: str = None):
+        "catalog entries of the matching traces, oldest first"
+        conditions = []
+        parameters = []
+        if device_id is not None:
+            conditions.append("device_id = ?")
+            parameters.append(device_id)
+        if step is not None:
+            conditions.append("step = ?")
+            parameters.append(step)
+        query = "SELECT id, fixture, step, device_id, test_time, source, bundle, layout, offset, rows FROM traces"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        cursor = self.connection.execute(query + " ORDER BY test_time", parameters)
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def read(self, entry: dict):
+        "header and columns of one catalogued trace"
+        with np.load(self.archive_path/entry["bundle"]) as bundle:
+            header = json.loads(str(bundle["layouts"]))[entry["layout"]]
+            start, end = entry["offset"], entry["offset"] + entry["rows"]
+            return header, [bundle[f"c{entry['layout']}_{index}"][start:end] for index in range(len(header))]
+
+    def extract(self, destination, device_id: str = None, step: str = None):
+        "writes the matching traces back out as CSV files laid out like Output/, returns the number written"
+        destination = pathlib.Path(destination)
+        count = 0
+        for entry in self.find(device_id = device_id, step = step):
+            header, columns = self.read(entry)
+            csv_path = destination/entry["source"]
+            csv_path.parent.mkdir(parents = True, exist_ok = True)
+            with open(csv_path, mode = "w", newline = "", encoding = "utf-8") as csv_file:
+                csv_writer = csv.writer(csv_file)
+                csv_writer.writerow([""] + header)
+                for index in range(entry["rows"]):
+                    csv_writer.writerow([index] + [_cell(column[index]) for column in columns])
+            count += 1
+        return count
+
+    def close(self):
+        self.connection.close()
+
+def _cell(value):
+    "CSV text of an archived value the way pandas wrote it, blank for NaN and no .0 on whole numbers"
+    if isinstance(value, np.floating):
+        if np.isnan(value):
+            return ""
+        return str(int(value)) if value.is_integer() else repr(float(value))
+    return str(value)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Compact the raw trace CSVs in a fixture's Output folder into weekly compressed bundles")
+    parser.add_argument("folder", help = "fixture log folder holding Output/")
+    parser.add_argument("--fixture", default = None, help = "fixture name for the bundles, defaults to the folder name")
+    subparsers = parser.add_subparsers(dest = "command", required = True)
+    archive_parser = subparsers.add_parser("archive", help = "archive every CSV from before this week")
+    archive_parser.add_argument("--workers", type = int, default = None, help = "worker processes, defaults to the CPU count")
+    archive_parser.add_argument("--prune", action = "store_true", help = "delete the CSV files once their bundle is verified")
+    extract_parser = subparsers.add_parser("extract", help = "write archived traces back out as CSV files")
+    extract_parser.add_argument("destination", help = "folder to write the CSV files to")
+    extract_parser.add_argument("--device", default = None, help = "only this Device ID")
+    extract_parser.add_argument("--step", default = None, choices = TRACE_FOLDERS, help = "only this test step")
+    list_parser = subparsers.add_parser("list", help = "list the archived traces of a unit")
+    list_parser.add_argument("device", help = "Device ID")
+    arguments = parser.parse_args()
+
+    Archive = TraceArchive(arguments.folder, fixture = arguments.fixture)
+    if arguments.command == "archive":
+        Bundles, Traces, Pruned, Failed = Archive.archive(workers = arguments.workers, prune = arguments.prune)
+        print(f"{Traces} traces archived into {Bundles} bundles, {Pruned} CSV files pruned")
+        if Failed:
+            print(f"Not archived, the CSV files were kept: {', '.join(Failed)}")
+    elif arguments.command == "extract":
+        print(f"{Archive.extract(arguments.destination, device_id = arguments.device, step = arguments.step)} traces written to {arguments.destination}")
+    else:
+        for Entry in Archive.find(device_id = arguments.device):
+            print(f"{Entry['test_time']}  {Entry['step']:<16} {Entry['rows']:>6} rows  {Entry['bundle']}")
+    Archive.close()
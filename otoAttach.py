@@ -0,0 +1,130 @@
+import threading
+import time
+import serial.tools.list_ports
+from otoPorts import CP210X_VID, CP210X_PID
+
+def cp210x_port():
+    "name of the OtO serial card's port, None if there isn't exactly one"
+    ports = [port.name for port in serial.tools.list_ports.comports() if port.vid == CP210X_VID and port.pid == CP210X_PID]
+    return ports[0] if len(ports) == 1 else None
+
+class UnitPrefetch:
+    "what the attach watcher read from an OtO before START was pressed"
+    def __init__(self, port: str, firmware: str, mac_address: str):
+        self.port = port
+        self.firmware = firmware
+        self.mac_address = mac_address
+        self.bom_number: str = None  # None if not read (old firmware or blank NVS)
+        self.device_id: str = None
+        self.cloud_request: dict = None  # unit name request sent for this unit and its answer
+        self.cloud_response = None
+        self.time: float = time.perf_counter()
+
+class AttachWatcher:
+    '''
+    Pings the OtO on the serial card's port between test runs, so the identity of a unit is read as soon as its ribbon
+    cable is plugged in instead of after START. A newly attached unit gets its firmware, MAC, BOM and device ID read
+    and, through lookup, the cloud unit name request made; GetUnitName uses that answer if its own request turns out
+    the same. The port is only opened for a ping without reset, and pause() waits for it to be closed again, so START
+    owns the port outright once pause() returns.
+
+    to call this,
+    watcher = AttachWatcher(open_interface = lambda: pyoto.OtoInterface(pyoto.ConnectionType.UART, logger = None), lookup = prefetch_unit_name)
+    watcher.start()
+    watcher.pause()  # at START, before connecting
+    watcher.cloud_response(request_json)  # prefetched answer or None
+    watcher.resume()  # once the port is closed again
+    watcher.close()
+    '''
+    POLL_TIME = 1.0  # sec between pings
+    MAX_AGE = 600  # sec a prefetched cloud answer is used for
+
+    def __init__(self, open_interface, lookup = None, find_port = cp210x_port):
+        self.open_interface = open_interface  # returns a new, unconnected OtoInterface
+        self.lookup = lookup  # lookup(prefetch) returns (request json, response) of the cloud unit name request, or None
+        self.find_port = find_port
+        self.prefetch: UnitPrefetch = None  # unit attached now, None when no OtO answers
+        self.paused: bool = False
+        self.lock = threading.Lock()  # held while the watcher has the port open
+        self.wake = threading.Event()
+        self.closing = threading.Event()
+        self.thread: threading.Thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target = self._run, name = "OtO attach watcher", daemon = True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.closing.is_set():
+            attached = None
+            with self.lock:
+                if not self.paused:
+                    attached = self._poll()
+            if attached is not None and self.lookup is not None and not self.paused:
+                try:
+                    answer = self.lookup(attached)
+                except Exception:
+                    answer = None
+                if answer is not None:
+                    attached.cloud_request, attached.cloud_response = answer
+            self.wake.wait(self.POLL_TIME)
+            self.wake.clear()
+
+    def _poll(self):
+        "pings the OtO once, returns the prefetch of a unit that wasn't attached at the last ping"
+        port = self.find_port()
+        if port is None:
+            self.prefetch = None
+            return None
+        interface = self.open_interface()
+        try:
+            interface.start_connection(port = port, reset_on_connect = False)
+        except Exception:  # no OtO on the ribbon cable
+            self.prefetch = None
+            return None
+        try:
+            firmware = interface.get_firmware_version().string
+            mac_address = interface.get_mac_address().string
+            if self.prefetch is not None and self.prefetch.mac_address == mac_address and self.prefetch.port == port:
+                return None  # same unit still attached
+            prefetch = UnitPrefetch(port, firmware, mac_address)
+            if firmware >= "v3":  # older firmware needs PyOtO 2, which add_device swaps in at START
+                try:
+                    prefetch.bom_number = interface.get_device_hardware_version().string
+                    prefetch.device_id = interface.get_device_id().string or None
+                except Exception:  # blank NVS, GetUnitName reports it at START
+                    pass
+            self.prefetch = prefetch
+            return prefetch
+        except Exception:
+            self.prefetch = None
+            return None
+        finally:
+            try:
+                interface.stop_connection()
+            except Exception:
+                pass
+
+    def pause(self):
+        "stops pinging and waits until the port is closed, returns the prefetch of the attached unit"
+        self.paused = True
+        with self.lock:
+            return self.prefetch
+
+    def resume(self):
+        if self.paused:
+            self.paused = False
+            self.wake.set()
+
+    def cloud_response(self, request_json: dict):
+        "the prefetched answer to request_json, None if it wasn't made for the same unit, BOM and device ID or is too old"
+        prefetch = self.prefetch
+        if prefetch is None or prefetch.cloud_request != request_json or time.perf_counter() - prefetch.time > self.MAX_AGE:
+            return None
+        return prefetch.cloud_response
+
+    def close(self):
+        self.closing.set()
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join(timeout = 5)
@@ -0,0 +1,66 @@
+import threading
+import time
+import otoTimeline
+
+class StepCancelled(Exception):
+    "raised out of a test step when STOP was pressed, the caller shuts the fixture down"
+
+class CancellationToken:
+    '''
+    STOP for a running test step. Tk only runs the STOP button's command when something processes the event queue,
+    so check() pumps it (at most every PUMP_INTERVAL, from the main thread only) and then raises StepCancelled if STOP
+    was pressed. Steps call it in every collection and poll loop, the step unwinds from there and the caller turns the
+    air, motors and pumps off with TestPeripherals.safe_shutdown().
+
+    to call this,
+    token = CancellationToken(pump = window.update)
+    button command: token.cancel()
+    step loop: token.check()  # raises StepCancelled
+    '''
+    PUMP_INTERVAL = 0.02  # sec between Tk event pumps, how late a STOP press can be noticed
+
+    def __init__(self, pump = None):
+        self.pump = pump  # processes pending GUI events so the STOP press reaches cancel()
+        self.cancelled: bool = False
+        self.last_pump: float = 0.0
+
+    def cancel(self):
+        self.cancelled = True
+
+    def reset(self):
+        "ready for the next test run"
+        self.cancelled = False
+
+    def check(self):
+        "raises StepCancelled if STOP was pressed"
+        if self.pump is not None and threading.current_thread() is threading.main_thread():
+            now = time.perf_counter()
+            if now - self.last_pump >= self.PUMP_INTERVAL:
+                self.last_pump = now
+                self.pump()
+        if self.cancelled:
+            raise StepCancelled()
+
+    def sleep(self, seconds: float):
+        "time.sleep that still notices STOP, recorded on the active timeline as one sleep"
+        start_ns = time.perf_counter_ns()
+        end = time.perf_counter() + seconds
+        try:
+            while True:
+                self.check()
+                remaining = end - time.perf_counter()
+                if remaining <= 0:
+                    return
+                time.sleep(min(remaining, self.PUMP_INTERVAL))
+        finally:
+            otoTimeline.record("sleep", "sleep", start_ns, time.perf_counter_ns())
+
+class _NeverCancelled(CancellationToken):
+    "token of steps run on their own (single step buttons, otoReplay), nothing can cancel it"
+    def cancel(self):
+        pass
+
+    def check(self):
+        pass
+
+NEVER_CANCELLED = _NeverCancelled()
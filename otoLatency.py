@@ -0,0 +1,281 @@
+import http.server
+import json
+import pathlib
+import threading
+import time
+from otoTimeline import prune
+
+class LatencyHistogram:
+    '''
+    HDR style latency histogram: exact below 128 µs, then 64 buckets per doubling, so every percentile is within
+    1.6 % of the true value however long the tail gets. Buckets are kept in a dict, a few hundred at most, and
+    recording a value is a couple of integer operations.
+
+    to call this,
+    histogram = LatencyHistogram()
+    histogram.record(1830)  # µs
+    histogram.percentile(99), histogram.summary()
+    '''
+    SUB_BUCKET_BITS = 7
+
+    def __init__(self):
+        self.counts: dict = {}  # bucket index -> count
+        self.count: int = 0
+        self.total: int = 0  # µs
+        self.minimum: int = None
+        self.maximum: int = 0
+
+    def record(self, microseconds: int):
+        microseconds = max(int(microseconds), 0)
+        shift = max(microseconds.bit_length() - self.SUB_BUCKET_BITS, 0)
+        index = (shift << self.SUB_BUCKET_BITS) + (microseconds >> shift)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += microseconds
+        self.minimum = microseconds if self.minimum is None else min(self.minimum, microseconds)
+        self.maximum = max(self.maximum, microseconds)
+
+    def bucket_value(self, index: int):
+        "middle of the bucket in µs"
+        shift = index >> self.SUB_BUCKET_BITS
+        lower = (index - (shift << self.SUB_BUCKET_BITS)) << shift
+        return lower + (1 << shift) // 2
+
+    def percentile(self, percent: float):
+        "latency in µs that percent of the calls were at or under"
+        if self.count == 0:
+            return None
+        target = max(self.count * percent / 100, 1)
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= target:
+                return min(max(self.bucket_value(index), self.minimum), self.maximum)
+        return self.maximum
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        if other.count:
+            self.minimum = other.minimum if self.minimum is None else min(self.minimum, other.minimum)
+        self.count += other.count
+        self.total += other.total
+        self.maximum = max(self.maximum, other.maximum)
+
+    def summary(self):
+        "count and percentiles in ms"
+        if self.count == 0:
+            return {"Count": 0}
+        return {"Count": self.count,
+                "Mean ms": round(self.total / self.count / 1000, 3),
+                "Min ms": self.minimum / 1000,
+                "P50 ms": self.percentile(50) / 1000,
+                "P90 ms": self.percentile(90) / 1000,
+                "P99 ms": self.percentile(99) / 1000,
+                "Max ms": self.maximum / 1000}
+
+    def buckets(self):
+        "[bucket middle ms, count] for every bucket that has calls, to plot the whole distribution"
+        return [[self.bucket_value(index) / 1000, self.counts[index]] for index in sorted(self.counts)]
+
+class CommandStats:
+    "calls, latency, bytes on the link and failures of one DUTMLB method"
+    def __init__(self):
+        self.latency = LatencyHistogram()
+        self.bytes_sent: int = 0
+        self.bytes_received: int = 0
+        self.timeouts: int = 0
+        self.errors: int = 0  # exceptions other than timeouts
+
+    def merge(self, other):
+        self.latency.merge(other.latency)
+        self.bytes_sent += other.bytes_sent
+        self.bytes_received += other.bytes_received
+        self.timeouts += other.timeouts
+        self.errors += other.errors
+
+    def summary(self, buckets: bool = False):
+        result = self.latency.summary()
+        result.update({"Bytes Sent": self.bytes_sent, "Bytes Received": self.bytes_received, "Timeouts": self.timeouts, "Errors": self.errors})
+        if buckets:
+            result["Histogram"] = self.latency.buckets()
+        return result
+
+def is_timeout(error: BaseException):
+    "PyOtO, pyserial and the standard library each have their own timeout exception, all with Timeout in the name"
+    return isinstance(error, TimeoutError) or "timeout" in type(error).__name__.lower()
+
+class LatencyStats:
+    '''
+    Per method statistics of the calls made to the OtO, plus how long the host spent between calls. Slow units can be
+    split three ways: a high latency with few bytes is the OtO firmware answering slowly, latency growing with bytes
+    (or timeouts) points at the CP210x link, and a large host gap is our own loop (plotting, analysis, file writes).
+
+    to call this,
+    stats = LatencyStats()
+    peripherals.start_latency(stats)
+    ...
+    peripherals.stop_latency()
+    stats.summary()
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()  # motion polling calls the OtO from other threads
+        self.commands: dict = {}  # method -> CommandStats
+        self.host_gap = LatencyHistogram()  # µs between the end of one call and the start of the next
+        self.last_end: int = None  # perf_counter_ns of the end of the last call
+
+    def record(self, method: str, start_ns: int, end_ns: int, sent: int, received: int, error: BaseException = None):
+        with self.lock:
+            if method not in self.commands:
+                self.commands[method] = CommandStats()
+            command = self.commands[method]
+            command.latency.record((end_ns - start_ns) // 1000)
+            command.bytes_sent += sent
+            command.bytes_received += received
+            if error is not None:
+                if is_timeout(error):
+                    command.timeouts += 1
+                else:
+                    command.errors += 1
+            if self.last_end is not None and start_ns > self.last_end:
+                self.host_gap.record((start_ns - self.last_end) // 1000)
+            self.last_end = max(end_ns, self.last_end or 0)
+
+    def merge(self, other):
+        with self.lock:
+            for method, command in other.commands.items():
+                self.commands.setdefault(method, CommandStats()).merge(command)
+            self.host_gap.merge(other.host_gap)
+
+    def summary(self, buckets: bool = False):
+        "dict of method -> statistics, slowest total time first, and the host gap between calls"
+        with self.lock:
+            commands = sorted(self.commands.items(), key = lambda item: item[1].latency.total, reverse = True)
+            return {"Commands": {method: command.summary(buckets) for method, command in commands},
+                    "Host Gap": self.host_gap.summary()}
+
+    def save(self, folder, file_name: str, info: dict = None, max_bytes: int = 20000000):
+        "writes the summary with the full histograms to folder/file_name.json and deletes the oldest files until the folder holds at most max_bytes, returns the path"
+        folder = pathlib.Path(folder)
+        folder.mkdir(parents = True, exist_ok = True)
+        path = folder/f"{file_name}.json"
+        with open(path, mode = "w", encoding = "utf-8") as stats_file:
+            json.dump({**(info or {}), **self.summary(buckets = True)}, stats_file, indent = 1, default = str)
+        prune(folder, max_bytes, keep = path)
+        return path
+
+class _ByteCountingPort:
+    "wraps the serial port under OtoInterface and counts the bytes written and read"
+    def __init__(self, port):
+        object.__setattr__(self, "_port", port)
+        object.__setattr__(self, "sent", 0)
+        object.__setattr__(self, "received", 0)
+
+    def write(self, data):
+        written = self._port.write(data)
+        object.__setattr__(self, "sent", self.sent + (written if isinstance(written, int) else len(data)))
+        return written
+
+    def read(self, *args, **kwargs):
+        data = self._port.read(*args, **kwargs)
+        object.__setattr__(self, "received", self.received + len(data or b""))
+        return data
+
+    def read_until(self, *args, **kwargs):
+        data = self._port.read_until(*args, **kwargs)
+        object.__setattr__(self, "received", self.received + len(data or b""))
+        return data
+
+    def readline(self, *args, **kwargs):
+        data = self._port.readline(*args, **kwargs)
+        object.__setattr__(self, "received", self.received + len(data or b""))
+        return data
+
+    def __getattr__(self, name: str):
+        return getattr(self._port, name)
+
+    def __setattr__(self, name: str, value):
+        setattr(self._port, name, value)
+
+class LatencyProxy:
+    '''
+    Wraps the DUTMLB OtoInterface and records every method call in a LatencyStats. The serial port under the interface
+    (DUTMLB.connection.port) is wrapped too, so the bytes written and read while a call runs are put against it;
+    packets a PyOtO reader thread picks up in the background count against whatever call was running.
+    '''
+    def __init__(self, target, stats: LatencyStats):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_stats", stats)
+        object.__setattr__(self, "_port", None)
+        connection = getattr(target, "connection", None)
+        if connection is not None and getattr(connection, "port", None) is not None and not isinstance(connection.port, _ByteCountingPort):
+            object.__setattr__(self, "_port", _ByteCountingPort(connection.port))
+            connection.port = self._port
+
+    def __getattr__(self, name: str):
+        value = getattr(self._target, name)
+        if callable(value):
+            return self._measured_call(name, value)
+        return value
+
+    def __setattr__(self, name: str, value):
+        setattr(self._target, name, value)
+
+    def _measured_call(self, method: str, function):
+        stats = self._stats
+        port = self._port
+        def call(*args, **kwargs):
+            sent, received = (port.sent, port.received) if port is not None else (0, 0)
+            start = time.perf_counter_ns()
+            try:
+                value = function(*args, **kwargs)
+            except Exception as e:
+                end = time.perf_counter_ns()
+                stats.record(method, start, end, port.sent - sent if port is not None else 0, port.received - received if port is not None else 0, error = e)
+                raise
+            end = time.perf_counter_ns()
+            stats.record(method, start, end, port.sent - sent if port is not None else 0, port.received - received if port is not None else 0)
+            return value
+        return call
+
+    def release(self):
+        "puts the real serial port back, returns the interface"
+        connection = getattr(self._target, "connection", None)
+        if self._port is not None and connection is not None and connection.port is self._port:
+            connection.port = object.__getattribute__(self._port, "_port")
+        return self._target
+
+class LatencyServer:
+    '''
+    Serves the latency statistics as JSON on http://127.0.0.1:<port>/ from a daemon thread, so they can be watched
+    with a browser or curl while units are tested. Only listens on localhost.
+
+    to call this,
+    server = LatencyServer(lambda: {"Unit": unit_stats.summary()}, port = 8765)
+    ...
+    server.close()
+    '''
+    def __init__(self, snapshot, port: int = 8765):
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(handler):
+                body = json.dumps(snapshot(), indent = 1, default = str).encode("utf-8")
+                handler.send_response(200)
+                handler.send_header("Content-Type", "application/json")
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, *args):
+                pass  # no console line per request
+
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", port), Handler)
+        self.thread = threading.Thread(target = self.server.serve_forever, name = "Latency stats server", daemon = True)
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
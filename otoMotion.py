@@ -0,0 +1,68 @@
+import time
+import otoTimeline
+
+class MotionFuture:
+    '''
+    A valve or nozzle move that was sent with wait_for_complete = False, so the test can turn on the air or start the
+    next motor while the move finishes. PyOtO only reports CTRL_OUT_COMMAND_COMPLETE to the call that is blocking on it,
+    so completion is decided here by polling the position instead: the move is done once the position is within
+    tolerance of the target and hasn't moved for stable_time.
+
+    to call this,
+    move = move_valve(peripherals_list.DUTMLB, valve_position_centideg = 9000)
+    ... anything that doesn't need the valve in place ...
+    if not move.result():
+        error out, the valve didn't reach the target in time
+    '''
+    POLL_TIME = 0.01  # sec between position reads while waiting
+
+    def __init__(self, name: str, read_position, target: int, tolerance: int = 15, stable_time: float = 0.1, timeout: float = 10):
+        self.name = name
+        self.read_position = read_position  # function returning the current position in centidegrees
+        self.target = target
+        self.tolerance = tolerance
+        self.stable_time = stable_time
+        self.timeout = timeout
+        self.start_time = time.perf_counter()
+        self.complete: bool = False
+        self.last_position: int = None
+        self.stable_since: float = None
+
+    def done(self):
+        "polls the position once, True when the move has finished"
+        if self.complete:
+            return True
+        position = int(self.read_position())
+        now = time.perf_counter()
+        distance = abs((position - self.target + 18000) % 36000 - 18000)
+        if distance > self.tolerance or self.last_position is None or abs((position - self.last_position + 18000) % 36000 - 18000) > 1:
+            self.stable_since = now
+        self.last_position = position
+        if distance <= self.tolerance and now - self.stable_since >= self.stable_time:
+            self.complete = True
+        return self.complete
+
+    @property
+    def timed_out(self):
+        return not self.complete and time.perf_counter() - self.start_time >= self.timeout
+
+    def result(self, cancel = None):
+        "waits for the move to finish, returns False if it didn't within timeout. cancel.check() is called every poll so STOP isn't held up by a move"
+        while not self.done():
+            if self.timed_out:
+                return False
+            if cancel is not None:
+                cancel.check()
+            otoTimeline.sleep(self.POLL_TIME)
+        return True
+
+def move_valve(interface, valve_position_centideg: int, timeout: float = 10):
+    "starts a valve move and returns its MotionFuture"
+    interface.set_valve_position(valve_position_centideg = valve_position_centideg, wait_for_complete = False)
+    return MotionFuture(name = f"Valve to {round(valve_position_centideg/100, 2)}°", read_position = lambda: interface.get_sensors().valve_position_centideg,
+                        target = valve_position_centideg, timeout = timeout)
+
+def home_nozzle(interface, timeout: float = 10):
+    "starts sending the nozzle home and returns its MotionFuture, sensor nozzle positions are relative to home so the target is 0"
+    interface.set_nozzle_position_home(wait_for_complete = False)
+    return MotionFuture(name = "Nozzle home", read_position = lambda: interface.get_sensors().nozzle_position_centideg, target = 0, timeout = timeout)
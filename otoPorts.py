@@ -0,0 +1,102 @@
+import threading
+import time
+import serial.tools.list_ports
+
+CP210X_VID = 0x10C4  # USB IDs of the OtO serial card
+CP210X_PID = 0xEA60
+
+class PortRecord:
+    "one serial port in the inventory, identified by its device name since CP210x cards can share the factory serial number, serial number and USB location are kept to tell the user which card it is"
+    def __init__(self, port_info, now: float):
+        self.name: str = port_info.name
+        self.device: str = port_info.device
+        self.vid: int = port_info.vid
+        self.pid: int = port_info.pid
+        self.serial_number: str = port_info.serial_number
+        self.location: str = port_info.location
+        self.description: str = port_info.description
+        self.arrived: float = now  # perf_counter when it was first seen
+
+    @property
+    def is_oto_card(self):
+        return self.vid == CP210X_VID and self.pid == CP210X_PID
+
+    def __str__(self):
+        return f"{self.name} (SN {self.serial_number or '?'}, {self.location or 'no location'})"
+
+class PortInventory:
+    '''
+    Cached inventory of the serial ports, kept up to date by a daemon thread that lists them every POLL_TIME and notes
+    arrivals and removals, so finding the OtO serial card at START is a dictionary lookup instead of a port scan. A
+    lookup that finds no card rescans once before giving up, a card plugged in less than POLL_TIME ago is still found.
+
+    to call this,
+    inventory = PortInventory()
+    inventory.start()
+    port, reason = inventory.oto_port()  # reason says why port is None
+    inventory.close()
+    '''
+    POLL_TIME = 1.0  # sec between port scans
+    EVENTS_KEPT = 50  # newest arrivals and removals kept for the console
+
+    def __init__(self, list_ports = serial.tools.list_ports.comports):
+        self.list_ports = list_ports
+        self.lock = threading.Lock()
+        self.ports: dict = {}  # device name -> PortRecord
+        self.oto_cards: list = []  # PortRecords of the OtO serial cards, what oto_port() answers from
+        self.events: list = []  # [perf_counter, "arrived"/"removed", PortRecord]
+        self.scanned: float = None  # perf_counter of the last scan
+        self.closing = threading.Event()
+        self.thread: threading.Thread = None
+
+    def start(self):
+        self.refresh()
+        self.thread = threading.Thread(target = self._run, name = "Serial port inventory", daemon = True)
+        self.thread.start()
+
+    def _run(self):
+        while not self.closing.wait(self.POLL_TIME):
+            try:
+                self.refresh()
+            except Exception:  # a port vanishing while it's listed, try again next scan
+                pass
+
+    def refresh(self):
+        "scans the ports now and updates the inventory"
+        now = time.perf_counter()
+        records = [PortRecord(port_info, now) for port_info in self.list_ports()]
+        found = {record.device: record for record in records}
+        with self.lock:
+            for device, record in found.items():
+                known = self.ports.get(device)
+                if known is None or known.serial_number != record.serial_number or known.location != record.location:
+                    self.events.append([now, "arrived", record])
+                else:
+                    record.arrived = known.arrived
+            for device, record in self.ports.items():
+                if device not in found:
+                    self.events.append([now, "removed", record])
+            del self.events[:-self.EVENTS_KEPT]
+            self.ports = found
+            self.oto_cards = sorted((record for record in records if record.is_oto_card), key = lambda record: record.name)
+            self.scanned = now
+
+    def oto_port(self):
+        "(port name, None) if exactly one OtO serial card is connected, otherwise (None, reason)"
+        cards = self.oto_cards
+        if not cards:
+            self.refresh()  # plugged in since the last scan?
+            cards = self.oto_cards
+        if len(cards) == 1:
+            return cards[0].name, None
+        if len(cards) > 1:
+            return None, f"Too many USB cards attached for this test! {', '.join(str(card) for card in cards)}"
+        removed = [record for _, event, record in reversed(self.events) if event == "removed" and record.is_oto_card]
+        if removed:
+            return None, f"USB card {removed[0]} was unplugged, plug it back in."
+        return None, "No USB card found!"
+
+    def close(self):
+        self.closing.set()
+        if self.thread is not None:
+            self.thread.join(timeout = 5)
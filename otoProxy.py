@@ -0,0 +1,163 @@
+import gzip
+import pickle
+import threading
+import time
+import types
+
+PRIMITIVES = (type(None), bool, int, float, complex, str, bytes)
+
+class RecordedObject(types.SimpleNamespace):
+    "stand in for a PyOtO message or other object that can't be pickled, keeps its public attributes"
+
+class ReplayedError(Exception):
+    "stand in for a recorded exception that couldn't be pickled"
+
+_picklable_types: dict = {}  # type -> True if its instances pickle, checked once per type
+
+def portable(value):
+    "value in a form that can be pickled into a session log, unpicklable objects become RecordedObjects of their public attributes"
+    if isinstance(value, PRIMITIVES):
+        return value
+    if isinstance(value, (list, tuple)):
+        return type(value)(portable(entry) for entry in value)
+    if isinstance(value, dict):
+        return {key: portable(entry) for key, entry in value.items()}
+    value_type = type(value)
+    if value_type not in _picklable_types:
+        try:
+            pickle.loads(pickle.dumps(value))
+            _picklable_types[value_type] = True
+        except Exception:
+            _picklable_types[value_type] = False
+    if _picklable_types[value_type]:
+        return value
+    if isinstance(value, BaseException):
+        return ReplayedError(f"{value_type.__name__}: {value}")
+    if hasattr(value, "__dict__"):
+        attributes = {name: entry for name, entry in vars(value).items() if not name.startswith("_")}
+    else:
+        attributes = {name: getattr(value, name) for name in dir(value) if not name.startswith("_")}
+    return RecordedObject(**{name: portable(entry) for name, entry in attributes.items() if not callable(entry)})
+
+class SessionRecorder:
+    '''
+    Writes every call made through a RecordingProxy during a test run to a gzip compressed stream of pickled records,
+    so the run can be replayed offline by otoReplay. Calls are timestamped relative to the start of the session.
+
+    Record kinds:
+    ["snapshot", name, state]  state of an object, e.g. DUTsprinkler at the start and end
+    ["step", name, time]  the test step that the following calls belong to
+    ["call", device, method, args, kwargs, start, end, raised, value]  value is the exception if raised
+    ["attribute", device, name, time, value]  an attribute read
+    ["result", step, test_status, is_passed]  what the step returned
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.file = gzip.open(path, mode = "wb", compresslevel = 6)
+        self.lock = threading.Lock()  # the power trace and motion polling can call from other threads
+        self.start_time = time.perf_counter()
+        self.write(["session", time.time()])
+
+    def now(self):
+        return time.perf_counter() - self.start_time
+
+    def write(self, record: list):
+        with self.lock:
+            if self.file is not None:
+                pickle.dump(record, self.file, protocol = pickle.HIGHEST_PROTOCOL)
+
+    def snapshot(self, name: str, state: dict):
+        self.write(["snapshot", name, {key: portable(value) for key, value in state.items()}])
+
+    def step(self, name: str):
+        self.write(["step", name, self.now()])
+
+    def result(self, step: str, result):
+        self.write(["result", step, result.test_status, result.is_passed])
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+class RecordingProxy:
+    '''
+    Wraps DUTMLB, gpioSuite or i2cSuite and passes every call through to it, writing the call, its result and its
+    timing to a SessionRecorder. Attributes that are objects themselves (gpioSuite.airSolenoidPin) are wrapped too, so
+    airSolenoidPin.set(1) is recorded as device "gpioSuite.airSolenoidPin", method "set".
+    '''
+    def __init__(self, target, device: str, recorder: SessionRecorder):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_device", device)
+        object.__setattr__(self, "_recorder", recorder)
+        object.__setattr__(self, "_children", {})
+
+    def __getattr__(self, name: str):
+        value = getattr(self._target, name)
+        if isinstance(value, PRIMITIVES):
+            self._recorder.write(["attribute", self._device, name, self._recorder.now(), value])
+            return value
+        if callable(value):
+            return self._recording_call(name, value)
+        if name not in self._children:
+            self._children[name] = RecordingProxy(value, f"{self._device}.{name}", self._recorder)
+        return self._children[name]
+
+    def __setattr__(self, name: str, value):
+        setattr(self._target, name, value)
+
+    def _recording_call(self, method: str, function):
+        def call(*args, **kwargs):
+            start = self._recorder.now()
+            try:
+                value = function(*args, **kwargs)
+            except Exception as e:
+                self._recorder.write(["call", self._device, method, portable(args), portable(kwargs), start, self._recorder.now(), True, portable(e)])
+                raise
+            self._recorder.write(["call", self._device, method, portable(args), portable(kwargs), start, self._recorder.now(), False, portable(value)])
+            return value
+        return call
+
+class TimingProxy:
+    '''
+    Wraps DUTMLB, gpioSuite or i2cSuite and adds a span named "<device>.<method>" to an otoTimeline.Timeline for
+    every call. Attributes that are objects themselves are wrapped the same way as in RecordingProxy. The timed wrapper
+    of a method is made once and kept on the proxy, a call costs about a microsecond on top of the device call.
+    '''
+    def __init__(self, target, device: str, timeline):
+        object.__setattr__(self, "_target", target)
+        object.__setattr__(self, "_device", device)
+        object.__setattr__(self, "_timeline", timeline)
+        object.__setattr__(self, "_children", {})
+
+    def __getattr__(self, name: str):
+        value = getattr(self._target, name)
+        if isinstance(value, PRIMITIVES):
+            return value
+        if callable(value):
+            call = self._timed_call(f"{self._device}.{name}", value)
+            if isinstance(value, types.MethodType):  # kept on the proxy, later calls don't go through __getattr__ again
+                object.__setattr__(self, name, call)
+            return call
+        if name not in self._children:
+            self._children[name] = TimingProxy(value, f"{self._device}.{name}", self._timeline)
+        return self._children[name]
+
+    def __setattr__(self, name: str, value):
+        setattr(self._target, name, value)
+
+    def _timed_call(self, span_name: str, function):
+        timeline = self._timeline
+        category = self._device.split(".")[0]
+        def call(*args, **kwargs):
+            start = time.perf_counter_ns()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                timeline.add(span_name, category, start, time.perf_counter_ns())
+        return call
+
+def unwrap(device, proxy_type: type = RecordingProxy):
+    "the object a proxy of proxy_type wraps, or the object itself if it isn't one"
+    return object.__getattribute__(device, "_target") if isinstance(device, proxy_type) else device
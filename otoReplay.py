@@ -0,0 +1,289 @@
+import argparse
+import collections
+import contextlib
+import gzip
+import os
+import pathlib
+import pickle
+import sys
+import tempfile
+import time
+import timeit
+import globalvars
+from otoProxy import ReplayedError
+
+# PyOtO enums in the DUTsprinkler snapshot were pickled under the module names add_device imports them with
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "pyoto", "otoProtocol"))
+
+from otoSprinkler import otoSprinkler
+from otoTests import TestPeripherals, create_test_list
+
+class ReplayMismatch(Exception):
+    "the test step made a call the recorded session has no answer for"
+
+class VirtualClock:
+    "stands in for the time module while a session is replayed, time only moves when a recorded call finishes or the code sleeps"
+    def __init__(self, wall_start: float = 0):
+        self.now: float = 0
+        self.wall_start = wall_start
+
+    def advance_to(self, moment: float):
+        self.now = max(self.now, moment)
+
+    def sleep(self, seconds: float):
+        self.now += max(seconds, 0)
+
+    def time(self):
+        return self.wall_start + self.now
+
+    def perf_counter(self):
+        return self.now
+
+@contextlib.contextmanager
+def virtual_time(clock: VirtualClock):
+    "points time.perf_counter, time.monotonic, time.time, time.sleep and timeit.default_timer at the clock, so timed loops run faster than real time"
+    saved = [time.perf_counter, time.monotonic, time.time, time.sleep, timeit.default_timer]
+    time.perf_counter = time.monotonic = timeit.default_timer = clock.perf_counter
+    time.time = clock.time
+    time.sleep = clock.sleep
+    try:
+        yield clock
+    finally:
+        time.perf_counter, time.monotonic, time.time, time.sleep, timeit.default_timer = saved
+
+def read_session(path):
+    "all records of a session log written by otoProxy.SessionRecorder"
+    records = []
+    with gzip.open(path, mode = "rb") as session_file:
+        while True:
+            try:
+                records.append(pickle.load(session_file))
+            except EOFError:
+                break
+    return records
+
+class SessionPlayer:
+    '''
+    Answers DUTMLB, GPIO and I2C calls from a recorded session. Calls are queued per test step, device and method and
+    handed out in recorded order, each one moving the virtual clock to the time the recorded call finished. A step that
+    polls more often than the recording did gets the last answer again (an empty packet list for
+    read_all_sensor_packets) and the clock moves on by EXHAUSTED_STEP, so time based loops still end. Calls left over
+    at the end of a step are dropped rather than fed to the next step.
+    '''
+    EXHAUSTED_STEP = 0.01  # virtual seconds per call once a step's recorded answers have run out
+    EMPTY_WHEN_EXHAUSTED = {"read_all_sensor_packets": []}
+
+    def __init__(self, path):
+        self.path = path
+        self.snapshots: dict = {}
+        self.recorded_results: list = []  # [step, test status, passed]
+        self.step_times: dict = {}
+        self.calls: dict = {}  # (step, device, method) -> deque of call records
+        self.last_calls: dict = {}  # (step, device, method) -> last record handed out
+        self.attributes: dict = {}  # (step, device, name) -> deque of values
+        self.call_names: set = set()  # (device, method)
+        self.attribute_names: set = set()  # (device, name)
+        self.devices: set = set()
+        self.duration: float = 0
+        wall_start = 0
+        step = None
+        for record in read_session(path):
+            kind = record[0]
+            if kind == "session":
+                wall_start = record[1]
+            elif kind == "snapshot":
+                self.snapshots[record[1]] = record[2]
+            elif kind == "step":
+                step = record[1]
+                self.step_times[step] = record[2]
+            elif kind == "result":
+                self.recorded_results.append(record[1:])
+            elif kind == "call":
+                _, device, method, args, kwargs, start, end, raised, value = record
+                self.calls.setdefault((step, device, method), collections.deque()).append([end, raised, value])
+                self.call_names.add((device, method))
+                self._add_device(device)
+                self.duration = max(self.duration, end)
+            elif kind == "attribute":
+                _, device, name, moment, value = record
+                self.attributes.setdefault((step, device, name), collections.deque()).append(value)
+                self.attribute_names.add((device, name))
+                self._add_device(device)
+        self.step = None
+        self.clock = VirtualClock(wall_start = wall_start)
+
+    def _add_device(self, device: str):
+        parts = device.split(".")
+        for index in range(len(parts)):
+            self.devices.add(".".join(parts[:index + 1]))
+
+    def set_step(self, name: str):
+        self.step = name
+        self.clock.advance_to(self.step_times.get(name, self.clock.now))
+
+    def call(self, device: str, method: str):
+        key = (self.step, device, method)
+        queue = self.calls.get(key)
+        if queue:
+            record = queue.popleft()
+            self.last_calls[key] = record
+            self.clock.advance_to(record[0])
+        else:
+            self.clock.sleep(self.EXHAUSTED_STEP)
+            if method in self.EMPTY_WHEN_EXHAUSTED:
+                return list(self.EMPTY_WHEN_EXHAUSTED[method])
+            if key not in self.last_calls:
+                raise ReplayMismatch(f"{self.step}: {device}.{method}() wasn't called in the recorded session")
+            record = self.last_calls[key]
+        _, raised, value = record
+        if raised:
+            raise value
+        return value
+
+    def attribute(self, device: str, name: str):
+        queue = self.attributes.get((self.step, device, name))
+        if not queue:
+            for (step, recorded_device, recorded_name), values in self.attributes.items():  # read in another step, attributes rarely change
+                if recorded_device == device and recorded_name == name and values:
+                    return values[0]
+            raise ReplayMismatch(f"{self.step}: {device}.{name} wasn't read in the recorded session")
+        return queue.popleft() if len(queue) > 1 else queue[0]
+
+class ReplayProxy:
+    "stands in for DUTMLB, gpioSuite or i2cSuite and answers from a SessionPlayer"
+    def __init__(self, player: SessionPlayer, device: str):
+        object.__setattr__(self, "_player", player)
+        object.__setattr__(self, "_device", device)
+
+    def __getattr__(self, name: str):
+        if (self._device, name) in self._player.attribute_names:
+            return self._player.attribute(self._device, name)
+        if f"{self._device}.{name}" in self._player.devices:
+            return ReplayProxy(self._player, f"{self._device}.{name}")
+        return lambda *args, **kwargs: self._player.call(self._device, name)
+
+    def __setattr__(self, name: str, value):
+        pass
+
+class HeadlessText:
+    "stand in for the Tk text boxes the test steps write to"
+    def __init__(self):
+        self.text = ""
+
+    def delete(self, *args):
+        self.text = ""
+
+    def insert(self, index, text: str):
+        self.text += str(text)
+
+    def get(self, *args):
+        return self.text
+
+    def update(self):
+        pass
+
+class HeadlessParent:
+    '''
+    Stand in for MainWindow with the attributes and methods the test steps use, without Tk or plotting, so the steps
+    can run from a replayed session. Console messages are kept in messages and printed if verbose.
+    '''
+    def __init__(self, verbose: bool = False):
+        self.verbose = verbose
+        self.messages: list = []
+        self.plots: list = []  # names of the plots the steps asked for
+        self.textFirmware = HeadlessText()
+        self.text_bom_number = HeadlessText()
+        self.text_device_id = HeadlessText()
+        self.GraphHolder = None
+        self.trace_store = None
+
+    def text_console_logger(self, display_message: str):
+        self.messages.append(display_message)
+        if self.verbose:
+            print(display_message)
+
+    def create_plot(self, window, plottype: str, xaxis, yaxis, size, name, clear, xtitle = None, ytitle = None, weights = None):
+        self.plots.append(name)
+
+    def show_unit_history(self):
+        pass
+
+    def update(self):
+        pass
+
+def build_peripherals(player: SessionPlayer, parent, output_folder, replay_unit_name: bool):
+    "TestPeripherals for a replay, DUTsprinkler as it was when capture started and the devices answered by the player"
+    peripherals = TestPeripherals(parent)
+    sprinkler = otoSprinkler()
+    sprinkler.__dict__.update(player.snapshots.get("start", {}).get("DUTsprinkler", {}))
+    if not replay_unit_name:  # Unit Name Check talks to the cloud, take the identity it found from the end of the session
+        end = player.snapshots.get("end", {}).get("DUTsprinkler", {})
+        for field in ["deviceID", "macAddress", "bomNumber", "UID"]:
+            if field in end:
+                setattr(sprinkler, field, end[field])
+    if not hasattr(sprinkler, "NoNVSException"):
+        sprinkler.NoNVSException = ReplayedError
+    sprinkler.logFileDirectory = pathlib.Path(output_folder)  # step CSV files go here, not to the production folder
+    peripherals.DUTsprinkler = sprinkler
+    peripherals.pressure_calibration = player.snapshots.get("start", {}).get("pressure_calibration")
+    globalvars.PressureCalibration = peripherals.pressure_calibration
+    for device in TestPeripherals.CAPTURED_DEVICES:
+        if device in player.devices:
+            setattr(peripherals, device, ReplayProxy(player, device))
+    return peripherals
+
+def replay_session(path, parent = None, output_folder = None, steps: list = None, replay_unit_name: bool = False):
+    '''
+    Runs the unchanged test steps against a recorded session on a virtual clock. Returns [[step name, TestResult]] for
+    every replayed step and the SessionPlayer, whose recorded_results hold what the steps returned on the fixture.
+    Steps that weren't recorded, and Unit Name Check unless replay_unit_name, are skipped.
+    '''
+    player = SessionPlayer(path)
+    if parent is None:
+        parent = HeadlessParent()
+    results = []
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        peripherals = build_peripherals(player, parent, output_folder if output_folder is not None else temporary_folder, replay_unit_name)
+        with virtual_time(player.clock):
+            for step in create_test_list(parent = parent):
+                if step.name not in player.step_times or (steps is not None and step.name not in steps):
+                    continue
+                if step.name == "Unit Name Check" and not replay_unit_name:
+                    continue
+                player.set_step(step.name)
+                results.append([step.name, step.run_step(peripherals_list = peripherals)])
+            peripherals.join_motions()
+    return results, player
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Replay recorded returns test sessions through the current test steps and compare the results")
+    parser.add_argument("sessions", nargs = "+", help = ".otosession files or folders of them")
+    parser.add_argument("--steps", nargs = "*", default = None, help = "only these test step names")
+    parser.add_argument("--verbose", action = "store_true", help = "print the console messages of every step")
+    arguments = parser.parse_args()
+
+    SessionPaths = []
+    for Entry in arguments.sessions:
+        Entry = pathlib.Path(Entry)
+        SessionPaths.extend(sorted(Entry.rglob("*.otosession")) if Entry.is_dir() else [Entry])
+    Parent = HeadlessParent(verbose = arguments.verbose)
+    StepCount = Changed = Errors = 0
+    RecordedTime = 0
+    StartTime = timeit.default_timer()
+    for SessionPath in SessionPaths:
+        try:
+            Results, Player = replay_session(SessionPath, parent = Parent, steps = arguments.steps)
+        except Exception as e:
+            Errors += 1
+            print(f"{SessionPath.name}: replay failed, {e!r}")
+            continue
+        RecordedTime += Player.duration
+        Recorded = {Step: [Status, Passed] for Step, Status, Passed in Player.recorded_results}
+        for StepName, Result in Results:
+            StepCount += 1
+            if StepName in Recorded and (Recorded[StepName][1] != Result.is_passed or Recorded[StepName][0] != Result.test_status):
+                Changed += 1
+                print(f"{SessionPath.name} {StepName}: recorded {Recorded[StepName][0]!r}, replayed {Result.test_status!r}")
+    WallTime = timeit.default_timer() - StartTime
+    print(f"{len(SessionPaths)} sessions, {StepCount} steps replayed, {Changed} results changed, {Errors} sessions failed")
+    print(f"{WallTime:.1f} s to replay {RecordedTime:.1f} s of recorded testing ({RecordedTime/max(WallTime, 1e-9):.1f}x real time)")
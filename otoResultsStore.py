@@ -0,0 +1,351 @@
+import argparse
+import csv
+import datetime
+import io
+import json
+import pathlib
+import sqlite3
+from otoSprinkler import otoSprinkler
+from otoTests import (GetUnitNameResult, TestBatteryResult, TestExternalPowerResult, TestPumpResult, SendNozzleHomeResult, PressureCheckResult,
+                      ValveCalibrationResult, VerifyValveOffsetTargetResult, TestMoesFullyOpenResult, NozzleRotationTestWithSubscribeResult,
+                      CheckVacSwitchResult, TestSolarResult)
+
+# column order of the unit results, same as the old ReturnsData.csv so exported files line up with the existing ones
+LOG_COLUMNS = ["Entry Time", "Device ID", "MAC Address", "Firmware", "BOM", "Batch", "Unit Name Time", "Battery", "Battery Time", "Ext Power I","Ext Power V", "Ext Power Time",
+               "Pump 1 Time", "Pump 1 Ave Current", "Pump 1 Current STD", "Pump 2 Time", "Pump 2 Ave Current", "Pump 2 Current STD", "Pump 3 Time", "Pump 3 Ave Current", "Pump 3 Current STD",
+               "Nozzle Offset", "Nozzle Home Time","0 Pressure", "0 Pressure STD", "0 Pressure Time", "Valve Offset", "Valve Offset Time", "Valve Ave Current", "Valve Current STD",
+               "Peak 1 Pressure", "Peak 1 Angle", "Peak 2 Pressure", "Peak 2 Angle", "Closed Pressure", "Closed Pressure STD", "Closed Pressure Time", "Fully Open Trials",
+               "Fully Open 1 Ave", "Fully Open 1 STD", "Fully Open 3 Ave", "Fully Open 3 STD", "Fully Open Time", "Nozzle Speed", "Nozzle Speed STD", "Nozzle Time", "Nozzle Ave Current",
+               "Nozzle Current STD", "Vacuum Fail", "Vacuum Time", "Solar Voltage", "Solar Current", "Solar Time", "Cloud Save", "Cloud Time", "Printed", "Print Time", "Pass Time", "Passed",
+               "Settle Times", "Ext Power I STD", "Stream Quality"]
+STORE_COLUMNS = ["Fixture"] + LOG_COLUMNS  # the database file is per fixture like the CSV was, the column keeps rows apart once databases are merged
+TEXT_COLUMNS = {"Entry Time", "Device ID", "MAC Address", "Firmware", "BOM", "Batch", "Settle Times", "Stream Quality"}  # kept as written when a legacy CSV is imported
+BOOLEAN_COLUMNS = {"Passed"}  # stored as 1/0, written as True/False in exported CSV files like the old file had them
+INDEXED_COLUMNS = {"device": "Device ID", "mac": "MAC Address", "fixture": "Fixture", "entry_time": "Entry Time"}
+# values shown when a unit is identified, when the returns or EOL row has them
+HISTORY_COLUMNS = ["Valve Offset", "Peak 1 Pressure", "Peak 1 Angle", "Peak 2 Pressure", "Peak 2 Angle", "Closed Pressure", "Nozzle Speed", "Nozzle Speed STD",
+                   "Solar Voltage", "Ext Power I", "Passed"]
+
+# result type -> function(result, sprinkler, occurrence) returning {column: value}, occurrence counts results of the same type in one run from 1
+RESULT_COLUMNS: dict = {}
+
+def register_result_columns(result_type: type):
+    "decorator that registers how a TestResult subclass is written to the results columns"
+    def register(mapper):
+        RESULT_COLUMNS[result_type] = mapper
+        return mapper
+    return register
+
+def result_mapper(result):
+    "registered column mapper for the result, looked up through the class hierarchy so subclasses inherit their parent's columns"
+    for result_type in type(result).__mro__:
+        if result_type in RESULT_COLUMNS:
+            return RESULT_COLUMNS[result_type]
+    raise TypeError(f'Program error, unknown test specified: {result}')
+
+@register_result_columns(GetUnitNameResult)
+def _unit_name_columns(result, sprinkler: otoSprinkler, occurrence: int):
+    return {"Unit Name Time": result.cycle_time}
+
+@register_result_columns(TestBatteryResult)
+def _battery_columns(result, sprinkler: otoSprinkler, occurrence: int):
+    return {"Battery Time": result.cycle_time, "Battery": sprinkler.batteryVoltage}
+
+@register_result_columns(TestExternalPowerResult)
+def _external_power_columns(result, sprinkler: otoSprinkler, occurrence: int):
+    return {"Ext Power Time": result.cycle_time, "Ext Power I": sprinkler.extPowerCurrent, "Ext Power V": sprinkler.extPowerVoltage,
+            "Ext Power I STD": sprinkler.extPowerCurrentSTD}
+
+@register_result_columns(TestPumpResult)
+def _pump_columns(result, sprinkler: otoSprinkler, occurrence: int):
+    "pumps are run in order, so the nth pump result is pump n"
+    if occurrence > 3:
+        return {}
+    return {f"Pump {occurrence} Time": result.cycle_time, f"Pump {occurrence} Ave Current": getattr(sprinkler, f"Pump{occurrence}CurrentAve"),
+            f"Pump {occurrence} Current STD": getattr(sprinkler, f"Pump{occurrence}CurrentSTD")}
+
+@register_result_columns(SendNozzleHomeResult)
+def _nozzle_home_columns(result, sprinkler: otoSprinkler, occurrence: int):
+    return {"Nozzle Home Time": result.cycle_time, "Nozzle Offset": sprinkler.nozzleOffset}
+
+@register_result_columns(PressureCheckResult)
+def _zero_pressure_columns(result, sprinkler: otoSprinkler, occurrence: int):
+    return {"0 Pressure Time": result.cycle_time, "0 Pressure": sprinkler.ZeroPressureAve, "0 Pressure STD": sprinkler.ZeroPressureSTD}
+
+@register_result_columns(ValveCalibrationResult)
+def _valve_calibration_columns(result, sprinkler: otoSprinkler, occurrence: int):
+    return {"Valve Offset Time": result.cycle_time, "Valve Ave Current": sprinkler.ValveCurrentAve, "Valve Current STD": sprinkler.ValveCurrentSTD,
+            "Valve Offset": sprinkler.valveOffset, "Peak 1 Pressure": sprinkler.ValvePeak1, "Peak 1 Angle": sprinkler.Peak1Angle,
+            "Peak 2 Pressure": sprinkler.ValvePeak2, "Peak 2 Angle": sprinkler.Peak2Angle}
+
+@register_result_columns(VerifyValveOffsetTargetResult)
+def _closed_pressure_columns(result, sprinkler: otoSprinkler, occurrence: int):
+    columns = {"Closed Pressure Time": result.cycle_time}
+    if sprinkler.valveClosesAve > 0:
+        columns.update({"Closed Pressure": sprinkler.valveClosesAve, "Closed Pressure STD": sprinkler.valveClosesSTD})
+    return columns
+
+@register_result_columns(TestMoesFullyOpenResult)
+def _fully_open_columns(result, sprinkler: otoSprinkler, occurrence: int):
+    columns = {"Fully Open Time": result.cycle_time}
+    if sprinkler.valveFullyOpenTrials > 0:
+        columns.update({"Fully Open Trials": sprinkler.valveFullyOpenTrials, "Fully Open 1 Ave": sprinkler.valveFullyOpen1Ave, "Fully Open 1 STD": sprinkler.valveFullyOpen1STD,
+                        "Fully Open 3 Ave": sprinkler.valveFullyOpen3Ave, "Fully Open 3 STD": sprinkler.valveFullyOpen3STD})
+    return columns
+
+@register_result_columns(NozzleRotationTestWithSubscribeResult)
+def _nozzle_rotation_columns(result, sprinkler: otoSprinkler, occurrence: int):
+    columns = {"Nozzle Time": result.cycle_time, "Nozzle Ave Current": sprinkler.NozzleCurrentAve, "Nozzle Current STD": sprinkler.NozzleCurrentSTD}
+    if sprinkler.nozzleRotationAve > 0:
+        columns.update({"Nozzle Speed": sprinkler.nozzleRotationAve, "Nozzle Speed STD": sprinkler.nozzleRotationSTD})
+    return columns
+
+@register_result_columns(CheckVacSwitchResult)
+def _vacuum_columns(result, sprinkler: otoSprinkler, occurrence: int):
+    return {"Vacuum Time": result.cycle_time, "Vacuum Fail": sprinkler.vacuumFail}
+
+@register_result_columns(TestSolarResult)
+def _solar_columns(result, sprinkler: otoSprinkler, occurrence: int):
+    return {"Solar Time": result.cycle_time, "Solar Voltage": sprinkler.solarVoltage, "Solar Current": sprinkler.solarCurrent}
+
+def build_unit_row(test_result_list: list, sprinkler: otoSprinkler):
+    "one row of unit results from the test results of a run, every result type in the run must be registered"
+    row = dict.fromkeys(STORE_COLUMNS)
+    row.update({"Fixture": sprinkler.testFixtureName,
+                "Entry Time": str(datetime.datetime.now()),
+                "Device ID": sprinkler.deviceID,
+                "MAC Address": sprinkler.macAddress,
+                "Firmware": sprinkler.Firmware,
+                "BOM": sprinkler.bomNumber,
+                "Batch": sprinkler.batchNumber,
+                "Pass Time": sprinkler.passTime,
+                "Passed": sprinkler.passEOL,
+                "Settle Times": "; ".join(f"{name}: {waited}s" + ("" if settled else " (timeout)") for name, waited, settled in sprinkler.settleTimes),
+                "Stream Quality": "; ".join(f"{name}: {description}" + ("" if acceptable else " (rejected)") for name, description, acceptable in sprinkler.streamQuality)})
+    occurrences: dict = {}
+    for entry in test_result_list:
+        if entry.cycle_time is not None and entry.cycle_time > 0:
+            mapper = result_mapper(entry)
+            occurrences[mapper] = occurrences.get(mapper, 0) + 1
+            row.update(mapper(entry, sprinkler, occurrences[mapper]))
+    return row
+
+class ResultsStore:
+    '''
+    SQLite store of unit results, one row per tested unit, replacing the append-only ReturnsData.csv. The log folder can
+    be a synced or network folder, where WAL mode isn't safe, so the database keeps SQLite's default rollback journal.
+    add() commits each unit's row in its own transaction as soon as the unit finishes, so a crash or power cut loses
+    nothing that was already logged. The old ReturnsData.csv is imported once, in one transaction, by import_legacy_csv().
+
+    unit_history is kept up to date as rows are written, and EOL station CSV files are imported incrementally from where
+    the last import stopped, so unit_history() answers from indexes only.
+
+    to call this,
+    store = ResultsStore(pathlib.Path(logFileDirectory)/"OTOLab1ReturnsResults.db")
+    store.import_legacy_csv(pathlib.Path(logFileDirectory)/"OTOLab1ReturnsData.csv", fixture = "OTOLab1")
+    store.add(build_unit_row(test_result_list, sprinkler))
+    store.export_csv("ReturnsData.csv", fixture = "OTOLab1")
+    store.close()
+    '''
+    def __init__(self, db_path):
+        self.db_path = pathlib.Path(db_path)
+        self.connection: sqlite3.Connection = None
+
+    def connect(self):
+        if self.connection is None:
+            self.db_path.parent.mkdir(parents = True, exist_ok = True)
+            self.connection = sqlite3.connect(str(self.db_path), timeout = 10)
+            self.connection.execute("PRAGMA journal_mode = DELETE")  # also takes a database made in WAL mode back to the rollback journal
+            self.create_tables()
+        return self.connection
+
+    def create_tables(self):
+        columns = ", ".join(f'"{column}"' for column in STORE_COLUMNS)
+        with self.connection:
+            self.connection.execute(f"CREATE TABLE IF NOT EXISTS unit_results (id INTEGER PRIMARY KEY, {columns})")
+            existing = [row[1] for row in self.connection.execute("PRAGMA table_info(unit_results)")]
+            for column in STORE_COLUMNS:  # columns added to LOG_COLUMNS after the database was made
+                if column not in existing:
+                    self.connection.execute(f'ALTER TABLE unit_results ADD COLUMN "{column}"')
+            for index_name, column in INDEXED_COLUMNS.items():
+                self.connection.execute(f'CREATE INDEX IF NOT EXISTS unit_results_{index_name} ON unit_results ("{column}")')
+            # one row per unit, updated as results are written so a lookup never has to scan the results
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS unit_history (device_id TEXT PRIMARY KEY, mac TEXT, first_tested TEXT, last_tested TEXT,
+                                       tests INTEGER, passes INTEGER, last_result_id INTEGER)""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS unit_history_mac ON unit_history (mac)")
+            # original end of line results, imported from the EOL station CSV files
+            self.connection.execute("CREATE TABLE IF NOT EXISTS eol_results (id INTEGER PRIMARY KEY, device_id TEXT, mac TEXT, entry_time TEXT, source TEXT, data TEXT)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS eol_results_device ON eol_results (device_id)")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS eol_results_mac ON eol_results (mac)")
+            # how far each EOL CSV file has been imported, so only new lines are read
+            self.connection.execute("CREATE TABLE IF NOT EXISTS eol_imports (path TEXT PRIMARY KEY, offset INTEGER, header TEXT)")
+            # ReturnsData.csv files already imported, each is only imported once
+            self.connection.execute("CREATE TABLE IF NOT EXISTS legacy_imports (path TEXT PRIMARY KEY, rows INTEGER, imported TEXT)")
+
+    def add(self, row: dict):
+        "writes a unit row and commits it straight away"
+        connection = self.connect()
+        with connection:
+            self._insert_row(connection, row)
+
+    def _insert_row(self, connection: sqlite3.Connection, row: dict):
+        "inserts a row and updates its unit's history, older rows (a legacy import) don't replace the latest test"
+        columns = ", ".join(f'"{column}"' for column in STORE_COLUMNS)
+        placeholders = ", ".join("?" for _ in STORE_COLUMNS)
+        result_id = connection.execute(f"INSERT INTO unit_results ({columns}) VALUES ({placeholders})", [row.get(column) for column in STORE_COLUMNS]).lastrowid
+        if row.get("Device ID"):
+            connection.execute("""INSERT INTO unit_history (device_id, mac, first_tested, last_tested, tests, passes, last_result_id) VALUES (?, ?, ?, ?, 1, ?, ?)
+                                  ON CONFLICT (device_id) DO UPDATE SET tests = tests + 1, passes = passes + excluded.passes,
+                                  first_tested = MIN(first_tested, excluded.first_tested),
+                                  mac = CASE WHEN excluded.last_tested >= last_tested THEN excluded.mac ELSE mac END,
+                                  last_result_id = CASE WHEN excluded.last_tested >= last_tested THEN excluded.last_result_id ELSE last_result_id END,
+                                  last_tested = MAX(last_tested, excluded.last_tested)""",
+                               (row.get("Device ID"), row.get("MAC Address"), row.get("Entry Time"), row.get("Entry Time"), int(bool(row.get("Passed"))), result_id))
+
+    def import_legacy_csv(self, csv_path, fixture: str):
+        "imports an old ReturnsData.csv into unit_results and unit_history in one transaction, once per file, returns the number of rows imported"
+        connection = self.connect()
+        path = str(pathlib.Path(csv_path).resolve())
+        if not pathlib.Path(path).exists() or connection.execute("SELECT 1 FROM legacy_imports WHERE path = ?", (path,)).fetchone():
+            return 0
+        with open(path, mode = "r", newline = "", encoding = "utf-8", errors = "replace") as csv_file:
+            rows = [_legacy_row(line, fixture) for line in csv.DictReader(csv_file)]
+        with connection:
+            for row in rows:
+                self._insert_row(connection, row)
+            connection.execute("INSERT INTO legacy_imports (path, rows, imported) VALUES (?, ?, ?)", (path, len(rows), str(datetime.datetime.now())))
+        return len(rows)
+
+    def import_eol_csv(self, csv_path, batch_size: int = 500):
+        "imports the lines added to an EOL station CSV since the last import, returns the number of new rows"
+        connection = self.connect()
+        path = str(pathlib.Path(csv_path).resolve())
+        saved = connection.execute("SELECT offset, header FROM eol_imports WHERE path = ?", (path,)).fetchone()
+        offset, header = saved if saved else (0, None)
+        with open(path, mode = "rb") as csv_file:
+            csv_file.seek(0, io.SEEK_END)
+            if csv_file.tell() < offset:  # file was replaced, start again
+                offset, header = 0, None
+            csv_file.seek(offset)
+            new_bytes = csv_file.read()
+        complete = new_bytes.rfind(b"\n") + 1  # a line still being written is left for next time
+        if complete == 0:
+            return 0
+        lines = list(csv.reader(io.StringIO(new_bytes[:complete].decode("utf-8", errors = "replace"))))
+        if header is None:
+            header = json.dumps(lines.pop(0)) if lines else None
+        columns = json.loads(header) if header else []
+        rows = []
+        for line in lines:
+            data = dict(zip(columns, line))
+            if data.get("Device ID") or data.get("MAC Address"):
+                rows.append((data.get("Device ID"), data.get("MAC Address"), data.get("Entry Time"), path, json.dumps(data)))
+        with connection:
+            for start in range(0, len(rows), batch_size):
+                connection.executemany("INSERT INTO eol_results (device_id, mac, entry_time, source, data) VALUES (?, ?, ?, ?, ?)", rows[start:start + batch_size])
+            connection.execute("INSERT OR REPLACE INTO eol_imports (path, offset, header) VALUES (?, ?, ?)", (path, offset + complete, header))
+        return len(rows)
+
+    def unit_history(self, device_id: str = None, mac: str = None, limit: int = 5):
+        '''
+        Previous tests of a unit, found by device ID or MAC address through the indexes.
+        returns {"Summary": unit_history row as a dict or None, "Returns": latest returns test rows, "EOL": latest EOL row or None}
+        '''
+        connection = self.connect()
+        if device_id:
+            key, value = "device_id", device_id
+        else:
+            key, value = "mac", mac
+        cursor = connection.execute(f"SELECT device_id, mac, first_tested, last_tested, tests, passes FROM unit_history WHERE {key} = ?", (value,))
+        summary = cursor.fetchone()
+        if summary is not None:
+            summary = dict(zip([description[0] for description in cursor.description], summary))
+        returns_column = "Device ID" if device_id else "MAC Address"
+        cursor = connection.execute('SELECT "Entry Time", "Fixture", ' + ", ".join(f'"{column}"' for column in HISTORY_COLUMNS) +
+                                    f' FROM unit_results WHERE "{returns_column}" = ? ORDER BY "Entry Time" DESC LIMIT ?', (value, limit))
+        names = [description[0] for description in cursor.description]
+        returns = [{name: bool(value) if name in BOOLEAN_COLUMNS and value is not None else value for name, value in zip(names, row)} for row in cursor]
+        eol = connection.execute(f"SELECT data FROM eol_results WHERE {key} = ? ORDER BY entry_time DESC LIMIT 1", (value,)).fetchone()
+        return {"Summary": summary, "Returns": returns, "EOL": json.loads(eol[0]) if eol else None}
+
+    def export_csv(self, csv_path, fixture: str = None, since: str = None):
+        "writes the unit results in the old ReturnsData.csv layout, optionally only one fixture and/or entries from since (YYYY-MM-DD) on, returns the row count"
+        connection = self.connect()
+        query = "SELECT " + ", ".join(f'"{column}"' for column in LOG_COLUMNS) + " FROM unit_results"
+        conditions = []
+        parameters = []
+        if fixture is not None:
+            conditions.append('"Fixture" = ?')
+            parameters.append(fixture)
+        if since is not None:
+            conditions.append('"Entry Time" >= ?')
+            parameters.append(since)
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        query += ' ORDER BY "Entry Time"'
+        count = 0
+        with open(csv_path, mode = "w", newline = "") as csv_file:
+            csv_writer = csv.writer(csv_file)
+            csv_writer.writerow(LOG_COLUMNS)
+            for row in connection.execute(query, parameters):
+                csv_writer.writerow([_csv_cell(column, value) for column, value in zip(LOG_COLUMNS, row)])
+                count += 1
+        return count
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+def _legacy_value(column: str, text: str):
+    "a cell of the old ReturnsData.csv as the value add() would have stored"
+    if text is None or text == "":
+        return None
+    if column in BOOLEAN_COLUMNS:
+        return int(text == "True")
+    if column in TEXT_COLUMNS:
+        return text
+    for number_type in (int, float):
+        try:
+            return number_type(text)
+        except ValueError:
+            pass
+    return text
+
+def _legacy_row(line: dict, fixture: str):
+    row = {column: _legacy_value(column, line.get(column)) for column in LOG_COLUMNS}
+    row["Fixture"] = fixture
+    return row
+
+def _csv_cell(column: str, value):
+    "a stored value the way the old ReturnsData.csv wrote it"
+    if value is None:
+        return ""
+    if column in BOOLEAN_COLUMNS:
+        return str(bool(value))
+    return value
+
+def import_eol_folder(db_path, folder, pattern: str):
+    "imports the new lines of every EOL station CSV file in folder matching pattern, with its own connection so it can run in a background thread, returns the number of new rows"
+    store = ResultsStore(db_path)
+    count = 0
+    try:
+        for csv_path in sorted(pathlib.Path(folder).glob(pattern)):
+            try:
+                count += store.import_eol_csv(csv_path)
+            except (OSError, sqlite3.Error, csv.Error, ValueError) as e:  # file locked, not synced yet or database busy, try again with the next unit
+                print(f"Couldn't import {csv_path}: {e}")
+    finally:
+        store.close()
+    return count
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = "Export unit results from the results database to CSV")
+    parser.add_argument("database", help = "results database file")
+    parser.add_argument("csv", help = "CSV file to write")
+    parser.add_argument("--fixture", default = None, help = "only this test fixture")
+    parser.add_argument("--since", default = None, help = "only entries from this date on, YYYY-MM-DD")
+    arguments = parser.parse_args()
+    store = ResultsStore(arguments.database)
+    print(f"{store.export_csv(arguments.csv, fixture = arguments.fixture, since = arguments.since)} rows written to {arguments.csv}")
+    store.close()
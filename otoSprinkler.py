@@ -19,6 +19,7 @@ class otoSprinkler:
 
         self.extPowerCurrent: float = 0
         self.extPowerVoltage: float = 0
+        self.extPowerCurrentSTD: float = 0  # spread of the burst averaged charging current
 
         self.nozzleOffset: int = 0  # represents actual ADC number of nozzle pointed straight ahead
 
@@ -95,4 +96,9 @@ class otoSprinkler:
         self.NoNVSException = None
         self.psig15: int = 0
         self.psig30: int = 0
+        self.SubscribePeriod: float = 10  # ms between sensor packets at SubscribeFrequency
+        self.FastSubscribeFrequency: int = 0  # fastest subscribe rate the firmware offers, for ValveCalibration's angular resolution, its low pass filter is designed at this rate
+        self.FastSubscribeRate: int = 100  # Hz of FastSubscribeFrequency
+        self.streamQuality: list = []  # [window name, StreamQuality.describe(), good enough for a verdict] for every sensor collection window
+        self.settleTimes: list = []  # [wait name, seconds actually waited, settled] for every settling wait, to tune the limits from data
 
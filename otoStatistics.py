@@ -0,0 +1,256 @@
+import math
+import time
+import numpy as np
+
+class RunningStatistics:
+    '''
+    Streaming mean / standard deviation of a sensor value, updated one batch of samples at a time.
+
+    Sums are kept relative to the first sample (shifted data) so that ADC values around 1.7 million with a spread of
+    a few hundred counts don't lose precision. The lag-1 autocorrelation is tracked as well, because the OtO moving
+    average filter makes neighbouring samples far from independent, and the confidence bounds have to use the
+    effective number of samples rather than the raw count.
+
+    to call this,
+    stats = RunningStatistics()
+    stats.add([1702005, 1702110, ...])
+    stats.mean, stats.std, stats.mean_bounds(z = 4), stats.std_bounds(z = 4)
+    '''
+    def __init__(self):
+        self.count: int = 0
+        self.shift: float = 0  # first sample, all sums are relative to this value
+        self.sum: float = 0  # Σ(x - shift)
+        self.sum_squares: float = 0  # Σ(x - shift)²
+        self.sum_lag: float = 0  # Σ(x[i] - shift)(x[i-1] - shift)
+        self.first: float = 0  # first shifted sample, needed to correct the lag sums
+        self.last: float = 0  # last shifted sample, carried between batches for the lag sum
+        self.minimum: float = math.inf
+        self.maximum: float = -math.inf
+
+    def add(self, values):
+        "adds a batch of samples (a single number, list or array)"
+        values = np.asarray(values, dtype = float).ravel()
+        if values.size == 0:
+            return
+        if self.count == 0:
+            self.shift = float(values[0])
+        shifted = values - self.shift
+        if self.count == 0:
+            self.first = float(shifted[0])
+            self.sum_lag += float(np.dot(shifted[1:], shifted[:-1]))
+        else:
+            self.sum_lag += self.last * float(shifted[0]) + float(np.dot(shifted[1:], shifted[:-1]))
+        self.last = float(shifted[-1])
+        self.count += values.size
+        self.sum += float(shifted.sum())
+        self.sum_squares += float(np.dot(shifted, shifted))
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+    @property
+    def mean(self):
+        if self.count == 0:
+            return math.nan
+        return self.shift + self.sum / self.count
+
+    @property
+    def variance(self):
+        "population variance, same as np.var / np.std with the default ddof = 0"
+        if self.count == 0:
+            return math.nan
+        return max(self.sum_squares / self.count - (self.sum / self.count) ** 2, 0.0)
+
+    @property
+    def std(self):
+        return math.sqrt(self.variance)
+
+    @property
+    def autocorrelation(self):
+        "lag-1 autocorrelation estimate, limited to 0 - 0.99 as negative values would only make the bounds optimistic"
+        if self.count < 3 or self.variance == 0:
+            return 0.0
+        m = self.sum / self.count
+        lag_covariance = self.sum_lag - m * ((self.sum - self.first) + (self.sum - self.last)) + (self.count - 1) * m * m
+        return min(max(lag_covariance / (self.count * self.variance), 0.0), 0.99)
+
+    @property
+    def effective_count(self):
+        "number of independent samples the data is worth, assuming first order autoregressive noise"
+        r = self.autocorrelation
+        return max(self.count * (1 - r) / (1 + r), 1.0)
+
+    def mean_bounds(self, z: float):
+        "(lower, upper) confidence bound of the mean, z standard errors wide"
+        if self.count < 2:
+            return (-math.inf, math.inf)
+        half_width = z * self.std / math.sqrt(self.effective_count)
+        return (self.mean - half_width, self.mean + half_width)
+
+    def std_bounds(self, z: float):
+        "(lower, upper) confidence bound of the standard deviation, normal approximation σ·(1 ± z/√(2n))"
+        if self.count < 3:
+            return (0.0, math.inf)
+        relative = z / math.sqrt(2 * max(self.effective_count - 1, 1.0))
+        return (self.std * max(1 - relative, 0.0), self.std * (1 + relative))
+
+def interval_verdict(bounds, minimum: float, maximum: float):
+    "True if the whole confidence interval is within [minimum, maximum], False if it is entirely outside, None if it's not settled yet"
+    lower, upper = bounds
+    if minimum <= lower and upper <= maximum:
+        return True
+    if upper < minimum or lower > maximum:
+        return False
+    return None
+
+def wait_for_settle(read, tolerance: float, timeout: float, window: float = 0.05, minimum_time: float = 0, poll_time: float = 0.005):
+    '''
+    Waits until a signal stops changing, instead of sleeping for a fixed time. read() is called repeatedly and returns
+    one value or a batch of values (e.g. the pressures of the sensor packets received since the last call, may be empty).
+    The values are averaged over windows of window seconds, and the signal is settled when two consecutive window means
+    are within tolerance of each other and at least minimum_time has passed.
+
+    returns (settled, seconds waited, last window mean), settled is False if timeout was reached first
+    '''
+    start_time = time.perf_counter()
+    window_start = start_time
+    window_values: list = []
+    previous_mean = None
+    mean = math.nan
+    while True:
+        values = np.asarray(read(), dtype = float).ravel()
+        window_values.extend(values.tolist())
+        now = time.perf_counter()
+        if now - window_start >= window and window_values:
+            mean = float(np.mean(window_values))
+            if previous_mean is not None and abs(mean - previous_mean) <= tolerance and now - start_time >= minimum_time:
+                return (True, now - start_time, mean)
+            previous_mean = mean
+            window_values = []
+            window_start = now
+        if now - start_time >= timeout:
+            return (False, now - start_time, mean)
+        time.sleep(poll_time)
+
+class StreamQuality:
+    '''
+    Checks the subscribed sensor stream against the rate it was subscribed at, from the OtO time_ms stamps and the
+    host time each batch arrived. Counts lost packets (gaps of more than LATE_FACTOR periods), duplicate and out of
+    order stamps, the jitter of the normal intervals, the drift between DUT and host elapsed time and the longest stall
+    with no packets. A window with problems() says more about the USB link than the unit, so its statistics shouldn't
+    be used for a verdict.
+
+    to call this,
+    quality = StreamQuality(period_ms = 10)
+    quality.add([int(packet.time_ms) for packet in packets])  # every poll, empty batches too
+    quality.acceptable, quality.problems(), quality.describe()
+    '''
+    LATE_FACTOR = 1.5  # an interval this many periods long means packets were lost
+    MAX_LOSS = 0.05  # fraction of the expected packets
+    MAX_DUPLICATES = 0.02  # fraction of the received packets, out of order packets count too
+    MAX_DRIFT = 0.05  # relative difference of host and DUT elapsed time, the host falling behind means packets are backing up
+    MIN_DRIFT_SPAN_MS = 500  # too little DUT time to judge the drift below this
+    MAX_STALL = 0.25  # sec without a packet while subscribed
+
+    def __init__(self, period_ms: float = 10):
+        self.period_ms = period_ms
+        self.received: int = 0
+        self.lost: int = 0
+        self.duplicates: int = 0
+        self.out_of_order: int = 0
+        self.gaps: int = 0  # intervals that lost packets
+        self.jitter_count: int = 0
+        self.jitter_sum: float = 0  # Σ(interval - period) of the intervals without loss
+        self.jitter_sum_squares: float = 0
+        self.first_dut: int = None
+        self.last_dut: int = None
+        self.first_host: float = None  # perf_counter when the first packet arrived
+        self.last_host: float = None  # perf_counter when the last packet arrived
+        self.last_poll: float = None
+        self.max_stall: float = 0
+
+    def add(self, time_ms, host_time: float = None):
+        "adds the time_ms stamps of one batch of packets, host_time is when they were read (now if not given)"
+        host_time = time.perf_counter() if host_time is None else host_time
+        self.last_poll = host_time
+        if len(time_ms) == 0:
+            return
+        stamps = np.asarray(time_ms, dtype = np.int64).ravel()
+        if self.last_dut is None:
+            self.first_dut = int(stamps[0])
+            self.first_host = host_time
+            intervals = np.diff(stamps)
+        else:
+            self.max_stall = max(self.max_stall, host_time - self.last_host)
+            intervals = np.diff(stamps, prepend = self.last_dut)
+        self.received += stamps.size
+        self.duplicates += int(np.count_nonzero(intervals == 0))
+        self.out_of_order += int(np.count_nonzero(intervals < 0))
+        late = intervals > self.LATE_FACTOR * self.period_ms
+        self.gaps += int(np.count_nonzero(late))
+        self.lost += int(np.maximum(np.rint(intervals[late] / self.period_ms) - 1, 1).sum())
+        normal = intervals[(intervals > 0) & ~late] - self.period_ms
+        self.jitter_count += normal.size
+        self.jitter_sum += float(normal.sum())
+        self.jitter_sum_squares += float(np.dot(normal, normal))
+        self.last_dut = max(self.last_dut, int(stamps.max())) if self.last_dut is not None else int(stamps.max())
+        self.last_host = host_time
+
+    @property
+    def dut_span_ms(self):
+        return 0 if self.first_dut is None else self.last_dut - self.first_dut
+
+    @property
+    def rate(self):
+        "packets per second of DUT time"
+        return (self.received - 1) * 1000 / self.dut_span_ms if self.dut_span_ms > 0 else math.nan
+
+    @property
+    def loss(self):
+        return self.lost / (self.received + self.lost) if self.received + self.lost else 0.0
+
+    @property
+    def jitter_ms(self):
+        "standard deviation of the intervals that didn't lose packets"
+        if self.jitter_count < 2:
+            return 0.0
+        mean = self.jitter_sum / self.jitter_count
+        return math.sqrt(max(self.jitter_sum_squares / self.jitter_count - mean * mean, 0.0))
+
+    @property
+    def drift(self):
+        "(host elapsed - DUT elapsed) / DUT elapsed between the first and last packet, 0 until MIN_DRIFT_SPAN_MS of DUT time"
+        if self.dut_span_ms < self.MIN_DRIFT_SPAN_MS:
+            return 0.0
+        return ((self.last_host - self.first_host) * 1000 - self.dut_span_ms) / self.dut_span_ms
+
+    @property
+    def stall(self):
+        "longest time without packets, including since the last one"
+        if self.last_host is None or self.last_poll is None:
+            return self.max_stall
+        return max(self.max_stall, self.last_poll - self.last_host)
+
+    def problems(self):
+        "what is wrong with the stream, empty if it is good enough for a verdict"
+        problems = []
+        if self.loss > self.MAX_LOSS:
+            problems.append(f"{self.lost} packets lost ({round(self.loss*100, 1)}%)")
+        if self.received and (self.duplicates + self.out_of_order) / self.received > self.MAX_DUPLICATES:
+            problems.append(f"{self.duplicates} duplicate and {self.out_of_order} out of order time stamps")
+        if abs(self.drift) > self.MAX_DRIFT:
+            problems.append(f"host and OtO clocks drifted {round(self.drift*100, 1)}%")
+        if self.stall > self.MAX_STALL:
+            problems.append(f"no packets for {round(self.stall, 2)} s")
+        return problems
+
+    @property
+    def acceptable(self):
+        return not self.problems()
+
+    def summary(self):
+        return {"Packets": self.received, "Rate Hz": round(self.rate, 1), "Lost": self.lost, "Duplicates": self.duplicates, "Out Of Order": self.out_of_order,
+                "Jitter ms": round(self.jitter_ms, 2), "Drift %": round(self.drift*100, 2), "Max Stall s": round(self.stall, 3)}
+
+    def describe(self):
+        "one line summary for the logs"
+        return f"{self.received} packets at {round(self.rate, 1)} Hz, {self.lost} lost, {self.duplicates + self.out_of_order} duplicate, jitter {round(self.jitter_ms, 2)} ms, drift {round(self.drift*100, 2)}%, max stall {round(self.stall, 3)} s"
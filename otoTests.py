@@ -5,15 +5,21 @@ import os
 from datetime import datetime
 from typing import Union, List, Dict ,Literal
 from pprint import pformat
+import re
 import requests
 from eolPCBComms import GpioSuite, I2CSuite
 import pandas as pd
 import pathlib
-from scipy import signal
-from scipy.signal import find_peaks
 from otoSprinkler import otoSprinkler
+from otoStatistics import RunningStatistics, StreamQuality, interval_verdict, wait_for_settle
+from otoAnalysis import (OffsetSpanSolver, StreamingPeakTracker, lowpass_sos, valve_curve_span_slope, valve_calibration_analysis, pressure_distribution,
+                         nozzle_speed_analysis)
+from otoMotion import MotionFuture, move_valve, home_nozzle
+from otoProxy import RecordingProxy, SessionRecorder, TimingProxy, unwrap
+from otoTimeline import Timeline, span
+from otoLatency import LatencyProxy, LatencyStats
+from otoCancel import CancellationToken, NEVER_CANCELLED
 import numpy as np
-import math
 import tkinter as tk
 import json
 import matplotlib
@@ -24,8 +30,13 @@ from matplotlib import pyplot as plt
 class TestPeripherals:
     "This class will sort the inputs into objects that have been predefined. Only one com port is supported, and the program won't run if more than one USB card is connected."
 
+    MAX_SUBSCRIBE_RATE = 200  # Hz, fastest sensor subscription asked for, every packet has to fit through the UART link (StreamQuality shows when it doesn't)
+
     def __init__(self, parent: tk, *args, **kwargs):
         self.parent = parent
+        self.pending_motions: List[MotionFuture] = []  # moves left to finish while the next test step runs
+        self.pressure_calibration: PressureCalibration = None  # resolved once per OtO connection in add_device
+        self.recorder: SessionRecorder = None  # set while a session is being captured for otoReplay
         for entry in args:
             if isinstance(entry, otoSprinkler):
                 self.DUTsprinkler = entry
@@ -40,6 +51,9 @@ class TestPeripherals:
         "adds a new OtOSprinkler, GPIOSuite or I2CSuite class to TestPeriperals. Adding an OtOSprinkler will connect to the OtO to determine PyOtO version, remove SSID if it exists to prevent errors."
         if isinstance(new_object, otoSprinkler):
             self.DUTsprinkler = new_object
+            AttachWatcher = getattr(self.parent, "attach_watcher", None)
+            if AttachWatcher is not None:
+                AttachWatcher.pause()  # the port is ours once it returns, ClosePort hands it back
             # first remove PyOtO 2 from the module path sys.path, if it exists
             try:
                 sys.path.remove(os.path.dirname(__file__) + "\pyoto2\otoProtocol")
@@ -55,9 +69,6 @@ class TestPeripherals:
             self.DUTMLB = pyoto.OtoInterface(pyoto.ConnectionType.UART, logger = None)
             self.DUTMLB.start_connection(port = globalvars.PortName, reset_on_connect = True)
             self.DUTsprinkler.Firmware = self.DUTMLB.get_firmware_version().string
-            self.parent.textFirmware.delete(1.0,tk.END)
-            self.parent.textFirmware.insert(tk.END, self.DUTsprinkler.Firmware)
-            self.parent.textFirmware.update()
             if self.DUTsprinkler.Firmware < "v3":
                 self.parent.text_console_logger("changing PyOtO versions to match firmware...")
                 self.DUTMLB.stop_connection()
@@ -83,6 +94,12 @@ class TestPeripherals:
                 self.DUTsprinkler.UID = ""
             except Exception as e:
                 raise TypeError("Error reading UID from OtO!\n" + str(repr(e)))
+            # the identity reads go out back to back behind the reset, the window is only updated once they are in
+            self.DUTsprinkler.macAddress = self.DUTMLB.get_mac_address().string
+            PressureSensorVersion = int(self.DUTMLB.get_pressure_sensor_version().pressure_sensor_version)
+            self.parent.textFirmware.delete(1.0,tk.END)
+            self.parent.textFirmware.insert(tk.END, self.DUTsprinkler.Firmware)
+            self.parent.textFirmware.update()
             if self.DUTsprinkler.UID != None:  # wifi will mess us up, let's remove the UID from the OtO
                 self.parent.text_console_logger(f"Removing UID, SSID {self.DUTsprinkler.UID}")
                 try:
@@ -107,17 +124,13 @@ class TestPeripherals:
                     self.DUTMLB.set_nozzle_home_centidegrees(int(self.DUTsprinkler.nozzleOffset))
             self.DUTsprinkler.SubscribeFrequency = pyoto.SensorSubscribeFrequencyEnum.SENSOR_SUBSCRIBE_FREQUENCY_100Hz
             self.DUTsprinkler.SlowerSubscribeFrequency = pyoto.SensorSubscribeFrequencyEnum.SENSOR_SUBSCRIBE_FREQUENCY_10Hz
+            self.DUTsprinkler.SubscribePeriod = 10
+            self.DUTsprinkler.FastSubscribeFrequency, self.DUTsprinkler.FastSubscribeRate = FastestSubscribeFrequency(pyoto.SensorSubscribeFrequencyEnum, maximum = self.MAX_SUBSCRIBE_RATE)
             self.DUTsprinkler.NoNVSException = pyoto.NotInitializedException
             self.DUTsprinkler.psig15 = otoMessageDefs.PressureSensorVersionEnum.MPRL_15_PSI_GAUGE.value
             self.DUTsprinkler.psig30 = otoMessageDefs.PressureSensorVersionEnum.MPRL_30_PSI_GAUGE.value                
-            self.DUTsprinkler.macAddress = self.DUTMLB.get_mac_address().string
-            PressureSensorVersion = int(self.DUTMLB.get_pressure_sensor_version().pressure_sensor_version)
-            if PressureSensorVersion == self.DUTsprinkler.psig30:
-                globalvars.PressureSensor = 206.8427  # kPa for 30psi
-            elif PressureSensorVersion == self.DUTsprinkler.psig15:
-                globalvars.PressureSensor = 103.4214  # kPa for 15psi
-            else:
-                globalvars.PressureSensor = 0  # error value
+            self.pressure_calibration = PressureCalibration.from_version(PressureSensorVersion, psig15 = self.DUTsprinkler.psig15, psig30 = self.DUTsprinkler.psig30)
+            globalvars.PressureCalibration = self.pressure_calibration
         elif isinstance(new_object, GpioSuite):
             self.gpioSuite = new_object
         elif isinstance(new_object, I2CSuite):
@@ -125,6 +138,78 @@ class TestPeripherals:
         else:
             raise TypeError("UNEXPECTED PROGRAM ERROR!")
         
+    def defer_motion(self, motion: MotionFuture):
+        "lets a move finish in the background, join_motions() must be called before anything depends on it"
+        self.pending_motions.append(motion)
+
+    def join_motions(self, cancel: CancellationToken = NEVER_CANCELLED):
+        "waits for all deferred moves, returns the names of the ones that didn't finish in time"
+        failed = [motion.name for motion in self.pending_motions if not motion.result(cancel)]
+        self.pending_motions.clear()
+        return failed
+
+    PUMP_BAYS = [1, 2, 3]
+
+    def safe_shutdown(self):
+        "air and water off first, then the nozzle and valve motors, the pumps, external power and the LED panel, after STOP. Each command is tried on its own so one failure doesn't leave the rest running, returns the seconds it took"
+        StartTime = time.perf_counter()
+        self.pending_motions.clear()  # abandoned, the motors are stopped below
+        Commands = []
+        if hasattr(self, "gpioSuite"):
+            Commands += [lambda: self.gpioSuite.airSolenoidPin.set(1), lambda: self.gpioSuite.waterSolenoidPin.set(1)]
+        if hasattr(self, "DUTMLB"):
+            Commands += [lambda: self.DUTMLB.set_nozzle_duty(duty_cycle = 0, direction = 0), lambda: self.DUTMLB.set_valve_duty(duty_cycle = 0, direction = 0)]
+            Commands += [lambda pump = pump: self.DUTMLB.set_pump_duty_cycle(pump_bay = pump, pump_duty_cycle = 0) for pump in self.PUMP_BAYS]
+        if hasattr(self, "gpioSuite"):
+            Commands += [lambda: self.gpioSuite.extPowerPin.set(1), lambda: self.gpioSuite.ledPanelPin.set(1)]
+        for Command in Commands:
+            try:
+                Command()
+            except Exception:
+                pass
+        return time.perf_counter() - StartTime
+
+    CAPTURED_DEVICES = ["DUTMLB", "gpioSuite", "i2cSuite"]
+
+    def start_capture(self, path):
+        "records every DUTMLB, GPIO and I2C call to a session log at path until stop_capture(), for replay with otoReplay"
+        self.recorder = SessionRecorder(path)
+        self.recorder.snapshot("start", {"DUTsprinkler": vars(self.DUTsprinkler), "pressure_calibration": self.pressure_calibration})
+        for device in self.CAPTURED_DEVICES:
+            if hasattr(self, device):
+                setattr(self, device, RecordingProxy(getattr(self, device), device, self.recorder))
+
+    def start_latency(self, stats: LatencyStats):
+        "records the latency, bytes and timeouts of every DUTMLB call in stats until stop_latency(), call before start_timeline() and start_capture() so only the OtO call itself is timed"
+        if hasattr(self, "DUTMLB") and not isinstance(self.DUTMLB, LatencyProxy):
+            self.DUTMLB = LatencyProxy(self.DUTMLB, stats)
+
+    def stop_latency(self):
+        if hasattr(self, "DUTMLB") and isinstance(self.DUTMLB, LatencyProxy):
+            self.DUTMLB = self.DUTMLB.release()
+
+    def start_timeline(self, timeline: Timeline):
+        "adds every DUTMLB, GPIO and I2C call to the timeline until stop_timeline()"
+        for device in self.CAPTURED_DEVICES:
+            if hasattr(self, device):
+                setattr(self, device, TimingProxy(getattr(self, device), device, timeline))
+
+    def stop_timeline(self):
+        for device in self.CAPTURED_DEVICES:
+            if hasattr(self, device):
+                setattr(self, device, unwrap(getattr(self, device), TimingProxy))
+
+    def stop_capture(self):
+        "puts the real devices back and closes the session log"
+        if self.recorder is None:
+            return
+        for device in self.CAPTURED_DEVICES:
+            if hasattr(self, device):
+                setattr(self, device, unwrap(getattr(self, device)))
+        self.recorder.snapshot("end", {"DUTsprinkler": vars(self.DUTsprinkler)})
+        self.recorder.close()
+        self.recorder = None
+
     def ClearModules(self):
         "removes PyOtO modules from memory to allow switching between PyOtO versions"
         ModuleList = ["otoPacket", "otoMessageDefs", "otoCommands", "otoUart", "otoBle"]
@@ -165,7 +250,7 @@ class TestStep:
         self.name = name
         self.parent = parent
 
-    def run_step(self, peripherals_list: TestPeripherals):
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
         return
 
 class TestSuite:
@@ -177,25 +262,115 @@ class TestSuite:
         self.test_devices = test_devices
         self.test_type = test_type  # if this is EOL, the test peripheral class is prepped differently.
 
-    def run_test_suite(self, peripherals_list):
+    def run_test_suite(self, peripherals_list, cancel: CancellationToken = NEVER_CANCELLED):
         "Runs through all of the test steps in the suite"
         test_result_list: List[TestResult] = list()
         for i, step in enumerate(self.test_list):
-            test_result_list.append(step.run_step(peripherals_list = peripherals_list))
+            test_result_list.append(step.run_step(peripherals_list = peripherals_list, cancel = cancel))
         return test_result_list
 
+class PressureCalibration:
+    '''
+    ADC to kPa conversion for the pressure sensor of the connected OtO, resolved once from get_pressure_sensor_version
+    when the OtO is added to TestPeripherals. The conversions take a single value or a whole list/array of packets and
+    return the same shape, so a trace is converted in one array operation instead of a Python call per sample.
+    '''
+    ADC_OFFSET = 1677721.6  # ADC reading at 0 kPa, 10% of 2^24
+    ADC_SPAN = 13421772.8  # ADC counts across the sensor's full scale, 80% of 2^24
+    FULL_SCALE_kPa = {"psig30": 206.8427, "psig15": 103.4214}  # kPa at full scale for the 30psi and 15psi sensors
+
+    def __init__(self, full_scale_kPa: float, version: int = None):
+        self.full_scale_kPa = full_scale_kPa  # 0 if the sensor wasn't recognised
+        self.version = version  # PressureSensorVersionEnum value, compare with DUTsprinkler.psig15/psig30 to pick limits
+        self.kPa_per_ADC = full_scale_kPa / self.ADC_SPAN
+
+    @classmethod
+    def from_version(cls, version: int, psig15: int, psig30: int):
+        if version == psig30:
+            return cls(cls.FULL_SCALE_kPa["psig30"], version)
+        elif version == psig15:
+            return cls(cls.FULL_SCALE_kPa["psig15"], version)
+        return cls(0, version)  # error value, every pressure reads 0 kPa
+
+    def to_kPa(self, ADCValue):
+        "converts ADC pressure to kPa"
+        kPa = np.round((np.asarray(ADCValue, dtype = float) - self.ADC_OFFSET) * self.kPa_per_ADC, 5)
+        return float(kPa) if kPa.ndim == 0 else kPa
+
+    def relative_kPa(self, ADCValue):
+        "relative conversion ADC to kPa, for differences and standard deviations"
+        kPa = np.round(np.asarray(ADCValue, dtype = float) * self.kPa_per_ADC, 5)
+        return float(kPa) if kPa.ndim == 0 else kPa
+
 def ADCtokPA(ADCValue):
-    "converts ADC pressure to kPa"
-    return round(((ADCValue - 1677721.6)/13421772.8)*globalvars.PressureSensor, 5)
+    "converts ADC pressure to kPa with the connected OtO's calibration"
+    return globalvars.PressureCalibration.to_kPa(ADCValue)
 
 def RelativekPA(ADCValue):
-    "relative conversion ADC to kPa"
-    return round((ADCValue/13421772.8)*globalvars.PressureSensor, 5)
+    "relative conversion ADC to kPa with the connected OtO's calibration"
+    return globalvars.PressureCalibration.relative_kPa(ADCValue)
+
+def SaveTrace(parent, peripherals_list, step: str, records: dict, info: list):
+    "writes a raw trace to the station's binary trace store, returns False when there is no trace store and the CSV file should be written instead"
+    if parent.trace_store is None:
+        return False
+    with span(f"Trace store {step}", "io"):
+        parent.trace_store.append(device_id = peripherals_list.DUTsprinkler.deviceID, step = step, records = records, info = [str(entry) for entry in info])
+    return True
+
+def FastestSubscribeFrequency(frequency_enum, maximum: int):
+    "the fastest SENSOR_SUBSCRIBE_FREQUENCY_<n>Hz member of the PyOtO enum up to maximum Hz and its rate, (100Hz member, 100) if there's nothing faster"
+    Fastest = (frequency_enum.SENSOR_SUBSCRIBE_FREQUENCY_100Hz, 100)
+    for Name in dir(frequency_enum):
+        Match = re.fullmatch(r"SENSOR_SUBSCRIBE_FREQUENCY_(\d+)Hz", Name)
+        if Match and Fastest[1] < int(Match.group(1)) <= maximum:
+            Fastest = (getattr(frequency_enum, Name), int(Match.group(1)))
+    return Fastest
+
+def StreamCheck(peripherals_list, name: str, quality: StreamQuality):
+    "records the sensor stream quality of a collection window in DUTsprinkler.streamQuality, returns True if the window is good enough for a verdict"
+    acceptable = quality.acceptable
+    if hasattr(peripherals_list, "DUTsprinkler"):
+        peripherals_list.DUTsprinkler.streamQuality.append([name, quality.describe(), acceptable])
+    return acceptable
+
+def StartSensorWindow(peripherals_list, fast: bool = False):
+    "subscribes to sensor packets at SubscribeFrequency, or FastSubscribeFrequency if fast"
+    return peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.FastSubscribeFrequency if fast else peripherals_list.DUTsprinkler.SubscribeFrequency)
+
+def ReadSensorPackets(peripherals_list):
+    "the sensor packets received since the last read"
+    return peripherals_list.DUTMLB.read_all_sensor_packets(limit = None, consume = True)
+
+def ClearSensorPackets(peripherals_list):
+    "drops the sensor packets received so far"
+    return peripherals_list.DUTMLB.clear_incoming_packet_log()
+
+def StopSensorWindow(peripherals_list):
+    "ends a collection by turning the subscription off"
+    ReturnMessage = peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeOff)
+    peripherals_list.DUTMLB.clear_incoming_packet_log()
+    return ReturnMessage
+
+def SensorPacketReader(peripherals_list, field: str):
+    "returns a function that consumes the subscribed sensor packets and gives back one field of each, to watch the stream with SettleWait"
+    return lambda: [int(getattr(packet, field)) for packet in ReadSensorPackets(peripherals_list)]
+
+def SettleWait(peripherals_list, name: str, read, tolerance: float, timeout: float, window: float = 0.05, minimum_time: float = 0, cancel: CancellationToken = NEVER_CANCELLED):
+    "waits until read() stops changing or timeout, and records how long it actually took in DUTsprinkler.settleTimes"
+    def Read():
+        cancel.check()
+        return read()
+    with span(f"Settle {name}", "sleep"):
+        settled, waited, _ = wait_for_settle(read = Read, tolerance = tolerance, timeout = timeout, window = window, minimum_time = minimum_time)
+    if hasattr(peripherals_list, "DUTsprinkler"):
+        peripherals_list.DUTsprinkler.settleTimes.append([name, round(waited, 3), settled])
+    return settled
 
 class CheckVacSwitch(TestStep):
     "Checks is vacuum switches are on"
 
-    def run_step(self,peripherals_list:TestPeripherals):
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
         "Check if any of the vacuum switches are currently tripped"
         startTime = timeit.default_timer()
         pumpErrors: str = ""
@@ -236,7 +411,7 @@ class EstablishLoggingLocation(TestStep):
         self.csv_file_name = csv_file_name # sometimes non-standard
         self.date_time = date_time
 
-    def run_step(self, peripherals_list: TestPeripherals):
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
         startTime = timeit.default_timer()
         if peripherals_list.DUTsprinkler.logFileDirectory is None:
             peripherals_list.DUTsprinkler.logFileDirectory = (pathlib.Path("C:\Data"))
@@ -271,8 +446,10 @@ class GetUnitName(TestStep):
                     "Blank BOM": "OtO computer doesn't have a BOM, can't be tested.",
                     "Can't Write": "Error writing BOM to OtO.",
                     "No Device ID": "OtO doesn't have a unit name, won't check Firebase"}
+    UNIT_NAME_URL = "https://us-central1-oto-test-3254b.cloudfunctions.net/masterGenerateUnit"
+    # UNIT_NAME_URL = 'https://meco-accessor-service-ugegz6xfpa-pd.a.run.app/oto/meco/masterGenerateUnit'
 
-    def run_step(self, peripherals_list: TestPeripherals):
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
         startTime = timeit.default_timer()
 
         # If there isn't a BOM stop and error out
@@ -307,38 +484,54 @@ class GetUnitName(TestStep):
             if existingSerial[0:3] == "oto" and len(existingSerial) == 10 and existingSerial[3:10].isnumeric():  # is the Device ID valid?
                 EstablishLoggingLocation(name = None, folder_name = None, csv_file_name = None, parent = self.parent).run_step(peripherals_list = peripherals_list)
                 self.parent.text_console_logger(f"{existingSerial}, {existingBOM}, {peripherals_list.DUTsprinkler.macAddress}, UID => {peripherals_list.DUTsprinkler.UID}")
+                self.parent.show_unit_history()
                 return GetUnitNameResult(test_status = None, step_start_time = startTime)
             else: # Invalid unit name
                 return GetUnitNameResult(test_status = f"Invalid unit name: {existingSerial}", step_start_time = startTime)                
         else:
             return GetUnitNameResult(test_status = self.ERRORS.get("No Device ID"), step_start_time = startTime)
         
-    def otoGenerateSerialRequest(self, peripherals_list: TestPeripherals, existingSerial: str = None):
-        "Send HTTP request to oto-generate-unit function, optionally using given unit name. Args: existingSerial (optional): given unit name if required. Returns: None if OK, otherwise error as String"
-        if "OTO" in peripherals_list.DUTsprinkler.factoryLocation.upper():
+    @staticmethod
+    def unit_name_request(bom_number: str, batch_number: str, mac_address: str, factory_location: str, existing_serial: str = None):
+        "JSON body of the oto-generate-unit request, factory_location is the EOL board's"
+        if "OTO" in factory_location.upper():
             factory_location = "OTO_MFG"
         else:
             factory_location = "MECO_MFG"
-        oto_generate_unit_url = "https://us-central1-oto-test-3254b.cloudfunctions.net/masterGenerateUnit"
-        # oto_generate_unit_url = 'https://meco-accessor-service-ugegz6xfpa-pd.a.run.app/oto/meco/masterGenerateUnit'
         requestJson = {
             "key": "XJhbCu4ujfJF3Ugu",
-            "bomNumber": peripherals_list.DUTsprinkler.bomNumber,
-            "batchNumber": peripherals_list.DUTsprinkler.batchNumber,
-            "macAddress": peripherals_list.DUTsprinkler.macAddress,
+            "bomNumber": bom_number,
+            "batchNumber": batch_number,
+            "macAddress": mac_address,
             "flashFactoryLocation": factory_location
         }
-        if existingSerial is not None:
-            requestJson["unitSerial"] = existingSerial
-        try:
-            self.parent.text_console_logger("Cloud communication...")            
-            response = requests.post(oto_generate_unit_url, json = requestJson, timeout = 10, allow_redirects = False)
-        except requests.exceptions.ConnectTimeout as error:
-            return f"Time out connecting to Firebase website {oto_generate_unit_url}"
-        except requests.exceptions.ConnectionError as error:
-            return f"Connection error to Firebase website {oto_generate_unit_url}"
-        except Exception as error:
-            return f"Unknown HTTP Request Exception:\n{repr(error)}"
+        if existing_serial is not None:
+            requestJson["unitSerial"] = existing_serial
+        return requestJson
+
+    @classmethod
+    def post_unit_name_request(cls, request_json: dict):
+        with span("Cloud unit name request", "cloud"):
+            return requests.post(cls.UNIT_NAME_URL, json = request_json, timeout = 10, allow_redirects = False)
+
+    def otoGenerateSerialRequest(self, peripherals_list: TestPeripherals, existingSerial: str = None):
+        "Send HTTP request to oto-generate-unit function, optionally using given unit name. Args: existingSerial (optional): given unit name if required. Returns: None if OK, otherwise error as String"
+        requestJson = self.unit_name_request(bom_number = peripherals_list.DUTsprinkler.bomNumber, batch_number = peripherals_list.DUTsprinkler.batchNumber,
+                                             mac_address = peripherals_list.DUTsprinkler.macAddress, factory_location = peripherals_list.DUTsprinkler.factoryLocation, existing_serial = existingSerial)
+        AttachWatcher = getattr(self.parent, "attach_watcher", None)
+        response = AttachWatcher.cloud_response(requestJson) if AttachWatcher is not None else None
+        if response is not None:
+            self.parent.text_console_logger("Cloud answer was fetched when the OtO was attached.")
+        else:
+            try:
+                self.parent.text_console_logger("Cloud communication...")            
+                response = self.post_unit_name_request(requestJson)
+            except requests.exceptions.ConnectTimeout as error:
+                return f"Time out connecting to Firebase website {self.UNIT_NAME_URL}"
+            except requests.exceptions.ConnectionError as error:
+                return f"Connection error to Firebase website {self.UNIT_NAME_URL}"
+            except Exception as error:
+                return f"Unknown HTTP Request Exception:\n{repr(error)}"
         # Parse response body as a JSON
         try:
             responseJson = response.json()
@@ -394,7 +587,9 @@ class NozzleRotationTestWithSubscribe(TestStep):
                             "Backwards": "Nozzle rotated backwards!",
                             "IDK": "Unexpected error during nozzle rotation!",
                             "Max_STD" : "Nozzle speed variation was too large.",
-                            "Min_STD" : "Nozzle speed variation was unusually small."}
+                            "Min_STD" : "Nozzle speed variation was unusually small.",
+                            "Early_Abort": "Nozzle speed was grossly out of range, stopped the duty cycle rotation early.",
+                            "Stream": "Nozzle data from OtO was unreliable, check the USB link and test again:"}
     TIMEOUT = 25 # in sec
     Nozzle_Duty_Cycle = 30  # % of full
     MAXRotationSpeed: int = 3943  # Mar 2411 data 3943
@@ -406,13 +601,31 @@ class NozzleRotationTestWithSubscribe(TestStep):
     MINNMotorCurrent = 31  # 2410 data
     MAXNMotorCurrentSTD = 12.5  # 2411 data 12.5
     MINNMotorCurrentSTD = 0.8  # 2411 data 0.8
+    InitialAngularDelay = 1000 # in centideg, rotation before recording starts
+    # the duty cycle pass is stopped early only on gross failures, speed depends on angle at the friction points so a
+    # partial revolution can't be held to the speed limits. The first ABORT_ARC of recorded rotation has to average
+    # within the speed limits widened by GROSS_SPEED_FACTOR (a passing unit's speed varies by at most Max_STD, about 11 %)
+    ABORT_ARC = 9000  # centideg
+    GROSS_SPEED_FACTOR = 2
+    SETTLE_TOLERANCE = 100  # centideg/sec change of the mean nozzle speed between windows that counts as spun up
+
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
+        "the nozzle homes in the background while the speeds are analysed, plotted and saved, it has to be home before the next step measures anything"
+        startTime = timeit.default_timer()
+        result = self.Rotation_Passes(peripherals_list = peripherals_list, cancel = cancel)
+        if peripherals_list.join_motions(cancel):
+            peripherals_list.DUTMLB.set_nozzle_duty(0, 0)
+            test_status = self.ERRORS.get("Timeout_N") if result.is_passed else f"{result.test_status}\n{self.ERRORS.get('Timeout_N')}"
+            return NozzleRotationTestWithSubscribeResult(test_status = test_status, step_start_time = startTime, Friction_Points = result.Friction_Points, Nozzle_Rotation_Data = result.Nozzle_Rotation_Data)
+        return result
 
-    def run_step(self, peripherals_list: TestPeripherals):
+    def Rotation_Passes(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
+        "duty cycle pass, then the speed target pass if that failed"
         startTime = timeit.default_timer()
         nozzle_rotation_test_failure_count = 0
         data_collection_status: int = None
 
-        rawdata = self.Collecting_Nozzle_Rotation_Data(peripherals_list = peripherals_list, cycle = "duty")
+        rawdata = self.Collecting_Nozzle_Rotation_Data(peripherals_list = peripherals_list, cycle = "duty", cancel = cancel)
         # data_collection_status = 0 if all OK, 1 if List is empty, 2 if Timeout, 3 Unknown
         data_collection_status = rawdata.get("Status_Check")
         Nozzle_Rotation_Test_Data = rawdata.get("Collected_Data_List")
@@ -421,7 +634,7 @@ class NozzleRotationTestWithSubscribe(TestStep):
         Timeout_Location = rawdata.get("TimeoutWhere")
 
         if data_collection_status == 0:
-            dataPointsWithFailureCount = self.Nozzle_Rotation_Speed_Calculator(peripherals_list, Nozzle_Rotation_Test_Data)
+            dataPointsWithFailureCount = self.Nozzle_Rotation_Speed_Calculator(peripherals_list, Nozzle_Rotation_Test_Data, rawdata.get("Speed_Statistics"))
             nozzle_rotation_test_failure_count = dataPointsWithFailureCount.get("Failure_Counter")
             nozzle_rotation_test_Max_STD_failure = dataPointsWithFailureCount.get("Max_STD_Limit")
             nozzle_rotation_test_Min_STD_failure = dataPointsWithFailureCount.get("Min_STD_Limit")
@@ -476,12 +689,16 @@ class NozzleRotationTestWithSubscribe(TestStep):
             self.parent.text_console_logger(self.ERRORS.get("Data_colection_timeout") + f"Failed at {Timeout_Location}")
         elif data_collection_status == 5:
             self.parent.text_console_logger(self.ERRORS.get("Backwards"))
+        elif data_collection_status == 6:
+            self.parent.text_console_logger(f"Nozzle Rotation Speed: {round(rawdata.get('Arc_Speed')/100, 2)}°/sec over {rawdata.get('Recorded_Rotation')/100}°\n" + self.ERRORS.get("Early_Abort"))
+        elif data_collection_status == 7:
+            self.parent.text_console_logger(f"{self.ERRORS.get('Stream')} {', '.join(rawdata.get('Stream_Problems'))}.")
         else:
             self.parent.text_console_logger(self.ERRORS.get("IDK"))
 
         # End of line based method failed, try again with speed target
         self.parent.text_console_logger(f"Trying nozzle rotation again with speed target {self.Nozzle_Speed/100}°/sec...")
-        rawdata = self.Collecting_Nozzle_Rotation_Data(peripherals_list = peripherals_list, cycle = "speed")
+        rawdata = self.Collecting_Nozzle_Rotation_Data(peripherals_list = peripherals_list, cycle = "speed", cancel = cancel)
         # data_collection_status = 0 if all OK, 1 if List is empty, 2 if Timeout, 3 Unknown
         data_collection_status = rawdata.get("Status_Check")
         Nozzle_Rotation_Test_Data = rawdata.get("Collected_Data_List")
@@ -490,7 +707,7 @@ class NozzleRotationTestWithSubscribe(TestStep):
         Timeout_Location = rawdata.get("TimeoutWhere")
 
         if data_collection_status == 0:
-            dataPointsWithFailureCount = self.Nozzle_Rotation_Speed_Calculator(peripherals_list, Nozzle_Rotation_Test_Data)
+            dataPointsWithFailureCount = self.Nozzle_Rotation_Speed_Calculator(peripherals_list, Nozzle_Rotation_Test_Data, rawdata.get("Speed_Statistics"))
             nozzle_rotation_test_failure_count = dataPointsWithFailureCount.get("Failure_Counter")
             nozzle_rotation_test_Max_STD_failure = dataPointsWithFailureCount.get("Max_STD_Limit")
             nozzle_rotation_test_Min_STD_failure = dataPointsWithFailureCount.get("Min_STD_Limit")
@@ -527,110 +744,126 @@ class NozzleRotationTestWithSubscribe(TestStep):
             return NozzleRotationTestWithSubscribeResult(test_status = self.ERRORS.get("Data_colection_timeout") + f"Failed at {Timeout_Location}", step_start_time = startTime, Friction_Points = nozzle_rotation_test_failure_count, Nozzle_Rotation_Data = Nozzle_Rotation_Test_Data)
         elif data_collection_status == 5:
             return NozzleRotationTestWithSubscribeResult(test_status = self.ERRORS.get("Backwards"), step_start_time = startTime, Friction_Points = nozzle_rotation_test_failure_count, Nozzle_Rotation_Data = Nozzle_Rotation_Test_Data)
+        elif data_collection_status == 7:
+            return NozzleRotationTestWithSubscribeResult(test_status = f"{self.ERRORS.get('Stream')} {', '.join(rawdata.get('Stream_Problems'))}.", step_start_time = startTime, Friction_Points = nozzle_rotation_test_failure_count, Nozzle_Rotation_Data = Nozzle_Rotation_Test_Data)
         else:
             return NozzleRotationTestWithSubscribeResult(test_status = self.ERRORS.get("IDK"), step_start_time = startTime, Friction_Points=nozzle_rotation_test_failure_count, Nozzle_Rotation_Data = Nozzle_Rotation_Test_Data)
 
-    def Collecting_Nozzle_Rotation_Data(self, peripherals_list: TestPeripherals, cycle: str = "duty"):
-        "Collects nozzle position and speed data for 360°"
+    def Collecting_Nozzle_Rotation_Data(self, peripherals_list: TestPeripherals, cycle: str = "duty", cancel: CancellationToken = NEVER_CANCELLED):
+        "Collects nozzle position and speed data for 360°, the nozzle is left homing in the background at the end"
         startTime = timeit.default_timer()
-        Sensor_Read_List: list = []
         Nozzle_Rotation_Data: list = []
         NozzleCurrent: list = []
-        InitialAngularDelay = 1000 # in centideg
         check_stat: int = None # Will return 0 if all OK, 1 if List is empty, 2 if Timeout, 3 Unknown
      
+        if peripherals_list.join_motions(cancel):  # a deferred nozzle homing from an earlier run must finish first
+            return {"Status_Check": 2 , "TimeoutWhere": 1 , "Collected_Data_List": Nozzle_Rotation_Data}
         try:  # Sending Nozzle Home
-            ReturnMessage = peripherals_list.DUTMLB.set_nozzle_position_home(wait_for_complete = True)
+            NozzleHome = home_nozzle(peripherals_list.DUTMLB, timeout = self.TIMEOUT)
         except TimeoutError:
             return {"Status_Check": 2 , "TimeoutWhere": 1 , "Collected_Data_List": Nozzle_Rotation_Data}
         except Exception as e:
             self.parent.text_console_logger(str(e))
             return {"Status_Check": 3 , "TimeoutWhere": 1 , "Collected_Data_List": Nozzle_Rotation_Data}
         
-        if ReturnMessage.message_type_string != "CTRL_OUT_COMMAND_COMPLETE":
+        if not NozzleHome.result(cancel):
             peripherals_list.DUTMLB.set_nozzle_duty(0, 0)
             return {"Status_Check": 2 , "TimeoutWhere": 1 , "Collected_Data_List": Nozzle_Rotation_Data}
 
         DataPointCounter = 0
         peripherals_list.DUTMLB.use_moving_average_filter(True)
         CurrentNozzlePosition = int(peripherals_list.DUTMLB.get_sensors().nozzle_position_centideg)
-        StartPosition = (CurrentNozzlePosition + InitialAngularDelay) % 36000
-        if StartPosition < CurrentNozzlePosition:  # StartPosition has to pass through 360° first before recording starts.
-            FlipFirst = True
-        else:  # StartPosition doesn't require passing through 360° before recording starts.
-            FlipFirst = False
+        Travel = 0  # unwrapped forward rotation in centideg since the motor was started
+        RecordStart = self.InitialAngularDelay
+        RecordEnd = self.InitialAngularDelay + 36000
+        SpeedStatistics = RunningStatistics()
+        streamQuality = StreamQuality(period_ms = peripherals_list.DUTsprinkler.SubscribePeriod)
 
-        Sensor_Read_List.clear()  # make sure list is empty
         NozzleCurrent.clear()  # make sure list is empty
-        Recording = False
         RotationComplete = False
         Backwards = False
+        EarlyAbort = False
+        RecordStartTime: int = None  # time_ms of the first recorded point
+        ArcSpeed: float = 0  # centideg/sec over the recorded rotation when the early abort was checked
         # start nozzle motor turning at desired duty cycle / speed      
         if cycle == "duty":
             peripherals_list.DUTMLB.set_nozzle_duty(duty_cycle = self.Nozzle_Duty_Cycle, direction = 1)
         else:
             peripherals_list.DUTMLB.set_nozzle_speed(speed_centidegrees_per_sec = self.Nozzle_Speed, direction = 1)
         # turn on OtO data acquisition at 100Hz
-        peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeFrequency)
-        time.sleep(0.1)
-        peripherals_list.DUTMLB.clear_incoming_packet_log()
+        StartSensorWindow(peripherals_list)
+        SettleWait(peripherals_list, name = f"Nozzle {cycle} spin up", read = SensorPacketReader(peripherals_list, "nozzle_speed_centideg_per_sec"),
+                   tolerance = self.SETTLE_TOLERANCE, timeout = 0.1, window = 0.03, cancel = cancel)
+        ClearSensorPackets(peripherals_list)
 
         while (timeit.default_timer() - startTime) <= self.TIMEOUT and not RotationComplete:
+            cancel.check()
             NozzleCurrent.extend([round(float(peripherals_list.DUTMLB.get_currents().nozzle_current_mA), 3)])
-            read_all_sensor_outputs = peripherals_list.DUTMLB.read_all_sensor_packets(limit = None, consume = True)
-            for ReadPoint in read_all_sensor_outputs:
-                PreviousNozzlePosition = CurrentNozzlePosition
-                CurrentNozzlePosition = int(ReadPoint.nozzle_position_centideg)
-                if CurrentNozzlePosition < PreviousNozzlePosition:  # either rotating backwards or passed 360°
-                    if np.sin(np.pi*PreviousNozzlePosition/18000) < 0:  # sine should be negative in previous position if passing 360°
-                        if FlipFirst:
-                            FlipFirst = False
-                    else:  # if sine is positive and previous is greater than current position, the nozzle is turning backward so shut down data collection and rotation on the OtO, then error out.
-                        RotationComplete = True
-                        Backwards = True
-                if Recording:
-                    Sensor_Read_List.append(ReadPoint)
-                    if not FlipFirst:
-                        if CurrentNozzlePosition >= StartPosition:
-                            RotationComplete = True
-                            break
-                elif not FlipFirst:  # now past 360°, so check for StartPosition to start recording
-                    if CurrentNozzlePosition >= StartPosition:
-                        Recording = True
-                        FlipFirst = True
+            read_all_sensor_outputs = ReadSensorPackets(peripherals_list)
+            if not read_all_sensor_outputs:
+                streamQuality.add([])
+                continue
+            Batch = np.array([[int(ReadPoint.time_ms), int(ReadPoint.nozzle_position_centideg), int(ReadPoint.nozzle_speed_centideg_per_sec)] for ReadPoint in read_all_sensor_outputs])
+            streamQuality.add(Batch[:, 0])
+            Positions = np.concatenate(([CurrentNozzlePosition], Batch[:, 1]))
+            Steps = np.diff(Positions)
+            # a position drop is passing 360° if the previous position was in the second half of the circle (sine negative), otherwise the nozzle is turning backward
+            Reversed = np.flatnonzero((Steps < 0) & (Positions[:-1] <= 18000))
+            if Reversed.size:  # shut down data collection and rotation on the OtO, then error out
+                Batch = Batch[:Reversed[0] + 1]
+                Steps = Steps[:Reversed[0] + 1]
+                Steps[-1] = 0
+                RotationComplete = True
+                Backwards = True
+            BatchTravel = Travel + np.cumsum(Steps % 36000)
+            PreviousTravel = np.concatenate(([Travel], BatchTravel[:-1]))
+            # a point is recorded if the nozzle had already passed the start position at the previous point, up to and including the point that completes 360°
+            Recorded = Batch[(PreviousTravel >= RecordStart) & (PreviousTravel < RecordEnd)]
+            Travel = int(BatchTravel[-1])
+            CurrentNozzlePosition = int(Batch[-1, 1])
+            if Recorded.size:
+                if RecordStartTime is None:
+                    RecordStartTime = int(Recorded[0, 0])
+                Nozzle_Rotation_Data.extend(Recorded.tolist())
+                SpeedStatistics.add(Recorded[:, 2])
+            if Travel >= RecordEnd:
+                RotationComplete = True
+            elif cycle == "duty" and not Backwards and RecordStartTime is not None and streamQuality.acceptable:
+                # the speed target pass follows a failed duty cycle pass anyway, so stop once the unit is certain to fail
+                EarlyAbort, ArcSpeed = self.Gross_Speed_Failure(arc = Travel - RecordStart, elapsed_ms = int(Batch[-1, 0]) - RecordStartTime)
+                RotationComplete = EarlyAbort
 
         # turn off OtO data acquisition
-        peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeOff)
-        peripherals_list.DUTMLB.clear_incoming_packet_log()
-        # turn off nozzle rotation
-        peripherals_list.DUTMLB.set_nozzle_duty(duty_cycle = 0, direction = 0, wait_for_complete = True)
+        StopSensorWindow(peripherals_list)
+        # turn off nozzle rotation, the homing move below waits for the nozzle
+        peripherals_list.DUTMLB.set_nozzle_duty(duty_cycle = 0, direction = 0)
 
         peripherals_list.DUTsprinkler.NozzleCurrentAve = round(float(np.average(NozzleCurrent)), 1)
         peripherals_list.DUTsprinkler.NozzleCurrentSTD = round(float(np.std(NozzleCurrent)), 2)
 
-        Nozzle_Rotation_Data.clear()
-        for sensor_message in Sensor_Read_List:
-            timestamp = int(sensor_message.time_ms)
-            Nozzle_Position = int(sensor_message.nozzle_position_centideg)
-            Nozzle_Speed = int(sensor_message.nozzle_speed_centideg_per_sec)
-            Nozzle_Rotation_Data.append([timestamp, Nozzle_Position, Nozzle_Speed])
-            DataPointCounter += 1
+        DataPointCounter = len(Nozzle_Rotation_Data)
 
-        # End of Data Gathering; Sending Nozzle Back Home
+        # End of Data Gathering; Sending Nozzle Back Home in the background, the speed target pass or the end of run_step waits for it
         try:  
-            ReturnMessage = peripherals_list.DUTMLB.set_nozzle_position_home(wait_for_complete = True)
+            peripherals_list.defer_motion(home_nozzle(peripherals_list.DUTMLB, timeout = self.TIMEOUT))
         except TimeoutError as e:
             return {"Status_Check": 2,"TimeoutWhere": 3 , "Collected_Data_List": Nozzle_Rotation_Data}
         except Exception as e:
             self.parent.text_console_logger(str(e))
             return {"Status_Check": 3, "TimeoutWhere": 3 , "Collected_Data_List": Nozzle_Rotation_Data}
 
-        if ReturnMessage.message_type_string != "CTRL_OUT_COMMAND_COMPLETE":
-            self.parent.text_console_logger(ReturnMessage.message_type_string)
-            return {"Status_Check": 2 , "TimeoutWhere": 3 , "Collected_Data_List": Nozzle_Rotation_Data}
-
-        # data_collection_status = 0 if all OK, 1 if List is empty, 2 if Timeout, 3 Unknown, 5 backwards rotation
-        if Nozzle_Rotation_Data and RotationComplete: 
+        # data_collection_status = 0 if all OK, 1 if List is empty, 2 if Timeout, 3 Unknown, 5 backwards rotation, 6 stopped early on a gross speed failure, 7 unreliable sensor stream
+        StreamGood = StreamCheck(peripherals_list, name = f"{self.name} {cycle}", quality = streamQuality) if Nozzle_Rotation_Data else True
+        if Backwards:
+            check_stat = 5
+            timeout_pos = None
+        elif not StreamGood:
+            check_stat = 7
+            timeout_pos = None
+        elif EarlyAbort:
+            check_stat = 6
+            timeout_pos = None
+        elif Nozzle_Rotation_Data and RotationComplete: 
             check_stat = 0
             timeout_pos = None
         elif not Nozzle_Rotation_Data: 
@@ -639,28 +872,37 @@ class NozzleRotationTestWithSubscribe(TestStep):
         elif not RotationComplete:
             check_stat = 2
             timeout_pos = 5
-        elif Backwards:
-            check_stat = 5
-            timeout_pos = None
         else:
             check_stat = 3
             timeout_pos = None
-        return {"Status_Check": check_stat, "TimeoutWhere": timeout_pos, "Collected_Data_List": Nozzle_Rotation_Data}
-
-    def Nozzle_Rotation_Speed_Calculator(self, peripherals_list: TestPeripherals, Nozzle_Rotation_Data: list):
-        "Calculates rotation speed information and saves a date stamped CSV file"
+        return {"Status_Check": check_stat, "TimeoutWhere": timeout_pos, "Collected_Data_List": Nozzle_Rotation_Data, "Speed_Statistics": SpeedStatistics,
+                "Arc_Speed": ArcSpeed, "Recorded_Rotation": max(Travel - RecordStart, 0), "Stream_Problems": streamQuality.problems()}
+
+    def Gross_Speed_Failure(self, arc: int, elapsed_ms: int):
+        '''
+        Early abort check of the duty cycle pass from the recorded rotation (centideg) and the time it took. Returns
+        (True, average speed in centideg/sec) when the unit can't pass: the recorded rotation, once it covers ABORT_ARC,
+        averages far outside the speed limits, it is taking too long to cover ABORT_ARC at all (a stall), or the
+        revolution has already taken longer than a full one at MINRotationSpeed, so its mean can only be below the limit.
+        '''
+        if elapsed_ms <= 0:
+            return False, 0
+        arc_speed = arc * 1000 / elapsed_ms
+        slowest = self.MINRotationSpeed / self.GROSS_SPEED_FACTOR
+        if elapsed_ms > 36000 * 1000 / self.MINRotationSpeed:
+            return True, arc_speed
+        if arc < self.ABORT_ARC:
+            return elapsed_ms > self.ABORT_ARC * 1000 / slowest, arc_speed
+        return not slowest <= arc_speed <= self.MAXRotationSpeed * self.GROSS_SPEED_FACTOR, arc_speed
+
+    def Nozzle_Rotation_Speed_Calculator(self, peripherals_list: TestPeripherals, Nozzle_Rotation_Data: list, speed_statistics: RunningStatistics = None):
+        "Calculates rotation speed information and saves a date stamped CSV file, mean and STD come from the running statistics if the collection kept them"
         Failed_Speed_counter:int = 0
         Max_Delta_Position: int = 100  # error count if more than this number of centidegrees between readings.
-        number_of_data_points:int = 0
         Average_Speed: float = 0
-        Delta_Speed: int = 0
         Max_Difference: int = 0
-        Nozzle_Position: int = 0
-        Delta_Position: int = 0
         Delta_Position_Counter: int = 0
         Speed_settings: list = []
-        dataSet: list = []
-        Speed_List: list = []
         max_speed_recorded = 0
         speed_standard_deviation: float = 0
         Max_STD_Check: bool = True
@@ -668,58 +910,21 @@ class NozzleRotationTestWithSubscribe(TestStep):
         Mean_Rotation_Speed = (self.MAXRotationSpeed + self.MINRotationSpeed) *0.5
         Tolerance_Rotation_Speed = (self.MAXRotationSpeed - self.MINRotationSpeed) *0.5
         
-        for data_point in Nozzle_Rotation_Data:
-            if data_point[2] >= max_speed_recorded:
-                max_speed_recorded = data_point[2]
-
-        for dataSet in Nozzle_Rotation_Data:
-            Rotation_Rate = dataSet[2]
-            Delta_Speed = Mean_Rotation_Speed - Rotation_Rate
-            
-            if number_of_data_points > 0:
-                if 0 <= Nozzle_Position <= 9000:
-                    if 27000 <= dataSet[1] <= 36000:
-                        Delta_Position = -(36000 - dataSet[1] + Nozzle_Position)
-                    else:
-                        Delta_Position = dataSet[1] - Nozzle_Position
-                elif 27000 <= Nozzle_Position <=36000:
-                    if 0 <= dataSet[1] <= 9000:
-                        Delta_Position = 36000 - Nozzle_Position + dataSet[1]
-                    else:
-                        Delta_Position = dataSet[1] - Nozzle_Position
-                else:
-                    Delta_Position = dataSet[1] - Nozzle_Position                    
-                Nozzle_Position = dataSet[1]
-            else:
-                Nozzle_Position = dataSet[1]
-                Delta_Position = 0
-
-            if abs(Delta_Position) >= Max_Delta_Position:
-                Delta_Position_Counter += 1
-
-            if abs(Delta_Speed) > abs(Max_Difference):
-                Max_Difference = Delta_Speed
-
-            if abs(Delta_Speed) > Tolerance_Rotation_Speed:
-                Failed_Speed_counter += 1
-
-            unit_radius = round(Rotation_Rate / max_speed_recorded, 4)
-            x_position = round(unit_radius * math.cos(math.radians(Nozzle_Position/100)), 4)
-            y_position = round(unit_radius * math.sin(math.radians(Nozzle_Position/100)), 4)
-
-            Speed_List.append(Rotation_Rate)
-
-            dataSet.append(Failed_Speed_counter)
-            dataSet.append(Delta_Speed)
-            dataSet.append(Delta_Position)
-            dataSet.append(unit_radius)
-            dataSet.append(x_position)
-            dataSet.append(y_position)
-
-            number_of_data_points +=1
-
-        speed_standard_deviation = round(float(np.std(Speed_List)), 1)
-        Average_Speed = round(float(np.mean(Speed_List)), 1)
+        Speeds = nozzle_speed_analysis(positions = [dataSet[1] for dataSet in Nozzle_Rotation_Data], speeds = [dataSet[2] for dataSet in Nozzle_Rotation_Data],
+                                       mean_speed = Mean_Rotation_Speed, tolerance = Tolerance_Rotation_Speed, max_delta_position = Max_Delta_Position)
+        for dataSet, (Failures, Delta_Speed, Delta_Position, unit_radius, x_position, y_position) in zip(Nozzle_Rotation_Data, Speeds["Columns"].tolist()):
+            dataSet.extend([int(Failures), Delta_Speed, int(Delta_Position), unit_radius, x_position, y_position])
+        Failed_Speed_counter = Speeds["Failed Count"]
+        Max_Difference = Speeds["Max Difference"]
+        Delta_Position_Counter = Speeds["Delta Position Count"]
+        max_speed_recorded = Speeds["Max Speed"]
+
+        if speed_statistics is not None and speed_statistics.count == len(Nozzle_Rotation_Data):
+            speed_standard_deviation = round(speed_statistics.std, 1)
+            Average_Speed = round(speed_statistics.mean, 1)
+        else:
+            speed_standard_deviation = round(Speeds["STD"], 1)
+            Average_Speed = round(Speeds["Mean"], 1)
 
         if self.Min_STD <= speed_standard_deviation <= self.Max_STD:
             Max_STD_Check = False
@@ -736,6 +941,7 @@ class NozzleRotationTestWithSubscribe(TestStep):
                             f"Measured Speed STD: {speed_standard_deviation}", f"Max Difference to set Mean: {Max_Difference}", f"Nummber of Failed Points: {Failed_Speed_counter}",
                             f"Max Delta Position Set (Between adjacent points): {Max_Delta_Position}",
                             f"Delta Position Counter (Exceeded Set Max): {Delta_Position_Counter}", f"Max Speed Recorded: {max_speed_recorded}", f"BOM Number: {bom_Number}"])
+        Speed_info = Speed_settings
         Speed_settings = pd.DataFrame(Speed_settings)
         Data = pd.DataFrame(Nozzle_Rotation_Data)
         peripherals_list.DUTsprinkler.nozzleRotationData = Nozzle_Rotation_Data
@@ -743,16 +949,16 @@ class NozzleRotationTestWithSubscribe(TestStep):
         Data = Data.merge(Speed_settings, suffixes = ['_left', '_right'], left_index = True, right_index = True, how = 'outer')
         Data.columns = ["Time Stamp", "Nozzle Position", "Nozzle Speed", "Failure Sequence", "Delta Speed (to Set Mean)", "Delta Position (adjacent points)", "R (Normalized Speed)" , "X" , "Y" , "Setting Info"]
 
-        RotationalSpeed = Data["Nozzle Speed"]
-        RotationalSpeed = list(map(lambda v: v/100, RotationalSpeed))
-        RotationalPosition = Data["Nozzle Position"]
-        RotationalPosition = list(map(lambda a: -a/18000*np.pi, RotationalPosition))
-        self.parent.create_plot(window = self.parent.GraphHolder, plottype = "polar", xaxis = RotationalPosition, yaxis = RotationalSpeed, size = None, name = "Nozzle Rotation", clear = True)
+        self.parent.create_plot(window = self.parent.GraphHolder, plottype = "polar", xaxis = Speeds["Plot Angles"], yaxis = Speeds["Plot Speeds"], size = None, name = "Nozzle Rotation", clear = True)
 
         Date_Time = str(datetime.now().strftime("%d-%m-%Y %H_%M_%S"))
         if peripherals_list.DUTsprinkler.deviceID != "":
-            file_name= EstablishLoggingLocation(name = "NRT", folder_name = "Nozzle Rotation", csv_file_name = f"{self.Nozzle_Duty_Cycle}DC_{Date_Time}.csv", date_time = Date_Time, parent = self.parent).run_step(peripherals_list=peripherals_list).file_path
-            Data.to_csv(file_name, encoding='utf-8')
+            Records = {"time_ms": [row[0] for row in Nozzle_Rotation_Data], "nozzle_position_centideg": [row[1] for row in Nozzle_Rotation_Data],
+                       "nozzle_speed_centideg_per_sec": [row[2] for row in Nozzle_Rotation_Data]}
+            if not SaveTrace(self.parent, peripherals_list, step = "Nozzle Rotation", records = Records, info = Speed_info):
+                file_name= EstablishLoggingLocation(name = "NRT", folder_name = "Nozzle Rotation", csv_file_name = f"{self.Nozzle_Duty_Cycle}DC_{Date_Time}.csv", date_time = Date_Time, parent = self.parent).run_step(peripherals_list=peripherals_list).file_path
+                with span("CSV write", "io", {"file": str(file_name)}):
+                    Data.to_csv(file_name, encoding='utf-8')
 
         return_dict = {"Failure_Counter": Failed_Speed_counter , "Max_STD_Limit": Max_STD_Check , "Min_STD_Limit": Min_STD_Check,
                         "Collected_Data_List": Nozzle_Rotation_Data, "Mean_Speed":Average_Speed, "Measured_STD": speed_standard_deviation}
@@ -774,7 +980,13 @@ class PressureCheck(TestStep):
                     "Low STD": "Pressure data is unusually consistent.",
                     "BAD_STD": "Pressure data is not within expected consistency limits.",
                     "BAD_Both": "Pressure data values and consistency are not within limits.",
-                    "Pressure_Sensor": "OtO pressure sensor is not recognized."}
+                    "Pressure_Sensor": "OtO pressure sensor is not recognized.",
+                    "Stream": "Sensor data from OtO was unreliable, check the USB link and test again:"}
+    MIN_COLLECTION_TIME = 0.5  # sec, never stop collecting before this
+    STREAM_RETRIES = 1  # windows thrown away and collected again because the sensor stream was unreliable
+    MIN_SAMPLES = 40  # never stop collecting with fewer pressure readings than this
+    CONFIDENCE_Z = 4  # width of the running confidence bounds in standard errors, matches the ±4σ used for the limits
+    SETTLE_TOLERANCE = 1000  # ADC change of the mean pressure between windows that counts as settled after subscribing
 
     def __init__(self, name: str, data_collection_time: int , class_function:str , valve_target: int, parent: tk):
         super().__init__(name, parent)
@@ -782,9 +994,9 @@ class PressureCheck(TestStep):
         self.class_function = class_function
         self.valve_target = valve_target
 
-    def run_step(self, peripherals_list: TestPeripherals):
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
         startTime = timeit.default_timer()
-        pressure_sensor_check = int(peripherals_list.DUTMLB.get_pressure_sensor_version().pressure_sensor_version)
+        pressure_sensor_check = peripherals_list.pressure_calibration.version
 
         if self.class_function in "EOL":  # new fully open test at closed positions uses same limits as zero pressure
             if pressure_sensor_check == peripherals_list.DUTsprinkler.psig30:
@@ -829,106 +1041,139 @@ class PressureCheck(TestStep):
             return PressureCheckResult(test_status = self.ERRORS.get("Bad_Function"), step_start_time = startTime, Zero_P = mean, Zero_P_Tolerance = Zero_Tolerance)
 
         standardDeviation:float = 32000  # should be equal to or bigger than min_acceptable_STD defined above
-        number_of_trials:int = 2
-        trial_count:int = 1
+        number_of_trials:int = 2  # a marginal window is extended by another data_collection_time, up to this many windows
         multiple_STD:int = 5
-        Sensor_Read_List:list = []
         pressureReading:list = []
         pressureReadingData:list = []
+        output:list = []
         dataCount:int =0
         mean:int = 0
         maxDeviation:int = 0
-        maxDeviation_x:int = 0
         Zero_Tolerance:int = 0
         setting_n_output: list = []
         Destination_Folder_1 = None
-        loop_check:bool = True
         STD_check = True
         ADC_check = True
+        stopReason = "Time"
+        pressureStatistics = RunningStatistics()
 
+        SubscribeRate = round(1000 / peripherals_list.DUTsprinkler.SubscribePeriod)  # the STD limits and Zero_Tolerance were set on the raw 100Hz stream
         peripherals_list.DUTMLB.use_moving_average_filter(True)
-        while loop_check == True and trial_count <= number_of_trials:
-            Sensor_Read_List:list = []
-            output:list = []
-            pressureReading = []
-            kPaPressure = []
-            pressureReadingData = []
-            dataCount:int = 0
-            mean:int = 0
-            maxDeviation:int = 0
-            maxDeviation_x:int = 0
-            Zero_Tolerance:int = 0
-            setting_n_output: list = []
-            standardDeviation = 0
-
-            peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeFrequency) 
-            time.sleep(0.1)
-            peripherals_list.DUTMLB.clear_incoming_packet_log()
-            main_loop_start_time = time.perf_counter()
-            while time.perf_counter() - main_loop_start_time <= self.data_collection_time:
-                Sensor_Read_List.extend(peripherals_list.DUTMLB.read_all_sensor_packets(limit = None, consume = True))
-            peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeOff)
-            peripherals_list.DUTMLB.clear_incoming_packet_log()
-
-            if not Sensor_Read_List:
-                PressureCheckResult(test_status = self.ERRORS.get("Empty List"), step_start_time = startTime, Zero_P = None, Zero_P_Tolerance = None)
-
-            for message in Sensor_Read_List:
-                pressureReadingData.append([int(message.time_ms), int(message.pressure_adc)])
-                pressureReading.append(int(message.pressure_adc))
-                kPaPressure.append(ADCtokPA(message.pressure_adc))
-                dataCount += 1
-
-            mean = round(float(np.mean(pressureReading)), 0)
-            standardDeviation = round(float(np.std(pressureReading)), 1)
-            Zero_Tolerance = multiple_STD * standardDeviation
-            for pressure in pressureReading:
-                maxDeviation_x = maxDeviation
-                maxDeviation = abs(mean-pressure)
-                if maxDeviation <= maxDeviation_x: 
-                    maxDeviation = maxDeviation_x
-
-            output.append(mean)
-            output.append(Zero_Tolerance)
-            output.append(multiple_STD)
-            
-            if self.class_function == "EOL":
-                peripherals_list.DUTsprinkler.ZeroPressure = output
-                peripherals_list.DUTsprinkler.ZeroPressureAve = mean
-                peripherals_list.DUTsprinkler.ZeroPressureSTD = standardDeviation
-                function = "Checking Zero Pressure"
-                self.parent.create_plot(window = self.parent.GraphHolder, plottype = "histplot", xaxis = kPaPressure, xtitle = "kPa", yaxis = None, size = None, name = function, clear = False)
-            elif self.class_function in "FO_test MFO_test":
-                peripherals_list.DUTsprinkler.ZeroPressure_Temp = output
-                function = "Valve Fully Open Position Testing"
-                self.parent.create_plot(window = self.parent.GraphHolder, plottype = "fohistplot", xaxis = kPaPressure, xtitle = "kPa", yaxis = None, size = None, name = function, clear = False)
-            else: 
-                return PressureCheckResult(test_status = self.ERRORS.get("Bad_Function"), step_start_time = startTime, Zero_P = mean, Zero_P_Tolerance= Zero_Tolerance)
-          
-            UnitName = peripherals_list.DUTsprinkler.deviceID
-            bom_Number = peripherals_list.DUTsprinkler.bomNumber
-            setting_n_output = ([f"Unit ID: {UnitName}", f"Mean: {mean}", f"STD: {standardDeviation}", f"Max Deviation to Mean: {maxDeviation}", f"Data Points: {dataCount}",
-                                 f"{multiple_STD}x STD: {multiple_STD*standardDeviation}",f"Output List: {output} ", f"BOM Number: {bom_Number}" , f"Valve Target: {self.valve_target}" ,
-                                 "Limits:",f" min and max ADC: [{min_acceptable_ADC} , {max_acceptable_ADC}]",f" min and max Std. Dev.: [{min_acceptable_STD} , {max_acceptable_STD}]"])
-
-            setting_n_output = pd.DataFrame(setting_n_output)
-            Data = pd.DataFrame(pressureReadingData)
-            Data = Data.merge(setting_n_output, suffixes = ["_left", "_right"], left_index = True, right_index = True, how = "outer")
-            Data.columns = ["Timestamp" , "Pressure Reading" , "More info"]
-            Date_Time = str(datetime.now().strftime("%d-%m-%Y %H-%M-%S"))
-
-            if self.class_function == "EOL":
-                Destination_Folder_1 = "Zero P"
-            elif self.class_function in "FO_test MFO_test":
-                Destination_Folder_1 = "Fully Open"
-
-            if UnitName != "":
-                file_name = EstablishLoggingLocation(name = "CollectRawDataWithSubscribe", folder_name = Destination_Folder_1, date_time = Date_Time, parent = self.parent).run_step(peripherals_list = peripherals_list).file_path
-                Data.to_csv(file_name, encoding = "utf-8")
+        StartSensorWindow(peripherals_list)
+        SettleWait(peripherals_list, name = self.name, read = SensorPacketReader(peripherals_list, "pressure_adc"), tolerance = self.SETTLE_TOLERANCE, timeout = 0.1, window = 0.03, cancel = cancel)
+        ClearSensorPackets(peripherals_list)
+        main_loop_start_time = time.perf_counter()
+        window_end_time = self.data_collection_time
+        trial_count:int = 1
+        stream_retries:int = 0
+        streamQuality = StreamQuality(period_ms = 1000 / SubscribeRate)
+        while True:
+            cancel.check()
+            NewPackets = ReadSensorPackets(peripherals_list)
+            Stamps = [int(message.time_ms) for message in NewPackets]
+            streamQuality.add(Stamps)
+            if NewPackets:
+                Pressures = [int(message.pressure_adc) for message in NewPackets]
+                pressureReadingData.extend([list(reading) for reading in zip(Stamps, Pressures)])
+                pressureStatistics.add(Pressures)
+            elapsed_time = time.perf_counter() - main_loop_start_time
+            if elapsed_time < self.MIN_COLLECTION_TIME or pressureStatistics.count < self.MIN_SAMPLES:
+                if elapsed_time >= self.data_collection_time * number_of_trials:
+                    break
+                continue
+            if not streamQuality.acceptable:  # lost or late packets, the statistics of this window can't give a verdict
+                StreamCheck(peripherals_list, name = self.name, quality = streamQuality)
+                if stream_retries >= self.STREAM_RETRIES:
+                    stopReason = "Stream"
+                    break
+                stream_retries += 1
+                self.parent.text_console_logger(f"Sensor data from OtO was unreliable ({', '.join(streamQuality.problems())}), collecting again...")
+                pressureReadingData = []
+                pressureStatistics = RunningStatistics()
+                streamQuality = StreamQuality(period_ms = 1000 / SubscribeRate)
+                ClearSensorPackets(peripherals_list)
+                main_loop_start_time = time.perf_counter()
+                window_end_time = self.data_collection_time
+                trial_count = 1
+                continue
+            mean_verdict = interval_verdict(pressureStatistics.mean_bounds(self.CONFIDENCE_Z), min_acceptable_ADC, max_acceptable_ADC)
+            STD_verdict = interval_verdict(pressureStatistics.std_bounds(self.CONFIDENCE_Z), min_acceptable_STD, max_acceptable_STD)
+            # pass is statistically settled, no need to wait for the end of the window. The EOL zero pressure is also a
+            # measurement, VerifyValveOffsetTarget takes its 5x STD as the closed valve tolerance, so it collects for the whole window
+            if mean_verdict is True and STD_verdict is True and self.class_function != "EOL":
+                stopReason = "Settled pass"
+                break
+            if elapsed_time >= window_end_time:
+                point_estimate_passed = (min_acceptable_STD <= pressureStatistics.std <= max_acceptable_STD) and (min_acceptable_ADC <= pressureStatistics.mean <= max_acceptable_ADC)
+                if point_estimate_passed:
+                    break
+                if mean_verdict is False or STD_verdict is False:  # failure is settled, more data won't change it
+                    stopReason = "Settled fail"
+                    break
+                if trial_count >= number_of_trials:
+                    break
+                trial_count += 1  # marginal result, keep the data and extend the window
+                window_end_time += self.data_collection_time
+        collection_time = round(time.perf_counter() - main_loop_start_time, 3)
+        StopSensorWindow(peripherals_list)
+
+        if not pressureReadingData:
+            return PressureCheckResult(test_status = self.ERRORS.get("Empty List"), step_start_time = startTime, Zero_P = None, Zero_P_Tolerance = None)
+        if stopReason == "Stream" or not StreamCheck(peripherals_list, name = self.name, quality = streamQuality):
+            return PressureCheckResult(test_status = f"{self.ERRORS.get('Stream')} {', '.join(streamQuality.problems())}.", step_start_time = startTime, Zero_P = None, Zero_P_Tolerance = None)
+
+        Distribution = pressure_distribution([reading[1] for reading in pressureReadingData])
+        kPaPressure = peripherals_list.pressure_calibration.to_kPa(Distribution["Histogram Centers"])
+        dataCount = pressureStatistics.count
+
+        mean = round(float(pressureStatistics.mean), 0)
+        standardDeviation = round(float(pressureStatistics.std), 1)
+        Zero_Tolerance = multiple_STD * standardDeviation
+        maxDeviation = max(mean - pressureStatistics.minimum, pressureStatistics.maximum - mean)
+
+        output.append(mean)
+        output.append(Zero_Tolerance)
+        output.append(multiple_STD)
+        
+        if self.class_function == "EOL":
+            peripherals_list.DUTsprinkler.ZeroPressure = output
+            peripherals_list.DUTsprinkler.ZeroPressureAve = mean
+            peripherals_list.DUTsprinkler.ZeroPressureSTD = standardDeviation
+            function = "Checking Zero Pressure"
+            self.parent.create_plot(window = self.parent.GraphHolder, plottype = "histplot", xaxis = kPaPressure, weights = Distribution["Histogram Counts"], xtitle = "kPa", yaxis = None, size = None, name = function, clear = False)
+        elif self.class_function in "FO_test MFO_test":
+            peripherals_list.DUTsprinkler.ZeroPressure_Temp = output
+            function = "Valve Fully Open Position Testing"
+            self.parent.create_plot(window = self.parent.GraphHolder, plottype = "fohistplot", xaxis = kPaPressure, weights = Distribution["Histogram Counts"], xtitle = "kPa", yaxis = None, size = None, name = function, clear = False)
+        else: 
+            return PressureCheckResult(test_status = self.ERRORS.get("Bad_Function"), step_start_time = startTime, Zero_P = mean, Zero_P_Tolerance= Zero_Tolerance)
+      
+        UnitName = peripherals_list.DUTsprinkler.deviceID
+        bom_Number = peripherals_list.DUTsprinkler.bomNumber
+        setting_n_output = ([f"Unit ID: {UnitName}", f"Mean: {mean}", f"STD: {standardDeviation}", f"Max Deviation to Mean: {maxDeviation}", f"Data Points: {dataCount}",
+                             f"{multiple_STD}x STD: {multiple_STD*standardDeviation}",f"Output List: {output} ", f"BOM Number: {bom_Number}" , f"Valve Target: {self.valve_target}" ,
+                             "Limits:",f" min and max ADC: [{min_acceptable_ADC} , {max_acceptable_ADC}]",f" min and max Std. Dev.: [{min_acceptable_STD} , {max_acceptable_STD}]",
+                             f"Collection Time: {collection_time}", f"Windows: {trial_count}", f"Stopped By: {stopReason}", f"Effective Data Points: {round(pressureStatistics.effective_count, 1)}",
+                             f"Subscribe Rate: {SubscribeRate} Hz"])
 
-            trial_count += 1
-            if (min_acceptable_STD <= standardDeviation <= max_acceptable_STD) and (min_acceptable_ADC <= mean <= max_acceptable_ADC):
-                loop_check = False
+        setting_n_info = setting_n_output
+        setting_n_output = pd.DataFrame(setting_n_output)
+        Data = pd.DataFrame(pressureReadingData)
+        Data = Data.merge(setting_n_output, suffixes = ["_left", "_right"], left_index = True, right_index = True, how = "outer")
+        Data.columns = ["Timestamp" , "Pressure Reading" , "More info"]
+        Date_Time = str(datetime.now().strftime("%d-%m-%Y %H-%M-%S"))
+
+        if self.class_function == "EOL":
+            Destination_Folder_1 = "Zero P"
+        elif self.class_function in "FO_test MFO_test":
+            Destination_Folder_1 = "Fully Open"
+
+        if UnitName != "":
+            Records = {"time_ms": [row[0] for row in pressureReadingData], "pressure_adc": [row[1] for row in pressureReadingData]}
+            if not SaveTrace(self.parent, peripherals_list, step = Destination_Folder_1, records = Records, info = setting_n_info):
+                file_name = EstablishLoggingLocation(name = "CollectRawDataWithSubscribe", folder_name = Destination_Folder_1, date_time = Date_Time, parent = self.parent).run_step(peripherals_list = peripherals_list).file_path
+                with span("CSV write", "io", {"file": str(file_name)}):
+                    Data.to_csv(file_name, encoding = "utf-8")
 
         if standardDeviation > max_acceptable_STD or standardDeviation < min_acceptable_STD:
             STD_check = False
@@ -957,8 +1202,9 @@ class SendNozzleHome(TestStep):
     "Checks if there is a nozzle home position, then sends it there"
 
     ERRORS: Dict[str,str] = {"Not Valid": "OtO nozzle position value is not valid."}
+    TIMEOUT = 25  # sec, a full turn home at the slowest nozzle speed takes about 12 sec
 
-    def run_step(self, peripherals_list: TestPeripherals):
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
         startTime = timeit.default_timer()
         saved_MLB = None
         try:
@@ -971,8 +1217,8 @@ class SendNozzleHome(TestStep):
         if saved_MLB > 36000 or saved_MLB < 0:
             return SendNozzleHomeResult(test_status = f"{self.ERRORS.get('NotValid')} at {saved_MLB/100}°", step_start_time = startTime, N_Offset_calc = saved_MLB)
         else:
-            ReturnMessage = peripherals_list.DUTMLB.set_nozzle_position_home(wait_for_complete = True)
-            if ReturnMessage.message_type_string != "CTRL_OUT_COMMAND_COMPLETE":
+            peripherals_list.join_motions(cancel)
+            if not home_nozzle(peripherals_list.DUTMLB, timeout = self.TIMEOUT).result(cancel):
                 peripherals_list.DUTMLB.set_nozzle_duty(0, 0)
                 return SendNozzleHomeResult(test_status = f"Nozzle didn't rotate home!!! Nozzle Home Position: {saved_MLB/100}°", step_start_time = startTime, N_Offset_calc = saved_MLB)
             else:
@@ -991,7 +1237,7 @@ class TestBattery(TestStep):
                          "No Reading": "Error reading battery voltage."
                          }
 
-    def run_step(self, peripherals_list: TestPeripherals):
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
         startTime = timeit.default_timer()
         battVoltage = 0
         try:  # confirm board has been voltage calibrated before continuing
@@ -1023,6 +1269,9 @@ class TestExternalPower(TestStep):
     MAX_CURRENT: float =  0.385  # Jan 2023 update ±4σ
     PASS_CURRENTv4 = 0.37  # Based on "calibrated" current results
     MAX_CURRENTv4 =  0.43  # Based on "calibrated" current results
+    SETTLE_CURRENT: float = 0.005  # A difference between the means of two consecutive current bursts that counts as settled
+    SETTLE_TIMEOUT: float = 1  # sec, longest time to keep bursting after external power turns on
+    SETTLE_MINIMUM: float = 0.5  # sec, the charger soft starts after external power turns on, bursts that agree before this don't count
     ERRORS: Dict[str, str] = {
         "Current Below": "External charging current BELOW limit ",
         "Current Above": "External charging current ABOVE limit ",
@@ -1030,7 +1279,7 @@ class TestExternalPower(TestStep):
         "Voltage Above": "External charging voltage ABOVE limit "
         }
 
-    def run_step(self, peripherals_list: TestPeripherals):
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
         startTime = timeit.default_timer()
         ErrorAfterMeasurement = False
         if peripherals_list.DUTsprinkler.testFixtureName == "MecoChina1":
@@ -1059,19 +1308,27 @@ class TestExternalPower(TestStep):
         PowerTimeStart = time.perf_counter()
         Success = 1
         while time.perf_counter() - PowerTimeStart < 2 and Success == 1:
-            time.sleep(0.2)
+            cancel.sleep(0.01)
             Success = peripherals_list.gpioSuite.extPowerPin.get()
         if Success == 1:
             print(Result)
             return TestExternalPowerResult(test_status = "Can't turn on external power!", step_start_time = startTime, pass_criteria = (self.PASS_VOLTAGE, self.PASS_CURRENT), actual_readings = (0, 0))            
-        time.sleep(1)
+        # burst read the charging current until two consecutive bursts agree after SETTLE_MINIMUM, at most SETTLE_TIMEOUT like the old fixed wait
+        PowerOnTime = time.perf_counter()
+        Burst = peripherals_list.i2cSuite.burstCurrent(cancel = cancel)
+        Settled = False
+        while not Settled and time.perf_counter() - PowerOnTime < self.SETTLE_TIMEOUT:
+            Burst = peripherals_list.i2cSuite.burstCurrent(cancel = cancel, previous = Burst, tolerance = self.SETTLE_CURRENT)
+            Settled = Burst.get("Settled") and time.perf_counter() - PowerOnTime >= self.SETTLE_MINIMUM
+        peripherals_list.DUTsprinkler.settleTimes.append([self.name, round(time.perf_counter() - PowerOnTime, 3), Settled])
         chargingVoltage = round(float(peripherals_list.DUTMLB.get_voltages().solar_voltage_v), 3)
-        chargingCurrent = round(float(peripherals_list.i2cSuite.i2cLTC2945.get_current() * CurrentFactor), 3)
+        chargingCurrent = round(float(Burst.get("Mean") * CurrentFactor), 3)
         peripherals_list.DUTsprinkler.extPowerCurrent = chargingCurrent
+        peripherals_list.DUTsprinkler.extPowerCurrentSTD = round(float(Burst.get("STD") * CurrentFactor), 4)
         peripherals_list.DUTsprinkler.extPowerVoltage = chargingVoltage
 
         Result = peripherals_list.gpioSuite.extPowerPin.set(1) #turn off power
-        time.sleep(0.1)
+        cancel.sleep(0.1)
 
         if peripherals_list.gpioSuite.extPowerPin.get() != 1:
             print(Result)
@@ -1111,26 +1368,23 @@ class TestExternalPowerResult(TestResult):
 class TestMoesFullyOpen(TestStep):
     "Moe's idea to check the two locations where the valve is just about to open, and compare the zero pressure values there to determine the real peak location"
 
-    def run_step(self, peripherals_list: TestPeripherals):
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
         target = 9000  # nominal open in centidegrees
         tolerance = 5650  # nominal movement to closed from target in centidegrees
-        AdjustmentFactor = 30  # factor used to move angle, the square root of pressure ADC difference divided by this factor x 1°, when adjusting the zero position
+        AdjustmentFactor = 30  # factor used to move angle, the square root of pressure ADC difference divided by this factor x 1°, when there is no better estimate
+        MaxStep = 200  # largest change of the pretend valve offset between trials in centidegrees
+        MaxOffsetChange = 200  # largest total change of the valve offset that still passes in centidegrees
         SpanTolerance = 750  # acceptance tolerance between the two pressure ADC values, 2411 data 750
         SigmaSpanTolerance = 95  # acceptance σ tolerance between the two pressure ADC sigmas. 2411 data
+        SettleTolerance = 2000  # pressure ADC change between windows that counts as built up after the air turns on
         PretendChangeAmount = 0  # we won't actually adjust the closed valve position value in the NVS RAM, but we will pretend to and see if it passes
         startTime = timeit.default_timer()
-        Finished = False
         if not hasattr(peripherals_list, "gpioSuite"): # if called by itself by one button press
             new_gpio = GpioSuite()
             peripherals_list.add_device(new_object = new_gpio)
         MaxRepeats = 3  # number of chances to adjust the zero
-        Targets = [0, 1, 2, 3, 4, 5, 6]  # Not using 0, 2x MaxRepeats must be defined below, done to avoid moving valve back and forth so far between trials.
-        Targets[1] = (target + (36000 - tolerance)) % 36000  # typically will equal 3350 centidegrees
-        Targets[2] = (target + tolerance) % 36000  # typically will equal 14650 centidegrees
-        Targets[3] = Targets[2]
-        Targets[4] = Targets[1]
-        Targets[5] = Targets[1]
-        Targets[6] = Targets[2]
+        LowTarget = (target + (36000 - tolerance)) % 36000  # typically will equal 3350 centidegrees
+        HighTarget = (target + tolerance) % 36000  # typically will equal 14650 centidegrees
         pressure_reading_list = None
         average_pressure = None
         standard_deviation = None
@@ -1144,65 +1398,64 @@ class TestMoesFullyOpen(TestStep):
             return TestMoesFullyOpenResult(test_status = str("OtO does not have a valve offsest!"), step_start_time = startTime)
         except Exception as e:
             return str(e)
-        CurrentTarget = 0
+        # fit span against offset change from the points measured so far, starting from the slope of the valve calibration curve
+        Solver = OffsetSpanSolver(max_step = MaxStep, adjustment_factor = AdjustmentFactor,
+                                  curve_slope = valve_curve_span_slope(peripherals_list.DUTsprinkler.valveRawData, saved_MLB, LowTarget, HighTarget))
         while Repeats <= MaxRepeats:
             plt.figure(2)
             plt.close()  # clear the histogram memory for fully open
-            Finished = False
-            CurrentTarget += 1
-            while not Finished:
-                peripherals_list.DUTsprinkler.valveFullyOpenTrials = Repeats
-                ReturnMessage = peripherals_list.DUTMLB.set_valve_position(valve_position_centideg = Targets[CurrentTarget] + PretendChangeAmount, wait_for_complete = True)
-                if ReturnMessage.message_type_string != "CTRL_OUT_COMMAND_COMPLETE":
-                    return TestMoesFullyOpenResult(test_status = str(f"OtO valve did not move to {round(Targets[CurrentTarget]/100 + PretendChangeAmount, 2)}° in time."), step_start_time = startTime)
+            peripherals_list.DUTsprinkler.valveFullyOpenTrials = Repeats
+            if Repeats % 2 == 1:  # alternate the order to avoid moving valve back and forth so far between trials.
+                TrialTargets = [LowTarget, HighTarget]
+            else:
+                TrialTargets = [HighTarget, LowTarget]
+            for TrialTarget in TrialTargets:
+                ValvePosition = (TrialTarget + PretendChangeAmount) % 36000
+                ValveMove = move_valve(peripherals_list.DUTMLB, valve_position_centideg = ValvePosition)
                 peripherals_list.DUTsprinkler.ZeroPressure_Temp.clear()
-                peripherals_list.gpioSuite.airSolenoidPin.set(0) # turn on air
-                time.sleep(0.3)  # give some time to build pressure
-                result = PressureCheck(name = "Fully Open Position Test", data_collection_time = dataCollectionTime , class_function= "MFO_test" , valve_target = Targets[CurrentTarget] + PretendChangeAmount, parent = self.parent).run_step(peripherals_list)
+                peripherals_list.gpioSuite.airSolenoidPin.set(0) # turn on air, pressure starts building while the valve finishes moving
+                if not ValveMove.result(cancel):
+                    peripherals_list.gpioSuite.airSolenoidPin.set(1) # turn off air
+                    return TestMoesFullyOpenResult(test_status = str(f"OtO valve did not move to {round(ValvePosition/100, 2)}° in time."), step_start_time = startTime, Trials = Repeats)
+                # give some time to build pressure
+                SettleWait(peripherals_list, name = f"{self.name} {round(ValvePosition/100, 2)}°", read = lambda: int(peripherals_list.DUTMLB.get_sensors().pressure_adc),
+                           tolerance = SettleTolerance, timeout = 0.3, minimum_time = 0.1, cancel = cancel)
+                result = PressureCheck(name = "Fully Open Position Test", data_collection_time = dataCollectionTime , class_function= "MFO_test" , valve_target = ValvePosition, parent = self.parent).run_step(peripherals_list, cancel = cancel)
                 peripherals_list.gpioSuite.airSolenoidPin.set(1) # turn off air
                 if peripherals_list.DUTsprinkler.ZeroPressure_Temp:
                     pressure_reading_list = peripherals_list.DUTsprinkler.ZeroPressure_Temp
                     average_pressure = pressure_reading_list[0]
                     standard_deviation = pressure_reading_list[1]/pressure_reading_list[2]
-                    if CurrentTarget %2 == 1:
+                    if TrialTarget == LowTarget:
                         peripherals_list.DUTsprinkler.valveFullyOpen1Ave = average_pressure
                         peripherals_list.DUTsprinkler.valveFullyOpen1STD = standard_deviation
-                        CurrentTarget += 1
-                    elif CurrentTarget %2 == 0:
+                    else:
                         peripherals_list.DUTsprinkler.valveFullyOpen3Ave = average_pressure
                         peripherals_list.DUTsprinkler.valveFullyOpen3STD = standard_deviation
-                        Finished = True
                 if result.test_status != None and result.test_status[0] != "±":
-                    return TestMoesFullyOpenResult(f"{round(Targets[CurrentTarget-1]/100, 2)}° pressure reading not within specification." + result.test_status, step_start_time = startTime)
+                    return TestMoesFullyOpenResult(f"{round(ValvePosition/100, 2)}° pressure reading not within specification." + result.test_status, step_start_time = startTime, Trials = Repeats)
             Span = peripherals_list.DUTsprinkler.valveFullyOpen1Ave - peripherals_list.DUTsprinkler.valveFullyOpen3Ave
             SigmaSpan = abs(peripherals_list.DUTsprinkler.valveFullyOpen1STD - peripherals_list.DUTsprinkler.valveFullyOpen3STD)
             if abs(Span) < SpanTolerance and SigmaSpan < SigmaSpanTolerance:
                 ReturnMessage = peripherals_list.DUTMLB.set_valve_position(wait_for_complete = False, valve_position_centideg = 90000)
-                if abs(valve_offset - saved_MLB) <= 200:
-                    return TestMoesFullyOpenResult(test_status = f"±Closed position OK!, Difference: {round(RelativekPA(Span), 3)} kPa, σ difference: {RelativekPA(SigmaSpan)} kPa", step_start_time = startTime)
+                if abs(PretendChangeAmount) <= MaxOffsetChange:
+                    return TestMoesFullyOpenResult(test_status = f"±Closed position OK!, Difference: {round(RelativekPA(Span), 3)} kPa, σ difference: {RelativekPA(SigmaSpan)} kPa", step_start_time = startTime, Trials = Repeats)
                 else:
-                    return TestMoesFullyOpenResult(test_status = f"Failed Closed Position!, Difference: {abs(valve_offset-saved_MLB)}°", step_start_time = startTime)
+                    return TestMoesFullyOpenResult(test_status = f"Failed Closed Position!, Difference: {abs(PretendChangeAmount)/100}°", step_start_time = startTime, Trials = Repeats)
             else:
-                DeltaAngle = int(np.sign(Span) * -100 * math.sqrt(abs(Span)) / AdjustmentFactor)
-                if Repeats == 2:  # invert the difference since the positions are opposite for 2nd repeat
-                    DeltaAngle = -DeltaAngle                
-                if DeltaAngle > 200:
-                    DeltaAngle = 200
-                if DeltaAngle < -200:
-                    DeltaAngle = -200
-                if DeltaAngle < 0:
-                    DeltaAngle = 36000 + DeltaAngle
-                valve_offset = (DeltaAngle + saved_MLB + PretendChangeAmount) % 36000 # this makes it absolute
-                self.parent.text_console_logger(f"Revised Valve Postion: {valve_offset/100}°")
-                PretendChangeAmount = PretendChangeAmount + DeltaAngle
+                Solver.add(offset_change = PretendChangeAmount, span = Span)
+                PretendChangeAmount = Solver.next_offset_change()
+                valve_offset = (saved_MLB + PretendChangeAmount) % 36000 # this makes it absolute
+                self.parent.text_console_logger(f"Revised Valve Postion: {valve_offset/100}° ({Solver.method})")
                 Repeats += 1
         ReturnMessage = peripherals_list.DUTMLB.set_valve_position(wait_for_complete = False, valve_position_centideg = 9000)
-        return TestMoesFullyOpenResult(test_status = f"Failed Fully Open Test Limits: [{RelativekPA(SpanTolerance)}, {RelativekPA(SigmaSpanTolerance)}], Actual: {RelativekPA(Span)}, {RelativekPA(SigmaSpan)}", step_start_time = startTime)
+        return TestMoesFullyOpenResult(test_status = f"Failed Fully Open Test Limits: [{RelativekPA(SpanTolerance)}, {RelativekPA(SigmaSpanTolerance)}], Actual: {RelativekPA(Span)}, {RelativekPA(SigmaSpan)}", step_start_time = startTime, Trials = MaxRepeats)
         
 class TestMoesFullyOpenResult(TestResult):
 
-    def __init__(self, test_status: Union[str, None], step_start_time: float = None):
+    def __init__(self, test_status: Union[str, None], step_start_time: float = None, Trials: int = None):
         super().__init__(test_status, step_start_time)
+        self.Trials = Trials  # number of pressure pairs measured before the verdict
 
 class TestPump(TestStep):
     "vacuum switches are normally closed so 0 indicates that the switch triggered due to vacuum at the switch"
@@ -1216,6 +1469,7 @@ class TestPump(TestStep):
                              }
     DEFAULT_PUMP_DUTY = 100
     CAPS: str = "Black", "Blue", "Orange"
+    SETTLE_TOLERANCE = 5  # mA change of the mean pump current between windows that counts as settled after subscribing
 
     def __init__(self, target_pump: int, name: str, parent: tk, target_pump_duty = None):
         super().__init__(name, parent)
@@ -1226,7 +1480,7 @@ class TestPump(TestStep):
         else:
             self.target_pump_duty = target_pump_duty
 
-    def run_step(self, peripherals_list: TestPeripherals):
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
         startTime = timeit.default_timer()
         PumpCurrent = []
         Firmware = peripherals_list.DUTsprinkler.Firmware
@@ -1248,22 +1502,22 @@ class TestPump(TestStep):
         if self.target_pump == 1 or self.target_pump == 2 or self.target_pump == 3:
             if UseSubscribe:
                 # turn on OtO data acquisition at 100Hz
-                ReturnMessage = peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeFrequency)
-                time.sleep(0.1) # to ignore first few filtered pressure values
+                ReturnMessage = StartSensorWindow(peripherals_list)
+                SettleWait(peripherals_list, name = self.name, read = SensorPacketReader(peripherals_list, "pump_current_mA"), tolerance = self.SETTLE_TOLERANCE, timeout = 0.1, window = 0.03, cancel = cancel)
             ReturnMessage = peripherals_list.DUTMLB.set_pump_duty_cycle(pump_bay = self.target_pump, pump_duty_cycle = self.target_pump_duty)
             if UseSubscribe:
-                peripherals_list.DUTMLB.clear_incoming_packet_log()
+                ClearSensorPackets(peripherals_list)
             while (timeit.default_timer() - startTime) <= self.TIMEOUT:
+                cancel.check()
                 if UseSubscribe:
-                    DataRead = peripherals_list.DUTMLB.read_all_sensor_packets(limit = None, consume = True)
+                    DataRead = ReadSensorPackets(peripherals_list)
                     for DataPoint in DataRead:
                         PumpCurrent.append(DataPoint.pump_current_mA)
                 else:
                     PumpCurrent.append([round(float(peripherals_list.DUTMLB.get_currents().pump_current_mA), 3)])
                 if peripherals_list.gpioSuite.vacSwitchPin1.get() == 0 and peripherals_list.DUTsprinkler.pump1Pass is False:
                     if UseSubscribe:
-                        ReturnMessage = peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeOff)
-                        peripherals_list.DUTMLB.clear_incoming_packet_log()
+                        ReturnMessage = StopSensorWindow(peripherals_list)
                     ReturnMessage = peripherals_list.DUTMLB.set_pump_duty_cycle(pump_bay = self.target_pump, pump_duty_cycle = 0)
                     peripherals_list.DUTsprinkler.pump1Pass = True
                     peripherals_list.DUTsprinkler.Pump1CurrentAve = round(float(np.average(PumpCurrent)), 1)
@@ -1277,8 +1531,7 @@ class TestPump(TestStep):
                         return TestPumpResult(test_status = self.ERRORS.get("Wrong Pump") + f" Expected: {self.target_pump}, Triggered: Pump 1", step_start_time = startTime, pass_criteria = self.PASS_TIME)
                 if peripherals_list.gpioSuite.vacSwitchPin2.get() == 0 and peripherals_list.DUTsprinkler.pump2Pass is False:
                     if UseSubscribe:
-                        ReturnMessage = peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeOff)
-                        peripherals_list.DUTMLB.clear_incoming_packet_log()
+                        ReturnMessage = StopSensorWindow(peripherals_list)
                     ReturnMessage = peripherals_list.DUTMLB.set_pump_duty_cycle(pump_bay = self.target_pump, pump_duty_cycle = 0)
                     peripherals_list.DUTsprinkler.pump2Pass = True
                     peripherals_list.DUTsprinkler.Pump2CurrentAve = round(float(np.average(PumpCurrent)), 1)
@@ -1292,8 +1545,7 @@ class TestPump(TestStep):
                         return TestPumpResult(test_status=self.ERRORS.get("Wrong Pump") + f" Expected: {self.target_pump}, Triggered: Pump 2", step_start_time = startTime, pass_criteria = self.PASS_TIME)
                 if peripherals_list.gpioSuite.vacSwitchPin3.get() == 0 and peripherals_list.DUTsprinkler.pump3Pass is False:
                     if UseSubscribe:
-                        ReturnMessage = peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeOff)
-                        peripherals_list.DUTMLB.clear_incoming_packet_log()
+                        ReturnMessage = StopSensorWindow(peripherals_list)
                     ReturnMessage = peripherals_list.DUTMLB.set_pump_duty_cycle(pump_bay = self.target_pump, pump_duty_cycle = 0)
                     peripherals_list.DUTsprinkler.pump3Pass = True
                     peripherals_list.DUTsprinkler.Pump3CurrentAve = round(float(np.average(PumpCurrent)), 1)
@@ -1307,8 +1559,7 @@ class TestPump(TestStep):
                         return TestPumpResult(test_status = self.ERRORS.get("Wrong Pump") + f" Expected: {self.target_pump}, Triggered: Pump 3", step_start_time = startTime, pass_criteria = self.PASS_TIME)
 
             if UseSubscribe:
-                ReturnMessage = peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeOff)
-                peripherals_list.DUTMLB.clear_incoming_packet_log()
+                ReturnMessage = StopSensorWindow(peripherals_list)
             ReturnMessage = peripherals_list.DUTMLB.set_pump_duty_cycle(pump_bay = self.target_pump, pump_duty_cycle = 0)
                 
             if self.target_pump == 1:
@@ -1342,6 +1593,8 @@ class TestSolar(TestStep):
     MAX_VOLTAGE: float = 9  # Temporary increase for new LED board
     PASS_CURRENT: float = 40  # update per 141 unit build at Meco Dec 2023
     MAX_CURRENT: float = 345  # update per 141 unit build at Meco Dec 2023
+    SETTLE_CURRENT: float = 5  # mA change between windows that counts as settled after the LED turns on
+    SETTLE_VOLTAGE: float = 0.05  # V change between windows that counts as settled after the LED turns on
     SI_UNITS: str = "ADC"
     ERRORS: Dict[str,str] = {"Solar Below": "Solar panel voltage BELOW limit. ",
                              "Solar Above": "Solar panel voltage ABOVE limit. ",
@@ -1351,13 +1604,16 @@ class TestSolar(TestStep):
                              "No Current": "No solar panel current was read from the OtO"
                              }
 
-    def run_step(self, peripherals_list: TestPeripherals):
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
         startTime = timeit.default_timer()
         if not hasattr(peripherals_list, "gpioSuite"):
             new_gpio = GpioSuite()
             peripherals_list.add_device(new_object = new_gpio)
         peripherals_list.gpioSuite.ledPanelPin.set(0)  #turn on LED
-        time.sleep(0.3)
+        if "-v4" in peripherals_list.DUTsprinkler.Firmware or "-v5" in peripherals_list.DUTsprinkler.Firmware:
+            SettleWait(peripherals_list, name = self.name, read = lambda: float(peripherals_list.DUTMLB.get_currents().charge_current_mA), tolerance = self.SETTLE_CURRENT, timeout = 0.3, minimum_time = 0.1, cancel = cancel)
+        else:
+            SettleWait(peripherals_list, name = self.name, read = lambda: float(peripherals_list.DUTMLB.get_voltages().solar_voltage_v), tolerance = self.SETTLE_VOLTAGE, timeout = 0.3, minimum_time = 0.1, cancel = cancel)
         solarCurrent = round(float(peripherals_list.DUTMLB.get_currents().charge_current_mA), 0)
         solarVoltage = round(float(peripherals_list.DUTMLB.get_voltages().solar_voltage_v), 2)
         peripherals_list.DUTsprinkler.solarCurrent = solarCurrent
@@ -1409,12 +1665,16 @@ class ValveCalibration(TestStep):
     MINVMotorCurrent = 58  # 2411 data 58
     MAXVMotorCurrentSTD = 20 # 2411 data 20
     MINVMotorCurrentSTD = 0.1  # 2411 data 0.1
+    PeakConfirmDrop = 150000  # ADC the filtered pressure must fall after a peak before it counts as a peak while rotating
+    PeakSpacingWindow = 1500  # centideg either side of 180° the two live peaks must be to stop rotating early, final check uses MaxAngleDifference
+    PeakMargin = 3000  # centideg to keep rotating past the second peak so the final filter has data on both sides of it
+    SETTLE_TOLERANCE = 5  # mA change of the mean valve motor current between windows that counts as spun up
 
     def __init__(self, name: str, parent: tk, reset: bool):
         super().__init__(name, parent)
         self.reset = reset
 
-    def run_step(self, peripherals_list: TestPeripherals):
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):
         start_time = timeit.default_timer()
 
         CurrentValvePosition = 0
@@ -1424,68 +1684,75 @@ class ValveCalibration(TestStep):
         first_peak = 0
         fullyOPEN_valve_position = 0       
         main2peaks_position = [None, None]
-        peak_position_list = []
-        peak_pressure_list = []
-        PressureData = []
-        kPaPressure = []
-        kPaFinalPressure = []
         PreviousValvePosition = 0
         read_all_sensor_outputs = []
-        SamplingFrequency = 100
+        SamplingFrequency = peripherals_list.DUTsprinkler.FastSubscribeRate  # finer angular resolution at the fastest rate the firmware offers
         second_peak = 0
-        sensor_read_list = []
+        RecordedPositions = []  # only position and pressure are kept from the sensor packets
+        RecordedPressures = []
         valve_calibration_data = []
         valve_offset = 0
         ValveCurrent = []
-        ValvePositionData = []
         TotalTravel = 0
 
         peripherals_list.DUTMLB.use_moving_average_filter(False)
         CurrentValvePosition = int(peripherals_list.DUTMLB.get_sensors().valve_position_centideg)
         
-        # Rotate valve backwards 5 degrees to make sure it can!
+        # Rotate valve backwards 5 degrees to make sure it can! The EOL board is set up while it moves.
         TestPosition = (CurrentValvePosition + 35500) % 36000
         try:
-            ReturnMessage = peripherals_list.DUTMLB.set_valve_position(valve_position_centideg = TestPosition, wait_for_complete = True)
+            BackwardMove = move_valve(peripherals_list.DUTMLB, valve_position_centideg = TestPosition)
         except:
             return ValveCalibrationResult (test_status = "Error moving valve!", step_start_time = start_time)
-        if ReturnMessage.message_type_string != "CTRL_OUT_COMMAND_COMPLETE":
-            return ValveCalibrationResult (test_status = "Valve won't rotate backwards!", step_start_time = start_time)
         if not hasattr(peripherals_list, "gpioSuite"): # if called by itself by one button press
             new_gpio = GpioSuite()
             peripherals_list.add_device(new_object = new_gpio)
-        sensor_read_list.clear()  # make sure list is empty
+        if not BackwardMove.result(cancel):
+            return ValveCalibrationResult (test_status = "Valve won't rotate backwards!", step_start_time = start_time)
+        RecordedPositions.clear()  # make sure list is empty
+        RecordedPressures.clear()
         ValveCurrent.clear()
         RotationComplete = False
+        EarlyStop = False
         TotalTravel = 0
+        RecordTravel = 0  # unwrapped rotation since recording started
+        sos = lowpass_sos(order = 1, cutoff = 0.5, fs = SamplingFrequency)
+        PeakTracker = StreamingPeakTracker(sos = sos, confirm_drop = self.PeakConfirmDrop)
         CurrentValvePosition = int(peripherals_list.DUTMLB.get_sensors().valve_position_centideg)
         peripherals_list.gpioSuite.airSolenoidPin.set(0) # turn on air 
         # start valve motor turning at desired duty cycle
         peripherals_list.DUTMLB.set_valve_duty(duty_cycle = self.VALVE_ROTATION_DUTY_CYCLE, direction = 1)
-        # turn on OtO data acquisition at 100Hz
-        peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeFrequency)
-        time.sleep(0.1) # to ignore first few filtered pressure values
-        peripherals_list.DUTMLB.clear_incoming_packet_log()
+        # turn on OtO data acquisition at the fastest subscribe rate
+        StartSensorWindow(peripherals_list, fast = True)
+        SettleWait(peripherals_list, name = "Valve calibration spin up", read = lambda: float(peripherals_list.DUTMLB.get_currents().valve_current_mA),
+                   tolerance = self.SETTLE_TOLERANCE, timeout = 0.1, window = 0.03, cancel = cancel)
+        ClearSensorPackets(peripherals_list)
 
         Recording = False
         FlipFirst = False
         PressureError = False
 
         while (timeit.default_timer() - start_time) <= self.TIMEOUT and not RotationComplete:
+            cancel.check()
             ValveCurrent.extend([round(float(peripherals_list.DUTMLB.get_currents().valve_current_mA), 3)])
-            read_all_sensor_outputs = peripherals_list.DUTMLB.read_all_sensor_packets(limit = None, consume = True)
+            read_all_sensor_outputs = ReadSensorPackets(peripherals_list)
+            BatchTravel = []
+            BatchPressure = []
             for ReadPoint in read_all_sensor_outputs:
                 PreviousValvePosition = CurrentValvePosition
                 CurrentValvePosition = int(ReadPoint.valve_position_centideg)
                 if Recording:
-                    sensor_read_list.append(ReadPoint)
+                    RecordedPositions.append(CurrentValvePosition)
+                    RecordedPressures.append(int(ReadPoint.pressure_adc))
+                    RecordTravel += (CurrentValvePosition - PreviousValvePosition) % 36000
+                    BatchTravel.append(RecordTravel)
+                    BatchPressure.append(RecordedPressures[-1])
                     if CurrentValvePosition < PreviousValvePosition:  # either rotating backwards or passed 360°
                         if np.sin(np.pi*PreviousValvePosition/18000) < 0:  # sine should be negative in previous position if passing 360°
                             FlipFirst = False
                         else:  # if sine is positive and previous is greater than current position, the valve is turning backward so shut down data collection and rotation on the OtO, then error out.
                             peripherals_list.gpioSuite.airSolenoidPin.set(1)  #turn off air
-                            peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeOff)
-                            peripherals_list.DUTMLB.clear_incoming_packet_log()
+                            StopSensorWindow(peripherals_list)
                             peripherals_list.DUTMLB.set_valve_duty(duty_cycle = 0, direction = 0)
                             return ValveCalibrationResult(test_status = self.ERRORS.get("BackwardRotation"), step_start_time = start_time)
                     else:
@@ -1503,8 +1770,7 @@ class ValveCalibration(TestStep):
                                 TotalTravel = TotalTravel + CurrentValvePosition + 36000 - PreviousValvePosition
                             else:  # if sine is positive and previous is greater than current position, the valve is turning backward so shut down data collection and rotation on the OtO, then error out.
                                 peripherals_list.gpioSuite.airSolenoidPin.set(1)  #turn off air
-                                peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeOff)
-                                peripherals_list.DUTMLB.clear_incoming_packet_log()
+                                StopSensorWindow(peripherals_list)
                                 peripherals_list.DUTMLB.set_valve_duty(duty_cycle = 0, direction = 0)
                                 return ValveCalibrationResult(test_status = self.ERRORS.get("BackwardRotation"), step_start_time = start_time)
                         else:
@@ -1512,11 +1778,15 @@ class ValveCalibration(TestStep):
                         if TotalTravel >= self.MaxAngleBeforeShutoff:
                             PressureError = True
                             RotationComplete = True
+            # follow the peaks live, and stop as soon as both are confirmed 180° apart
+            PeakTracker.update(travel = BatchTravel, pressure = BatchPressure)
+            if not RotationComplete and PeakTracker.pair_confirmed(travel = RecordTravel, spacing = 18000, spacing_window = self.PeakSpacingWindow, margin = self.PeakMargin):
+                RotationComplete = True
+                EarlyStop = True
 
         peripherals_list.gpioSuite.airSolenoidPin.set(1)  #turn off air
         # turn off OtO data acquisition
-        peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeOff)
-        peripherals_list.DUTMLB.clear_incoming_packet_log()
+        StopSensorWindow(peripherals_list)
         # turn off valve rotation
         ReturnMessage = peripherals_list.DUTMLB.set_valve_duty(duty_cycle = 0, direction = 0)
 
@@ -1533,16 +1803,14 @@ class ValveCalibration(TestStep):
             return ValveCalibrationResult (test_status = str(e), step_start_time = start_time)
 
         valve_calibration_data.clear()  # make sure the list is empty
-        for sensor_message in sensor_read_list:
-            Pressure = int(sensor_message.pressure_adc)
-            Position = int(sensor_message.valve_position_centideg + saved_MLB) % 36000
-            valve_calibration_data.append([Position, Pressure])
+        for Position, Pressure in zip(RecordedPositions, RecordedPressures):
+            valve_calibration_data.append([(Position + saved_MLB) % 36000, Pressure])
             data_count += 1
 
         Date_Time = str(datetime.now().strftime("%d-%m-%Y %H_%M_%S"))
         UnitName = peripherals_list.DUTsprinkler.deviceID
         bom_Number = peripherals_list.DUTsprinkler.bomNumber
-        Info = ([f"Unit Name: {UnitName}", f"Test Time: {Date_Time}" , f"BOM Number: {bom_Number}"])
+        Info = ([f"Unit Name: {UnitName}", f"Test Time: {Date_Time}" , f"BOM Number: {bom_Number}", f"Recorded Rotation: {RecordTravel/100}°", f"Stopped Early: {EarlyStop}"])
         Info_DF = pd.DataFrame(Info)
         
         if not valve_calibration_data:
@@ -1552,11 +1820,14 @@ class ValveCalibration(TestStep):
                 return ValveCalibrationResult (test_status = self.ERRORS.get("EmptyList"), step_start_time = start_time)
 
         if UnitName != "":
-            file_path = EstablishLoggingLocation(name = "CollectRawDataWithSubscribe", folder_name = "Valve Calibrate", date_time = Date_Time, parent = self.parent).run_step(peripherals_list=peripherals_list).file_path
-            data = pd.DataFrame(valve_calibration_data)
-            data = data.merge(Info_DF, suffixes=['_left', '_right'], left_index = True, right_index = True, how = 'outer')
-            data.columns = ["Position" , "Pressure" , "Unit Info"]
-            data.to_csv(file_path, encoding='utf-8')
+            Records = {"valve_position_centideg": [row[0] for row in valve_calibration_data], "pressure_adc": [row[1] for row in valve_calibration_data]}
+            if not SaveTrace(self.parent, peripherals_list, step = "Valve Calibrate", records = Records, info = Info):
+                file_path = EstablishLoggingLocation(name = "CollectRawDataWithSubscribe", folder_name = "Valve Calibrate", date_time = Date_Time, parent = self.parent).run_step(peripherals_list=peripherals_list).file_path
+                data = pd.DataFrame(valve_calibration_data)
+                data = data.merge(Info_DF, suffixes=['_left', '_right'], left_index = True, right_index = True, how = 'outer')
+                data.columns = ["Position" , "Pressure" , "Unit Info"]
+                with span("CSV write", "io", {"file": str(file_path)}):
+                    data.to_csv(file_path, encoding='utf-8')
         
         peripherals_list.DUTsprinkler.valveRawData = valve_calibration_data
 
@@ -1565,7 +1836,7 @@ class ValveCalibration(TestStep):
         elif "-v4" in peripherals_list.DUTsprinkler.Firmware or "-v5" in peripherals_list.DUTsprinkler.Firmware:
             self.parent.text_console_logger(f"Valve Motor {peripherals_list.DUTsprinkler.ValveCurrentAve} mA, σ {peripherals_list.DUTsprinkler.ValveCurrentSTD} mA")
 
-        pressure_sensor_check = peripherals_list.DUTMLB.get_pressure_sensor_version().pressure_sensor_version
+        pressure_sensor_check = peripherals_list.pressure_calibration.version
         if pressure_sensor_check == peripherals_list.DUTsprinkler.psig30:
             minimum_acceptable_peak_pressure = 2680000  # Apr 2023 match FOT values
             maximum_acceptable_peak_pressure = 3790000  # Apr 2023 match FOT values
@@ -1577,52 +1848,20 @@ class ValveCalibration(TestStep):
         else:
             return ValveCalibrationResult (test_status = "Can't identify pressure sensor!", step_start_time = start_time)
 
-        ValvePositionData.clear()
-        PressureData.clear()
-        kPaPressure.clear()
-        for i in range(len(valve_calibration_data)):
-            ValvePositionData.append(valve_calibration_data[i][0])
-            PressureData.append(valve_calibration_data[i][1])
-            kPaPressure.append(ADCtokPA(valve_calibration_data[i][1]))
-        
-        self.parent.create_plot(window = self.parent.GraphHolder, plottype = "lineplot", xaxis = ValvePositionData, yaxis = kPaPressure, ytitle = "kPa", size = 12, name = "Valve Calibration", clear = False)
-
-        sos = signal.butter(N = 1, Wn = 0.5, btype = "lowpass", output = "sos", fs = SamplingFrequency)
-        FinalPressure = signal.sosfiltfilt(sos, x = PressureData, padtype = "odd", padlen = 40)  # filter pressure data
-        # scale pressure data to line up filtered peaks closer to actual peaks
-        zero = min(FinalPressure)
-        FinalPressure = (FinalPressure - zero) * 1.085 + zero
+        CalibrationArray = np.asarray(valve_calibration_data)
+        # filter pressure data and scale it to line up filtered peaks closer to actual peaks
+        Peaks = valve_calibration_analysis(positions = CalibrationArray[:, 0], pressures = CalibrationArray[:, 1],
+                                           order = 1, cutoff = 0.5, fs = SamplingFrequency, padlen = 40 * SamplingFrequency // 100)
+        kPaPressure = peripherals_list.pressure_calibration.to_kPa(Peaks["Plot Pressures"])
+        self.parent.create_plot(window = self.parent.GraphHolder, plottype = "lineplot", xaxis = Peaks["Plot Positions"], yaxis = kPaPressure, ytitle = "kPa", size = 12, name = "Valve Calibration", clear = False)
 
-        kPaFinalPressure.clear()
-        for i in FinalPressure:
-            kPaFinalPressure.append(ADCtokPA(i))
-
-        self.parent.create_plot(window = self.parent.GraphHolder, plottype = "lineplot", xaxis = ValvePositionData, yaxis = kPaFinalPressure, ytitle = "kPa", size = 15, name = "Valve Calibration", clear = False)
-
-        peak_list_index, properties = find_peaks(FinalPressure)
-        
-        peak_position_list.clear()
-        peak_pressure_list.clear()
-        for i in range(len(peak_list_index)):
-            peak_position_list.append(ValvePositionData[peak_list_index[i]])
-            peak_pressure_list.append(FinalPressure[peak_list_index[i]])
+        kPaFinalPressure = peripherals_list.pressure_calibration.to_kPa(Peaks["Plot Filtered"])
+        self.parent.create_plot(window = self.parent.GraphHolder, plottype = "lineplot", xaxis = Peaks["Plot Filtered Positions"], yaxis = kPaFinalPressure, ytitle = "kPa", size = 15, name = "Valve Calibration", clear = False)
 
-        try:
-            first_peak = max(peak_pressure_list)
-        except:
-            first_peak = 0
-
-        for i in range(len(peak_list_index)):
-            if peak_pressure_list[i] != first_peak:
-                if peak_pressure_list[i] > second_peak:
-                    second_peak = peak_pressure_list[i]
-        
-        main2peaks_position = [None, None]
-        for i in range(len(peak_list_index)):
-            if first_peak == peak_pressure_list[i]:
-                main2peaks_position[0] = peak_position_list[i]
-            if second_peak == peak_pressure_list[i]:
-                main2peaks_position[1] = peak_position_list[i]
+        if Peaks["Peak 1"] is not None:
+            main2peaks_position[0], first_peak = Peaks["Peak 1"]
+        if Peaks["Peak 2"] is not None:
+            main2peaks_position[1], second_peak = Peaks["Peak 2"]
 
         if main2peaks_position[0] != None and main2peaks_position[1] != None:
             fullyOPEN_valve_position = main2peaks_position[0]  # main2peaks_position[0]  # Pass 0 or 1 for either closed valve position
@@ -1641,8 +1880,7 @@ class ValveCalibration(TestStep):
                     return ValveCalibrationResult (test_status = f"Pressure reading is too high! [{minimum_acceptable_peak_pressure:,.0f}]: {first_peak:,.0f} ADC", step_start_time = start_time)
                 elif first_peak - second_peak > self.MaxPeakDifference:
                     return ValveCalibrationResult (test_status = f"First and second peak pressures are too different! [{self.MaxPeakDifference}]: {(first_peak - second_peak):,.0f} ADC", step_start_time = start_time)
-                PositionDifference = abs(abs(main2peaks_position[0] - main2peaks_position[1]) - 18000)
-                if PositionDifference > self.MaxAngleDifference:
+                if Peaks["Separation Error"] > self.MaxAngleDifference:
                     return ValveCalibrationResult (test_status = f"First and second peak angles are not 180°±{self.MaxAngleDifference/100} apart! {abs(main2peaks_position[0] - main2peaks_position[1])/100:.1f}", step_start_time = start_time)
         else:
             return ValveCalibrationResult (test_status = "No peaks found in data!", step_start_time = start_time)
@@ -1688,20 +1926,22 @@ class VerifyValveOffsetTarget(TestStep):
                         "NonZeroPressure": "OtO's valve is leaking when closed.",
                         "NotFullyClosed": "Unable to close OtO's valve.",
                         "Empty List": "OtO did not return pressure information.",
-                        "Timeout": "Valve didn't reach target in time."}
+                        "Timeout": "Valve didn't reach target in time.",
+                        "Stream": "Pressure data from OtO was unreliable, check the USB link and test again:"}
     
     VALVE_TARGET_TOLERANCE: int = 15  # in centidegree
     Zero_P_Collection_time = 2.1
+    STREAM_RETRIES = 1  # windows thrown away and collected again because the sensor stream was unreliable
+    SETTLE_TOLERANCE = 200  # ADC change of the mean pressure between windows that counts as settled once the air is on
 
     # Use "Hard Coded" or "Test Calibration" for fixed characters or using the calibration test outputs respectively! 
     def __init__(self, name: str, parent: tk, method:str = "Test Calibration"):
         super().__init__(name, parent)
         self.Zero_Pressure_Calibration_Method = method
 
-    def run_step(self, peripherals_list: TestPeripherals):  
+    def run_step(self, peripherals_list: TestPeripherals, cancel: CancellationToken = NEVER_CANCELLED):  
         startTime = timeit.default_timer()
-        pressure_sensor_check = int(peripherals_list.DUTMLB.get_pressure_sensor_version().pressure_sensor_version)
-        pressure_sensor_check = peripherals_list.DUTMLB.get_pressure_sensor_version().pressure_sensor_version
+        pressure_sensor_check = peripherals_list.pressure_calibration.version
         if pressure_sensor_check == peripherals_list.DUTsprinkler.psig30:
             self.PRESSURE_ADC_TOLERANCE = 325  # ± this amount, based on 1,089 pcs data Jan 2024
             self.STD_LOWER_LIMIT_TO_MEAN = 57  # 2411 data 57
@@ -1722,7 +1962,6 @@ class VerifyValveOffsetTarget(TestStep):
         sensor_read_list = []
         pressure_data_list = []
         pressure_data = []
-        kPaPressure = []
         data_reading_loop_startTime = None
         UnitName = None
         dataCount = 0
@@ -1743,39 +1982,53 @@ class VerifyValveOffsetTarget(TestStep):
         peripherals_list.DUTMLB.use_moving_average_filter(True)
 
         try: # Closing the valve
-            ReturnMessage = peripherals_list.DUTMLB.set_valve_position(valve_position_centideg = valveTarget, wait_for_complete = True)
+            ValveMove = move_valve(peripherals_list.DUTMLB, valve_position_centideg = valveTarget)
         except TimeoutError:
             return VerifyValveOffsetTargetResult(test_status = self.ERRORS.get("Timeout"), step_start_time = startTime, Valve_Target = False, pressureReading = pressure_reading, Relative_valveOffset = valveTarget, Actual_Valve_Position = valve_position)
         except Exception as e:
             return VerifyValveOffsetTargetResult(test_status = str(e), step_start_time = startTime, Valve_Target = False, pressureReading = pressure_reading, Relative_valveOffset = valveTarget, Actual_Valve_Position = valve_position)
 
+        ValveClosed = ValveMove.result(cancel)
         valve_position = int(peripherals_list.DUTMLB.get_sensors().valve_position_centideg)
 
-        if ReturnMessage.message_type_string != "CTRL_OUT_COMMAND_COMPLETE":
+        if not ValveClosed:
             return VerifyValveOffsetTargetResult(test_status = self.ERRORS.get("Timeout"), step_start_time = startTime, Valve_Target = False, pressureReading = pressure_reading, Relative_valveOffset = valveTarget, Actual_Valve_Position = valve_position)
         else:
             peripherals_list.gpioSuite.airSolenoidPin.set(0) # turn on air
         
-        peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeFrequency)
-        time.sleep(0.3)
-        peripherals_list.DUTMLB.clear_incoming_packet_log()
-        data_reading_loop_startTime = time.perf_counter()
-        while time.perf_counter() - data_reading_loop_startTime <= self.Zero_P_Collection_time:
-            sensor_read_list.extend(peripherals_list.DUTMLB.read_all_sensor_packets(limit = None, consume = True))
+        StartSensorWindow(peripherals_list)
+        SettleWait(peripherals_list, name = self.name, read = SensorPacketReader(peripherals_list, "pressure_adc"), tolerance = self.SETTLE_TOLERANCE, timeout = 0.3, minimum_time = 0.1, cancel = cancel)
+        ClearSensorPackets(peripherals_list)
+        for stream_retries in range(self.STREAM_RETRIES + 1):
+            sensor_read_list = []
+            streamQuality = StreamQuality(period_ms = peripherals_list.DUTsprinkler.SubscribePeriod)
+            data_reading_loop_startTime = time.perf_counter()
+            while time.perf_counter() - data_reading_loop_startTime <= self.Zero_P_Collection_time:
+                cancel.check()
+                NewPackets = ReadSensorPackets(peripherals_list)
+                streamQuality.add([int(message.time_ms) for message in NewPackets])
+                sensor_read_list.extend(NewPackets)
+            if not sensor_read_list or StreamCheck(peripherals_list, name = self.name, quality = streamQuality):
+                break
+            if stream_retries < self.STREAM_RETRIES:  # lost or late packets, throw the window away rather than fail the unit on it
+                self.parent.text_console_logger(f"Sensor data from OtO was unreliable ({', '.join(streamQuality.problems())}), collecting again...")
+                ClearSensorPackets(peripherals_list)
         peripherals_list.gpioSuite.airSolenoidPin.set(1) # turn off air
-        peripherals_list.DUTMLB.set_sensor_subscribe(subscribe_frequency = peripherals_list.DUTsprinkler.SubscribeOff)
-        peripherals_list.DUTMLB.clear_incoming_packet_log()
+        StopSensorWindow(peripherals_list)
 
         if not sensor_read_list:
             return VerifyValveOffsetTargetResult(test_status = self.ERRORS.get("Empty List"), step_start_time = startTime, Valve_Target = False, pressureReading = pressure_reading, Relative_valveOffset = valveTarget, Actual_Valve_Position = valve_position)
+        if not streamQuality.acceptable:
+            return VerifyValveOffsetTargetResult(test_status = f"{self.ERRORS.get('Stream')} {', '.join(streamQuality.problems())}.", step_start_time = startTime, Valve_Target = False, pressureReading = pressure_reading, Relative_valveOffset = valveTarget, Actual_Valve_Position = valve_position)
         
         for dataCount, dataset in enumerate(sensor_read_list):
             pressure_data_list.append([int(dataset.time_ms) , int(dataset.pressure_adc)])
             pressure_data.append(int(dataset.pressure_adc))
-            kPaPressure.append(ADCtokPA(dataset.pressure_adc))
+        Distribution = pressure_distribution(pressure_data)
+        kPaPressure = peripherals_list.pressure_calibration.to_kPa(Distribution["Histogram Centers"])
 
-        pressure_reading = round(float(np.mean(pressure_data)), 0)
-        STD_pressure_reading = round(float(np.std(pressure_data)), 1)
+        pressure_reading = round(Distribution["Mean"], 0)
+        STD_pressure_reading = round(Distribution["STD"], 1)
         peripherals_list.DUTsprinkler.valveClosesAve = pressure_reading
         peripherals_list.DUTsprinkler.valveClosesSTD = STD_pressure_reading
 
@@ -1784,17 +2037,21 @@ class VerifyValveOffsetTarget(TestStep):
         setting_n_output = ([f"Checking closed pressure", f"Unit ID: {UnitName}", f"Trial: {run_counter}",f"Mean: {pressure_reading}", 
                             f"STD: {STD_pressure_reading}", f"Data points: {dataCount+1}" , f"BOM: {bom_Number}"])
 
+        setting_n_info = setting_n_output
         setting_n_output = pd.DataFrame(setting_n_output)
         Data = pd.DataFrame(pressure_data_list)
         Data = Data.merge(setting_n_output, suffixes=['_left', '_right'], left_index = True, right_index = True, how = 'outer')
         Data.columns = ["Timestamp" , "Pressure Reading" , "More info"]
         Date_Time = str(datetime.now().strftime("%d-%m-%Y %H_%M_%S"))
 
-        self.parent.create_plot(window = self.parent.GraphHolder, plottype = "histplot", xaxis = kPaPressure, xtitle = "kPa", yaxis = None, size = None, name = "Closed Valve Zero", clear = False)
+        self.parent.create_plot(window = self.parent.GraphHolder, plottype = "histplot", xaxis = kPaPressure, weights = Distribution["Histogram Counts"], xtitle = "kPa", yaxis = None, size = None, name = "Closed Valve Zero", clear = False)
 
         if UnitName != "":
-            file_name = EstablishLoggingLocation(name = "Verify valve position", folder_name = "Closed", date_time = Date_Time, parent = self.parent).run_step(peripherals_list=peripherals_list).file_path
-            Data.to_csv(file_name, encoding = "utf-8")
+            Records = {"time_ms": [row[0] for row in pressure_data_list], "pressure_adc": [row[1] for row in pressure_data_list]}
+            if not SaveTrace(self.parent, peripherals_list, step = "Closed", records = Records, info = setting_n_info):
+                file_name = EstablishLoggingLocation(name = "Verify valve position", folder_name = "Closed", date_time = Date_Time, parent = self.parent).run_step(peripherals_list=peripherals_list).file_path
+                with span("CSV write", "io", {"file": str(file_name)}):
+                    Data.to_csv(file_name, encoding = "utf-8")
 
         if valve_position > 18000:
             valve_position = abs(36000 - valve_position)
@@ -1815,4 +2072,22 @@ class VerifyValveOffsetTargetResult(TestResult):
         self.Valve_Target = Valve_Target
         self.pressureReading = pressureReading
         self.Actual_Valve_Position = Actual_Valve_Position
-        self.Relative_valveOffset = Relative_valveOffset
\ No newline at end of file
+        self.Relative_valveOffset = Relative_valveOffset
+
+def create_test_list(parent):
+    "the returns test steps in order, parent is the MainWindow or a headless stand in with the same methods"
+    return [GetUnitName(name = "Unit Name Check", parent = parent),
+            TestBattery(name = "Check Battery", parent = parent),
+            TestExternalPower(name = "Check OtO Charging", parent = parent),
+            TestPump(name = "Test Pump 1", target_pump = 1, target_pump_duty = 100, parent = parent),
+            TestPump(name = "Test Pump 2", target_pump = 2, target_pump_duty = 100, parent = parent),
+            TestPump(name = "Test Pump 3", target_pump = 3, target_pump_duty = 100, parent = parent),
+            SendNozzleHome(name = "Send Nozzle Home", parent = parent),
+            PressureCheck(name = "Zero Pressure Check", data_collection_time = 2.1, class_function= "EOL" , valve_target = None, parent = parent),
+            ValveCalibration(name = "Valve Calibration Comparison", parent = parent, reset = True),
+            VerifyValveOffsetTarget(name = "Verify Valve Closes", parent = parent),
+            TestMoesFullyOpen(name = "Fully Open Position Test", parent = parent),
+            NozzleRotationTestWithSubscribe(name = "Nozzle Rotation Test", parent = parent),
+            CheckVacSwitch(name = "Holds Pump Vacuum", parent = parent),
+            TestSolar(name = "Check Solar Panel", parent = parent)
+            ]
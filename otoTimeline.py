@@ -0,0 +1,156 @@
+import json
+import pathlib
+import threading
+import time
+
+class _Span:
+    "times one with block into a Timeline"
+    __slots__ = ("timeline", "name", "category", "args", "start")
+
+    def __init__(self, timeline, name: str, category: str, args: dict):
+        self.timeline = timeline
+        self.name = name
+        self.category = category
+        self.args = args
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exception):
+        self.timeline.events.append((self.name, self.category, self.start, time.perf_counter_ns(), threading.get_ident(), self.args))
+        return False
+
+class _NullSpan:
+    "what span() hands out when no timeline is running"
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+_NULL_SPAN = _NullSpan()
+
+class Timeline:
+    '''
+    Per unit timeline of test steps, OtO/GPIO/I2C calls, sleeps, plots, file writes and cloud requests, saved in the
+    Chrome trace event format that chrome://tracing and ui.perfetto.dev open. Recording a span is two perf_counter_ns
+    calls and a list append. Only the test's own sleeps are timed, through otoTimeline.sleep() and
+    CancellationToken.sleep(), time.sleep is left alone so the PyOtO, power trace and watcher threads aren't touched.
+    benchmarkTimeline.py measures what the hooks cost per unit.
+
+    Device calls and sleeps are also totalled per method. Polling loops alternate calls, so their repeats can't be
+    merged. After MAX_CALL_EVENTS of them only the totals keep counting, and the totals are saved with the trace.
+
+    to call this,
+    otoTimeline.start(Timeline("OtO returns test"))
+    with otoTimeline.span("Zero Pressure Check", "step"):
+        ...
+    otoTimeline.stop().save(folder, "oto1234567 2024-06-01 10_11_12")
+    '''
+    MERGE_GAP_NS = 1000000  # repeats of a call less than 1 ms apart are merged
+    MAX_CALL_EVENTS = 20000  # device call and sleep spans kept per trace, later ones only count towards the totals
+
+    def __init__(self, name: str):
+        self.name = name
+        self.start_ns = time.perf_counter_ns()
+        self.events: list = []  # (name, category, start ns, end ns, thread ident, args)
+        self.call_events: int = 0  # events of add() kept so far
+        self.call_totals: dict = {}  # name -> [calls, total ns] of every add(), kept or not
+        self.dropped_calls: int = 0  # add() calls past MAX_CALL_EVENTS
+
+    def span(self, name: str, category: str, args: dict = None):
+        return _Span(self, name, category, args)
+
+    def add(self, name: str, category: str, start_ns: int, end_ns: int):
+        "records a call that was timed elsewhere, back to back repeats of the same call (packet polling loops) are merged into one span with a count"
+        totals = self.call_totals.setdefault(name, [0, 0])
+        totals[0] += 1
+        totals[1] += end_ns - start_ns
+        if self.call_events >= self.MAX_CALL_EVENTS:
+            self.dropped_calls += 1
+            return
+        ident = threading.get_ident()
+        if self.events:
+            last = self.events[-1]
+            if last[0] == name and last[4] == ident and start_ns - last[3] <= self.MERGE_GAP_NS:
+                count = last[5]["calls"] + 1 if last[5] else 2
+                self.events[-1] = (name, category, last[2], end_ns, ident, {"calls": count})
+                return
+        self.call_events += 1
+        self.events.append((name, category, start_ns, end_ns, ident, None))
+
+    def chrome_trace(self):
+        "the events as a Chrome trace JSON object, times in microseconds from the start of the timeline"
+        thread_ids: dict = {}
+        trace_events = [{"name": "process_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": self.name}}]
+        threads = {thread.ident: thread.name for thread in threading.enumerate()}
+        for name, category, start_ns, end_ns, ident, args in self.events:
+            if ident not in thread_ids:
+                thread_ids[ident] = len(thread_ids) + 1
+                trace_events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": thread_ids[ident], "args": {"name": threads.get(ident, str(ident))}})
+            event = {"name": name, "cat": category, "ph": "X", "pid": 1, "tid": thread_ids[ident],
+                     "ts": (start_ns - self.start_ns) / 1000, "dur": (end_ns - start_ns) / 1000}
+            if args:
+                event["args"] = args
+            trace_events.append(event)
+        totals = {name: {"calls": calls, "ms": round(total_ns / 1e6, 3)} for name, (calls, total_ns) in sorted(self.call_totals.items(), key = lambda item: -item[1][1])}
+        return {"traceEvents": trace_events, "displayTimeUnit": "ms",
+                "metadata": {"call totals": totals, "call events dropped": self.dropped_calls}}
+
+    def save(self, folder, file_name: str, max_bytes: int = 100000000):
+        "writes the trace to folder/file_name.json and deletes the oldest traces until the folder holds at most max_bytes, returns the path"
+        folder = pathlib.Path(folder)
+        folder.mkdir(parents = True, exist_ok = True)
+        path = folder/f"{file_name}.json"
+        with open(path, mode = "w", encoding = "utf-8") as trace_file:
+            json.dump(self.chrome_trace(), trace_file, separators = (",", ":"), default = str)
+        prune(folder, max_bytes, keep = path)
+        return path
+
+def prune(folder, max_bytes: int, keep = None):
+    "deletes the oldest .json files in folder until it holds at most max_bytes, never keep"
+    files = sorted(((file.stat().st_mtime, file.stat().st_size, file) for file in pathlib.Path(folder).glob("*.json")), reverse = True)
+    total = 0
+    for _, size, file in files:
+        total += size
+        if total > max_bytes and file != keep:
+            try:
+                file.unlink()
+            except OSError:  # open in a viewer or still syncing, try again next unit
+                pass
+
+ACTIVE: Timeline = None  # timeline of the unit being tested, None when nothing is recorded
+
+def span(name: str, category: str, args: dict = None):
+    "span on the active timeline, does nothing when there isn't one"
+    if ACTIVE is None:
+        return _NULL_SPAN
+    return ACTIVE.span(name, category, args)
+
+def record(name: str, category: str, start_ns: int, end_ns: int):
+    "adds a call timed elsewhere to the active timeline, does nothing when there isn't one"
+    timeline = ACTIVE
+    if timeline is not None:
+        timeline.add(name, category, start_ns, end_ns)
+
+def sleep(seconds: float):
+    "time.sleep that is recorded on the active timeline"
+    start_ns = time.perf_counter_ns()
+    time.sleep(seconds)
+    record("sleep", "sleep", start_ns, time.perf_counter_ns())
+
+def start(timeline: Timeline):
+    "makes timeline the active one"
+    global ACTIVE
+    ACTIVE = timeline
+    return timeline
+
+def stop():
+    "stops recording and returns the timeline that was active"
+    global ACTIVE
+    timeline = ACTIVE
+    ACTIVE = None
+    return timeline
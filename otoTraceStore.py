@@ -0,0 +1,124 @@
+import collections
+import datetime
+import json
+import pathlib
+import sqlite3
+import zlib
+import numpy as np
+
+# one fixed width little-endian record per sensor packet, fields a step doesn't record are 0
+RECORD_DTYPE = np.dtype([("time_ms", "<u4"), ("pressure_adc", "<i4"), ("valve_position_centideg", "<i4"), ("nozzle_position_centideg", "<i4"),
+                         ("nozzle_speed_centideg_per_sec", "<i4"), ("pump_current_mA", "<f4")])
+
+class TraceStore:
+    '''
+    Append-only binary store of raw sensor traces, replacing one CSV file per step per run. Records are appended to the
+    open segment file (segment_00001.bin, ...) and a small SQLite index keeps (unit, step, run, segment, offset, count)
+    and the step's info list. Once a segment reaches segment_size bytes it is sealed: compressed with zlib to .binz and
+    the raw file removed.
+
+    Reads of the open segment are memory-mapped straight into NumPy. A sealed segment is decompressed into memory, the
+    last CACHED_SEGMENTS of them are kept so reading several traces of one segment decompresses it once.
+
+    to call this,
+    store = TraceStore(pathlib.Path(logFileDirectory)/"Traces")
+    store.append(device_id = "oto1234567", step = "Zero P", records = {"time_ms": times, "pressure_adc": pressures}, info = ["Mean: 1702005", ...])
+    for trace in store.find(device_id = "oto1234567", step = "Zero P"):
+        data = store.read(trace["id"])  # data["pressure_adc"] ...
+    '''
+    CACHED_SEGMENTS = 2  # decompressed sealed segments kept in memory, up to segment_size bytes each
+
+    def __init__(self, root, segment_size: int = 64 * 1024 * 1024):
+        self.root = pathlib.Path(root)
+        self.segment_size = segment_size
+        self.segment_cache = collections.OrderedDict()  # sealed segment -> decompressed bytes, least recently read first
+        self.root.mkdir(parents = True, exist_ok = True)
+        self.connection = sqlite3.connect(str(self.root/"trace_index.db"), timeout = 10)
+        self.connection.execute("PRAGMA journal_mode = DELETE")  # the log folder can be a synced or network folder where WAL isn't safe, also undoes WAL on an older index
+        with self.connection:
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS traces (id INTEGER PRIMARY KEY, device_id TEXT, step TEXT, run TEXT, segment INTEGER,
+                                       offset INTEGER, count INTEGER, info TEXT)""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS traces_unit_step ON traces (device_id, step)")
+            self.connection.execute("CREATE TABLE IF NOT EXISTS segments (segment INTEGER PRIMARY KEY, sealed INTEGER)")
+        open_segment = self.connection.execute("SELECT MAX(segment) FROM segments WHERE sealed = 0").fetchone()[0]
+        if open_segment is None:
+            open_segment = (self.connection.execute("SELECT MAX(segment) FROM segments").fetchone()[0] or 0) + 1
+            with self.connection:
+                self.connection.execute("INSERT INTO segments (segment, sealed) VALUES (?, 0)", (open_segment,))
+        self.open_segment: int = open_segment
+
+    def segment_path(self, segment: int, sealed: bool = False):
+        return self.root/(f"segment_{segment:05d}.binz" if sealed else f"segment_{segment:05d}.bin")
+
+    def append(self, device_id: str, step: str, records: dict, info: list = None, run: str = None):
+        "appends one trace, records maps RECORD_DTYPE field names to equal length sequences, returns the trace id"
+        count = len(next(iter(records.values()))) if records else 0
+        data = np.zeros(count, dtype = RECORD_DTYPE)
+        for field, values in records.items():
+            data[field] = values
+        path = self.segment_path(self.open_segment)
+        with open(path, mode = "ab") as segment_file:
+            offset = segment_file.tell() // RECORD_DTYPE.itemsize
+            segment_file.write(data.tobytes())
+            size = segment_file.tell()
+        if run is None:
+            run = str(datetime.datetime.now())
+        with self.connection:
+            trace_id = self.connection.execute("INSERT INTO traces (device_id, step, run, segment, offset, count, info) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                                               (device_id, step, run, self.open_segment, offset, count, json.dumps(info))).lastrowid
+        if size >= self.segment_size:
+            self.seal()
+        return trace_id
+
+    def seal(self):
+        "compresses the open segment and starts a new one"
+        path = self.segment_path(self.open_segment)
+        if path.exists():
+            self.segment_path(self.open_segment, sealed = True).write_bytes(zlib.compress(path.read_bytes(), 6))
+        with self.connection:
+            self.connection.execute("UPDATE segments SET sealed = 1 WHERE segment = ?", (self.open_segment,))
+            self.open_segment += 1
+            self.connection.execute("INSERT INTO segments (segment, sealed) VALUES (?, 0)", (self.open_segment,))
+        if path.exists():
+            path.unlink()
+
+    def find(self, device_id: str = None, step: str = None):
+        "index entries of the matching traces, oldest first"
+        conditions = []
+        parameters = []
+        if device_id is not None:
+            conditions.append("device_id = ?")
+            parameters.append(device_id)
+        if step is not None:
+            conditions.append("step = ?")
+            parameters.append(step)
+        query = "SELECT id, device_id, step, run, segment, offset, count, info FROM traces"
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        cursor = self.connection.execute(query + " ORDER BY id", parameters)
+        names = [description[0] for description in cursor.description]
+        return [dict(zip(names, row), info = json.loads(row[-1])) for row in cursor]
+
+    def read(self, trace_id: int):
+        "the records of one trace as a read only structured array, memory-mapped from the open segment or a view of a decompressed sealed one"
+        segment, offset, count = self.connection.execute("SELECT segment, offset, count FROM traces WHERE id = ?", (trace_id,)).fetchone()
+        if count == 0:
+            return np.zeros(0, dtype = RECORD_DTYPE)
+        path = self.segment_path(segment)
+        if path.exists():
+            return np.memmap(path, dtype = RECORD_DTYPE, mode = "r", offset = offset * RECORD_DTYPE.itemsize, shape = (count,))
+        return np.frombuffer(self.sealed_segment(segment), dtype = RECORD_DTYPE, count = count, offset = offset * RECORD_DTYPE.itemsize)
+
+    def sealed_segment(self, segment: int):
+        "decompressed bytes of a sealed segment, from the in-memory cache when it was read recently"
+        if segment in self.segment_cache:
+            self.segment_cache.move_to_end(segment)
+        else:
+            self.segment_cache[segment] = zlib.decompress(self.segment_path(segment, sealed = True).read_bytes())
+            while len(self.segment_cache) > self.CACHED_SEGMENTS:
+                self.segment_cache.popitem(last = False)
+        return self.segment_cache[segment]
+
+    def close(self):
+        self.segment_cache.clear()
+        self.connection.close()